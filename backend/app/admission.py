@@ -0,0 +1,89 @@
+# app/admission.py
+"""
+Admission control por etapa (DB, LLM, embeddings).
+
+Cada etapa tiene un límite de operaciones en vuelo y un deadline de espera
+en cola. Si no se consigue lugar a tiempo (o la cola ya está llena) se lanza
+`Shed` y el llamador degrada: sin LLM → sólo regex; sin DB/embeddings →
+respuesta "estamos procesando" y 503 para que la Cloud API reintente.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class Shed(Exception):
+    """La etapa está saturada: el request se descarta o degrada."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"etapa '{stage}' saturada")
+        self.stage = stage
+
+
+class Stage:
+    def __init__(self, name: str, limit: int, queue_timeout_s: float, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout_s = queue_timeout_s
+        self.max_queue = max_queue
+        self._sem = asyncio.Semaphore(limit)
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            self.shed += 1
+            raise Shed(self.name)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise Shed(self.name) from None
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._sem.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+db = Stage("db", settings.ADMISSION_DB_LIMIT, settings.ADMISSION_DB_QUEUE_TIMEOUT_S, settings.ADMISSION_MAX_QUEUE)
+llm = Stage("llm", settings.ADMISSION_LLM_LIMIT, settings.ADMISSION_LLM_QUEUE_TIMEOUT_S, settings.ADMISSION_MAX_QUEUE)
+embedding = Stage(
+    "embedding", settings.ADMISSION_EMBEDDING_LIMIT, settings.ADMISSION_EMBEDDING_QUEUE_TIMEOUT_S,
+    settings.ADMISSION_MAX_QUEUE,
+)
+STAGES = (db, llm, embedding)
+
+# Contadores de degradación (requests que siguieron por un camino más barato)
+degraded: Counter[str] = Counter()
+
+
+def snapshot() -> dict:
+    return {
+        "stages": {s.name: s.snapshot() for s in STAGES},
+        "degraded": dict(degraded),
+    }
@@ -0,0 +1,394 @@
+# app/agenda.py
+"""
+Feed de agenda por profesional (JSON e iCalendar) con caché y GET condicional.
+
+- `profesionales.bookings_version` se incrementa por trigger en cada cambio de
+  `bookings` del profesional; el mismo trigger registra en `booking_changes`
+  la última versión de cada booking (tombstone si se borró).
+- El feed también muestra el nombre del servicio y del cliente: renombrarlos
+  (o cambiar la duración del servicio) sube la versión de cada profesional con
+  bookings afectados, los registra en `booking_changes` y avisa por
+  `agenda_changed`, así no queda un 304 sirviendo el nombre viejo.
+- El render se cachea por proceso, por (profesional, formato, rango). Los
+  NOTIFY de `bookings_changed` (app.pg_events) invalidan las entradas del
+  profesional, así que un poll con If-None-Match que coincide con la entrada
+  cacheada responde 304 sin tocar la DB.
+- Sin entrada en caché basta leer la versión (una fila) para responder 304.
+- `?since=<version>` devuelve sólo lo que cambió desde esa versión.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.models import Booking, BookingChange, BookingStatus, Cliente, Profesional, Servicio
+
+settings = get_settings()
+logger = logging.getLogger("agenda")
+
+FORMATS = {"json": "application/json", "ics": "text/calendar; charset=utf-8"}
+
+CHANGE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_agenda_change() RETURNS trigger AS $$
+DECLARE
+    v integer;
+BEGIN
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.profesional_id IS DISTINCT FROM OLD.profesional_id) THEN
+        UPDATE profesionales SET bookings_version = bookings_version + 1
+         WHERE id = OLD.profesional_id RETURNING bookings_version INTO v;
+        IF v IS NOT NULL THEN
+            INSERT INTO booking_changes (profesional_id, booking_id, version, deleted)
+            VALUES (OLD.profesional_id, OLD.id, v, true)
+            ON CONFLICT (profesional_id, booking_id) DO UPDATE SET version = EXCLUDED.version, deleted = true;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE profesionales SET bookings_version = bookings_version + 1
+         WHERE id = NEW.profesional_id RETURNING bookings_version INTO v;
+        IF v IS NOT NULL THEN
+            INSERT INTO booking_changes (profesional_id, booking_id, version, deleted)
+            VALUES (NEW.profesional_id, NEW.id, v, false)
+            ON CONFLICT (profesional_id, booking_id) DO UPDATE SET version = EXCLUDED.version, deleted = false;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# TG_ARGV[0]: columna de bookings que apunta a la fila cambiada (servicio_id / cliente_id)
+LABEL_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_agenda_label_change() RETURNS trigger AS $$
+DECLARE
+    p integer;
+    v integer;
+BEGIN
+    FOR p IN EXECUTE format('SELECT DISTINCT profesional_id FROM bookings WHERE %I = $1', TG_ARGV[0])
+             USING NEW.id LOOP
+        UPDATE profesionales SET bookings_version = bookings_version + 1
+         WHERE id = p RETURNING bookings_version INTO v;
+        CONTINUE WHEN v IS NULL;
+        EXECUTE format(
+            'INSERT INTO booking_changes (profesional_id, booking_id, version, deleted) '
+            'SELECT profesional_id, id, $2, false FROM bookings WHERE %I = $1 AND profesional_id = $3 '
+            'ON CONFLICT (profesional_id, booking_id) DO UPDATE SET version = EXCLUDED.version, deleted = false',
+            TG_ARGV[0]) USING NEW.id, v, p;
+        PERFORM pg_notify('agenda_changed', json_build_object('profesional_id', p)::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# (tabla, columna de bookings que la referencia, columnas que se ven en el feed)
+LABEL_TARGETS = (
+    ("servicios", "servicio_id", ("nombre", "duracion_min")),
+    ("clientes", "cliente_id", ("nombre",)),
+)
+
+
+async def install(conn) -> None:
+    """Columna de versión + triggers sobre bookings, servicios y clientes (idempotente, se llama desde init_db)."""
+    await conn.execute(text(
+        "ALTER TABLE profesionales ADD COLUMN IF NOT EXISTS bookings_version integer NOT NULL DEFAULT 0"
+    ))
+    await conn.execute(text(CHANGE_FUNCTION_SQL))
+    await conn.execute(text("DROP TRIGGER IF EXISTS trg_bookings_agenda ON bookings"))
+    await conn.execute(text(
+        "CREATE TRIGGER trg_bookings_agenda AFTER INSERT OR UPDATE OR DELETE ON bookings "
+        "FOR EACH ROW EXECUTE FUNCTION vallebot_agenda_change()"
+    ))
+    await conn.execute(text(LABEL_FUNCTION_SQL))
+    for table, ref, cols in LABEL_TARGETS:
+        name = f"trg_{table}_agenda"
+        old = ", ".join(f"OLD.{c}" for c in cols)
+        new = ", ".join(f"NEW.{c}" for c in cols)
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        await conn.execute(text(
+            f"CREATE TRIGGER {name} AFTER UPDATE OF {', '.join(cols)} ON {table} "
+            f"FOR EACH ROW WHEN (({old}) IS DISTINCT FROM ({new})) "
+            f"EXECUTE FUNCTION vallebot_agenda_label_change('{ref}')"
+        ))
+
+
+# ---------------------------------------------------------------------------
+# Consulta y render
+# ---------------------------------------------------------------------------
+def etag_for(profesional_id: int, version: int, fmt: str, desde: date, hasta: date) -> str:
+    return f'W/"agenda-{profesional_id}-v{version}-{fmt}-{desde:%Y%m%d}-{hasta:%Y%m%d}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    bare = etag.removeprefix("W/")
+    return "*" in tags or any(t.removeprefix("W/") == bare for t in tags)
+
+
+async def current_version(session: AsyncSession, profesional_id: int) -> Optional[int]:
+    return await session.scalar(
+        select(Profesional.bookings_version).where(Profesional.id == profesional_id)
+    )
+
+
+def _booking_select():
+    return (
+        select(Booking, Servicio.nombre, Servicio.duracion_min, Cliente.nombre)
+        .join(Servicio, Servicio.id == Booking.servicio_id)
+        .outerjoin(Cliente, Cliente.id == Booking.cliente_id)
+    )
+
+
+def _item(b: Booking, servicio: str, duracion_min: int, cliente: str | None) -> dict:
+    return {
+        "id": b.id,
+        "fecha": b.fecha.isoformat(),
+        "hora": b.hora.strftime("%H:%M"),
+        "duracion_min": duracion_min,
+        "servicio_id": b.servicio_id,
+        "servicio": servicio,
+        "cliente_id": b.cliente_id,
+        "cliente": cliente,
+        "tipo": b.tipo,
+        "status": b.status.value,
+        "capacity_used": b.capacity_used,
+        "capacity_total": b.capacity_total,
+    }
+
+
+async def load_items(session: AsyncSession, profesional_id: int, desde: date, hasta: date) -> list[dict]:
+    res = await session.execute(
+        _booking_select()
+        .where(Booking.profesional_id == profesional_id, Booking.fecha.between(desde, hasta))
+        .order_by(Booking.fecha, Booking.hora, Booking.id)
+    )
+    return [_item(*row) for row in res.all()]
+
+
+def _ics_escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def _ics_fold(line: str) -> list[str]:
+    """RFC 5545: líneas de hasta 75 octetos, continuación con un espacio."""
+    out, buf = [], b""
+    for ch in line:
+        enc = ch.encode()
+        if len(buf) + len(enc) > (75 if not out else 74):
+            out.append(buf.decode())
+            buf = b""
+        buf += enc
+    out.append(buf.decode())
+    return [out[0]] + [" " + part for part in out[1:]]
+
+
+ICS_STATUS = {
+    BookingStatus.CONFIRMED.value: "CONFIRMED",
+    BookingStatus.ATTENDED.value: "CONFIRMED",
+    BookingStatus.NO_SHOW.value: "CONFIRMED",
+    BookingStatus.CANCELLED.value: "CANCELLED",
+}
+
+
+def render_ics(profesional_id: int, version: int, items: list[dict]) -> str:
+    tz = ZoneInfo(settings.SCHEDULER_TZ)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Vallebot//Agenda//ES",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:Agenda {profesional_id}",
+    ]
+    for it in items:
+        start = datetime.fromisoformat(f"{it['fecha']}T{it['hora']}").replace(tzinfo=tz).astimezone(timezone.utc)
+        end = start + timedelta(minutes=it["duracion_min"] or 0)
+        summary = it["servicio"] + (f" — {it['cliente']}" if it["cliente"] else "")
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:booking-{it['id']}@vallebot",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{start:%Y%m%dT%H%M%SZ}",
+            f"DTEND:{end:%Y%m%dT%H%M%SZ}",
+            f"SUMMARY:{_ics_escape(summary)}",
+            f"STATUS:{ICS_STATUS.get(it['status'], 'CONFIRMED')}",
+            f"SEQUENCE:{version}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(folded for line in lines for folded in _ics_fold(line)) + "\r\n"
+
+
+def render_json(profesional_id: int, version: int, desde: date, hasta: date, items: list[dict]) -> str:
+    return json.dumps(
+        {
+            "profesional_id": profesional_id,
+            "version": version,
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "bookings": items,
+        },
+        ensure_ascii=False,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Caché por proceso
+# ---------------------------------------------------------------------------
+@dataclass
+class Rendered:
+    version: int
+    etag: str
+    body: Optional[str]
+    media_type: str
+
+
+class AgendaCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, Rendered] = OrderedDict()
+        self._by_prof: dict[int, set[tuple]] = {}
+        # Generación por profesional (y global, para `clear`): un render que
+        # empezó antes de una invalidación no debe guardarse después de ella.
+        self._generations: dict[int, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, key: tuple) -> Optional[Rendered]:
+        r = self._entries.get(key)
+        if r is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return r
+
+    def generation(self, profesional_id: int) -> tuple[int, int]:
+        return self._epoch, self._generations.get(profesional_id, 0)
+
+    def put(self, key: tuple, rendered: Rendered, generation: tuple[int, int] | None = None) -> None:
+        if generation is not None and generation != self.generation(key[0]):
+            self.stale_puts += 1          # invalidado mientras se renderizaba
+            return
+        self._entries[key] = rendered
+        self._entries.move_to_end(key)
+        self._by_prof.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old, _ = self._entries.popitem(last=False)
+            self._discard_index(old)
+
+    def _discard_index(self, key: tuple) -> None:
+        keys = self._by_prof.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_prof[key[0]]
+
+    def invalidate(self, profesional_id: int) -> None:
+        for key in self._by_prof.pop(profesional_id, ()):
+            self._entries.pop(key, None)
+        self._generations[profesional_id] = self._generations.get(profesional_id, 0) + 1
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_prof.clear()
+        self._generations.clear()
+        self._epoch += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts,
+        }
+
+
+cache = AgendaCache(settings.AGENDA_CACHE_MAX_ENTRIES)
+
+
+def _on_booking_event(event: dict) -> None:
+    pid = event.get("profesional_id")
+    if pid is not None:
+        cache.invalidate(int(pid))
+
+
+def subscribe(listener) -> None:
+    """Invalida la caché con los NOTIFY de bookings; tras reconectar, la vacía (eventos perdidos)."""
+    listener.subscribe("bookings_changed", _on_booking_event)
+    listener.subscribe("agenda_changed", _on_booking_event)
+    listener.on_reconnect(cache.clear)
+
+
+async def render(
+    session: AsyncSession, profesional_id: int, fmt: str, desde: date, hasta: date,
+    if_none_match: str | None = None,
+) -> Optional[Rendered]:
+    """
+    Render cacheado; None si el profesional no existe. Si el ETag del cliente
+    coincide con la versión actual devuelve un `Rendered` sin body (→ 304).
+    """
+    key = (profesional_id, fmt, desde, hasta)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    # Primero la versión y después las filas: si entra un cambio en el medio, el
+    # render trae de más con una versión vieja y el próximo delta lo re-envía.
+    # La generación se lee antes que todo: si el NOTIFY de ese cambio invalida
+    # la caché mientras renderizamos, el resultado se devuelve pero no se guarda.
+    generation = cache.generation(profesional_id)
+    version = await current_version(session, profesional_id)
+    if version is None:
+        return None
+    etag = etag_for(profesional_id, version, fmt, desde, hasta)
+    if etag_matches(if_none_match, etag):
+        return Rendered(version, etag, None, FORMATS[fmt])
+    items = await load_items(session, profesional_id, desde, hasta)
+    body = (
+        render_ics(profesional_id, version, items) if fmt == "ics"
+        else render_json(profesional_id, version, desde, hasta, items)
+    )
+    rendered = Rendered(version, etag, body, FORMATS[fmt])
+    cache.put(key, rendered, generation)
+    return rendered
+
+
+async def delta(session: AsyncSession, profesional_id: int, since: int) -> Optional[dict]:
+    """Bookings creados/modificados y borrados desde la versión `since`."""
+    version = await current_version(session, profesional_id)
+    if version is None:
+        return None
+    out = {"profesional_id": profesional_id, "version": version, "since": since, "upserts": [], "deleted": []}
+    if since >= version:
+        return out
+    changes = (await session.execute(
+        select(BookingChange.booking_id, BookingChange.deleted)
+        .where(BookingChange.profesional_id == profesional_id, BookingChange.version > since)
+    )).all()
+    out["deleted"] = sorted(bid for bid, deleted in changes if deleted)
+    upsert_ids = [bid for bid, deleted in changes if not deleted]
+    if upsert_ids:
+        res = await session.execute(
+            _booking_select()
+            .where(Booking.profesional_id == profesional_id, Booking.id.in_(upsert_ids))
+            .order_by(Booking.fecha, Booking.hora, Booking.id)
+        )
+        out["upserts"] = [_item(*row) for row in res.all()]
+    return out
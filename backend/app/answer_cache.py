@@ -0,0 +1,247 @@
+# app/answer_cache.py
+"""
+Cache semántico de respuestas por profesional.
+
+Los clientes de un mismo profesional preguntan casi lo mismo ("¿cuánto sale?",
+"¿dónde queda?", "¿atendés a domicilio?"). Antes de ir al LLM buscamos una
+pregunta previa del mismo `profesional_id` con similitud coseno ≥ umbral y,
+si la respuesta se generó con la versión vigente de sus servicios, la
+reutilizamos.
+
+- Versión: `profesionales.servicios_version`, incrementada por un trigger en
+  cada cambio de `servicios` (precio, ubicación, horarios…). Una entrada con
+  versión vieja se descarta.
+- TTL por entrada y tope de tamaño (global y por profesional) con desalojo LRU.
+- Métricas de hit rate en /metrics (por proceso).
+
+Punto de entrada: `cached_answer(session, profesional_id, pregunta, generate)`
+(ANSWER_CACHE_ENABLED lo apaga). El webhook todavía no responde preguntas de
+clientes; ese flujo tiene que pasar por acá en vez de llamar al LLM directo.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from itertools import count
+from typing import Awaitable, Callable, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import admission
+from app.config import get_settings
+from app.models import Profesional
+
+settings = get_settings()
+
+# Columnas de `servicios` que cambian lo que el bot respondería (no el embedding)
+VERSIONED_COLUMNS = (
+    "profesional_id", "nombre", "tipo", "duracion_min", "capacidad", "precio",
+    "cancellation_limit_min", "ubicacion_text", "activo", "recurrence",
+)
+
+VERSION_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_bump_servicios_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE profesionales SET servicios_version = servicios_version + 1 WHERE id = OLD.profesional_id;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.profesional_id IS DISTINCT FROM OLD.profesional_id) THEN
+        UPDATE profesionales SET servicios_version = servicios_version + 1 WHERE id = NEW.profesional_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+async def install(conn) -> None:
+    """Columna de versión + trigger sobre servicios (idempotente, se llama desde init_db)."""
+    await conn.execute(text(
+        "ALTER TABLE profesionales ADD COLUMN IF NOT EXISTS servicios_version integer NOT NULL DEFAULT 0"
+    ))
+    await conn.execute(text(VERSION_FUNCTION_SQL))
+    await conn.execute(text("DROP TRIGGER IF EXISTS trg_servicios_version ON servicios"))
+    await conn.execute(text("DROP TRIGGER IF EXISTS trg_servicios_version_upd ON servicios"))
+    await conn.execute(text(
+        "CREATE TRIGGER trg_servicios_version AFTER INSERT OR DELETE ON servicios "
+        "FOR EACH ROW EXECUTE FUNCTION vallebot_bump_servicios_version()"
+    ))
+    # UPDATE OF dispara aunque el valor no cambie (p.ej. el upsert de la importación):
+    # sólo cuenta si alguna columna versionada cambió de verdad
+    cols = ", ".join(VERSIONED_COLUMNS)
+    old = ", ".join(f"OLD.{c}" for c in VERSIONED_COLUMNS)
+    new = ", ".join(f"NEW.{c}" for c in VERSIONED_COLUMNS)
+    await conn.execute(text(
+        f"CREATE TRIGGER trg_servicios_version_upd AFTER UPDATE OF {cols} ON servicios "
+        f"FOR EACH ROW WHEN (({old}) IS DISTINCT FROM ({new})) "
+        f"EXECUTE FUNCTION vallebot_bump_servicios_version()"
+    ))
+
+
+async def servicios_version(session: AsyncSession, profesional_id: int) -> int:
+    return await session.scalar(
+        select(Profesional.servicios_version).where(Profesional.id == profesional_id)
+    ) or 0
+
+
+@dataclass
+class _Entry:
+    profesional_id: int
+    question: str
+    vec: np.ndarray
+    answer: str
+    version: int
+    expires_at: float
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    question: str
+    similarity: float
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        *,
+        threshold: float = 0.92,
+        ttl_s: float = 86_400.0,
+        max_entries: int = 10_000,
+        max_per_profesional: int = 500,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_per_profesional = max_per_profesional
+        self._clock = clock
+        self._ids = count()
+        self._lru: OrderedDict[int, _Entry] = OrderedDict()          # global, más viejo primero
+        self._by_prof: dict[int, OrderedDict[int, None]] = {}        # profesional_id → ids (LRU)
+        self._matrix: dict[int, tuple[list[int], np.ndarray]] = {}   # cache de la matriz por profesional
+        self.stats: Counter[str] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def _normalize(vec: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def _remove(self, entry_id: int, reason: str) -> None:
+        entry = self._lru.pop(entry_id)
+        ids = self._by_prof[entry.profesional_id]
+        del ids[entry_id]
+        if not ids:
+            del self._by_prof[entry.profesional_id]
+        self._matrix.pop(entry.profesional_id, None)
+        self.stats[reason] += 1
+
+    def invalidate(self, profesional_id: int) -> None:
+        for entry_id in list(self._by_prof.get(profesional_id, ())):
+            self._remove(entry_id, "invalidated")
+
+    def get(self, profesional_id: int, vec: Sequence[float], version: int) -> Optional[CacheHit]:
+        ids = self._by_prof.get(profesional_id)
+        if ids:
+            now = self._clock()
+            for entry_id in list(ids):
+                e = self._lru[entry_id]
+                if e.version != version:
+                    self._remove(entry_id, "stale")
+                elif e.expires_at <= now:
+                    self._remove(entry_id, "expired")
+        if not self._by_prof.get(profesional_id):
+            self.stats["misses"] += 1
+            return None
+
+        cached = self._matrix.get(profesional_id)
+        if cached is None:
+            order = list(self._by_prof[profesional_id])
+            cached = self._matrix[profesional_id] = (order, np.stack([self._lru[i].vec for i in order]))
+        order, matrix = cached
+        sims = matrix @ self._normalize(vec)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+
+        entry_id = order[best]
+        self._lru.move_to_end(entry_id)
+        self._by_prof[profesional_id].move_to_end(entry_id)
+        self.stats["hits"] += 1
+        e = self._lru[entry_id]
+        return CacheHit(answer=e.answer, question=e.question, similarity=float(sims[best]))
+
+    def put(self, profesional_id: int, question: str, vec: Sequence[float], answer: str, version: int) -> None:
+        entry_id = next(self._ids)
+        self._lru[entry_id] = _Entry(
+            profesional_id=profesional_id,
+            question=question,
+            vec=self._normalize(vec),
+            answer=answer,
+            version=version,
+            expires_at=self._clock() + self.ttl_s,
+        )
+        self._by_prof.setdefault(profesional_id, OrderedDict())[entry_id] = None
+        self._matrix.pop(profesional_id, None)
+        self.stats["stores"] += 1
+
+        ids = self._by_prof[profesional_id]
+        while len(ids) > self.max_per_profesional:
+            self._remove(next(iter(ids)), "evicted")
+        while len(self._lru) > self.max_entries:
+            self._remove(next(iter(self._lru)), "evicted")
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._lru),
+            "profesionales": len(self._by_prof),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            **dict(self.stats),
+        }
+
+
+cache = AnswerCache(
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    ttl_s=settings.ANSWER_CACHE_TTL_S,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    max_per_profesional=settings.ANSWER_CACHE_MAX_PER_PROF,
+)
+
+
+async def cached_answer(
+    session: AsyncSession,
+    profesional_id: int,
+    question: str,
+    generate: Callable[[], Awaitable[str]],
+    *,
+    embedding: Sequence[float] | None = None,
+) -> tuple[str, bool]:
+    """
+    Devuelve (respuesta, hit). En un miss llama a `generate()` (el LLM) y guarda
+    la respuesta con la versión de servicios leída *antes* de generarla, así
+    un cambio concurrente la deja obsoleta en vez de consagrarla.
+    """
+    if not settings.ANSWER_CACHE_ENABLED:
+        return await generate(), False
+    if embedding is None:
+        from app.embedding_service import embed_text
+        async with admission.embedding.admit():
+            embedding = await asyncio.to_thread(embed_text, question)
+    version = await servicios_version(session, profesional_id)
+    hit = cache.get(profesional_id, embedding, version)
+    if hit is not None:
+        return hit.answer, True
+    answer = await generate()
+    if answer:
+        cache.put(profesional_id, question, embedding, answer, version)
+    return answer, False
@@ -0,0 +1,287 @@
+# app/billing.py
+"""
+Estado de cobros: agregados por profesional / cliente / mes.
+
+`billing_monthly` se mantiene incrementalmente con triggers AFTER sobre
+`payments` y `bookings`: cada transición aplica el delta (-OLD +NEW), así
+que los endpoints de saldo leen un puñado de filas en vez de sumar historial.
+
+    paid_amount        payments VERIFIED
+    pending_amount     payments PENDING
+    rejected_amount    payments REJECTED
+    sessions_attended  bookings ATTENDED (turnos individuales, con cliente_id)
+
+El mes de un pago es el de `created_at`; el de una sesión, el de `fecha`.
+
+La reconciliación recalcula desde cero por profesional y corrige el drift
+(escrituras con triggers deshabilitados, restores parciales, la primera
+carga en una base existente):
+
+    python -m app.billing reconcile [--profesional-id 42]
+
+Para no pisar incrementos concurrentes, los triggers toman un advisory lock
+compartido por profesional y la reconciliación uno exclusivo.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+from datetime import date
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import BillingMonthly, Profesional
+
+logger = logging.getLogger("billing")
+
+# Primer argumento de pg_advisory_xact_lock(int, int); el segundo es profesional_id
+LOCK_CLASS = 0x62696C6C  # "bill"
+
+AMOUNT_COLUMNS = ("paid_amount", "pending_amount", "rejected_amount")
+
+_APPLY_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION vallebot_billing_apply(
+    p_prof integer, p_cli integer, p_month date,
+    d_paid double precision, d_pending double precision, d_rejected double precision, d_attended integer
+) RETURNS void AS $$
+BEGIN
+    IF p_prof IS NULL OR p_cli IS NULL
+       OR (d_paid = 0 AND d_pending = 0 AND d_rejected = 0 AND d_attended = 0) THEN
+        RETURN;
+    END IF;
+    PERFORM pg_advisory_xact_lock_shared({LOCK_CLASS}, p_prof);
+    INSERT INTO billing_monthly AS b
+        (profesional_id, cliente_id, month, paid_amount, pending_amount, rejected_amount, sessions_attended, updated_at)
+    VALUES (p_prof, p_cli, p_month, d_paid, d_pending, d_rejected, d_attended, now())
+    ON CONFLICT (profesional_id, cliente_id, month) DO UPDATE SET
+        paid_amount       = b.paid_amount + EXCLUDED.paid_amount,
+        pending_amount    = b.pending_amount + EXCLUDED.pending_amount,
+        rejected_amount   = b.rejected_amount + EXCLUDED.rejected_amount,
+        sessions_attended = b.sessions_attended + EXCLUDED.sessions_attended,
+        updated_at        = now();
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_PAYMENTS_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_billing_payments() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM vallebot_billing_apply(
+            OLD.profesional_id, OLD.cliente_id, date_trunc('month', OLD.created_at)::date,
+            CASE WHEN OLD.status = 'VERIFIED' THEN -OLD.amount ELSE 0 END,
+            CASE WHEN OLD.status = 'PENDING'  THEN -OLD.amount ELSE 0 END,
+            CASE WHEN OLD.status = 'REJECTED' THEN -OLD.amount ELSE 0 END,
+            0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM vallebot_billing_apply(
+            NEW.profesional_id, NEW.cliente_id, date_trunc('month', NEW.created_at)::date,
+            CASE WHEN NEW.status = 'VERIFIED' THEN NEW.amount ELSE 0 END,
+            CASE WHEN NEW.status = 'PENDING'  THEN NEW.amount ELSE 0 END,
+            CASE WHEN NEW.status = 'REJECTED' THEN NEW.amount ELSE 0 END,
+            0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+_BOOKINGS_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_billing_bookings() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'ATTENDED' THEN
+        PERFORM vallebot_billing_apply(
+            OLD.profesional_id, OLD.cliente_id, date_trunc('month', OLD.fecha)::date, 0, 0, 0, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'ATTENDED' THEN
+        PERFORM vallebot_billing_apply(
+            NEW.profesional_id, NEW.cliente_id, date_trunc('month', NEW.fecha)::date, 0, 0, 0, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# (tabla, función, columnas cuyo UPDATE afecta el agregado)
+TRIGGER_TARGETS = (
+    ("payments", "vallebot_billing_payments", "status, amount, profesional_id, cliente_id, created_at"),
+    ("bookings", "vallebot_billing_bookings", "status, profesional_id, cliente_id, fecha"),
+)
+
+_TRUTH_SQL = """
+SELECT profesional_id, cliente_id, month,
+       sum(paid) AS paid_amount, sum(pending) AS pending_amount, sum(rejected) AS rejected_amount,
+       sum(attended)::int AS sessions_attended
+  FROM (
+        SELECT profesional_id, cliente_id, date_trunc('month', created_at)::date AS month,
+               CASE WHEN status = 'VERIFIED' THEN amount ELSE 0 END AS paid,
+               CASE WHEN status = 'PENDING'  THEN amount ELSE 0 END AS pending,
+               CASE WHEN status = 'REJECTED' THEN amount ELSE 0 END AS rejected,
+               0 AS attended
+          FROM payments
+         WHERE profesional_id = :pid
+        UNION ALL
+        SELECT profesional_id, cliente_id, date_trunc('month', fecha)::date,
+               0::float8, 0::float8, 0::float8, 1
+          FROM bookings
+         WHERE profesional_id = :pid AND cliente_id IS NOT NULL AND status = 'ATTENDED'
+       ) t
+ GROUP BY profesional_id, cliente_id, month
+"""
+
+_RECONCILE_UPSERT_SQL = f"""
+INSERT INTO billing_monthly AS b
+    (profesional_id, cliente_id, month, paid_amount, pending_amount, rejected_amount, sessions_attended, updated_at)
+SELECT profesional_id, cliente_id, month, paid_amount, pending_amount, rejected_amount, sessions_attended, now()
+  FROM ({_TRUTH_SQL}) truth
+ON CONFLICT (profesional_id, cliente_id, month) DO UPDATE SET
+    paid_amount       = EXCLUDED.paid_amount,
+    pending_amount    = EXCLUDED.pending_amount,
+    rejected_amount   = EXCLUDED.rejected_amount,
+    sessions_attended = EXCLUDED.sessions_attended,
+    updated_at        = now()
+WHERE (round(b.paid_amount::numeric, 2), round(b.pending_amount::numeric, 2),
+       round(b.rejected_amount::numeric, 2), b.sessions_attended)
+      IS DISTINCT FROM
+      (round(EXCLUDED.paid_amount::numeric, 2), round(EXCLUDED.pending_amount::numeric, 2),
+       round(EXCLUDED.rejected_amount::numeric, 2), EXCLUDED.sessions_attended)
+RETURNING b.id
+"""
+
+_RECONCILE_DELETE_SQL = f"""
+DELETE FROM billing_monthly
+ WHERE profesional_id = :pid
+   AND (cliente_id, month) NOT IN (SELECT cliente_id, month FROM ({_TRUTH_SQL}) truth)
+RETURNING id
+"""
+
+
+async def install(conn) -> None:
+    """Funciones y triggers de mantenimiento (idempotente, se llama desde init_db)."""
+    for sql in (_APPLY_FUNCTION_SQL, _PAYMENTS_FUNCTION_SQL, _BOOKINGS_FUNCTION_SQL):
+        await conn.execute(text(sql))
+    for table, fn, cols in TRIGGER_TARGETS:
+        name = f"trg_{table}_billing"
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        await conn.execute(text(
+            f"CREATE TRIGGER {name} AFTER INSERT OR DELETE OR UPDATE OF {cols} ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {fn}()"
+        ))
+
+
+# ---------------------------------------------------------------------------
+# Lectura
+# ---------------------------------------------------------------------------
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _row_dict(r: BillingMonthly) -> dict:
+    return {
+        "cliente_id": r.cliente_id,
+        "mes": r.month.strftime("%Y-%m"),
+        "paid": round(r.paid_amount, 2),
+        "pending": round(r.pending_amount, 2),
+        "rejected": round(r.rejected_amount, 2),
+        "sessions_attended": r.sessions_attended,
+    }
+
+
+def _totals(rows: list[dict]) -> dict:
+    return {
+        "paid": round(sum(r["paid"] for r in rows), 2),
+        "pending": round(sum(r["pending"] for r in rows), 2),
+        "rejected": round(sum(r["rejected"] for r in rows), 2),
+        "sessions_attended": sum(r["sessions_attended"] for r in rows),
+    }
+
+
+async def month_summary(session: AsyncSession, profesional_id: int, month: date) -> dict:
+    """Cobros del mes de un profesional, una fila por cliente."""
+    res = await session.execute(
+        select(BillingMonthly)
+        .where(BillingMonthly.profesional_id == profesional_id, BillingMonthly.month == month_start(month))
+        .order_by(BillingMonthly.cliente_id)
+    )
+    rows = [_row_dict(r) for r in res.scalars()]
+    return {"mes": month.strftime("%Y-%m"), "clientes": rows, "totales": _totals(rows)}
+
+
+async def client_balance(session: AsyncSession, profesional_id: int, cliente_id: int) -> dict:
+    """Saldo de un cliente con un profesional: una fila por mes con movimiento."""
+    res = await session.execute(
+        select(BillingMonthly)
+        .where(BillingMonthly.profesional_id == profesional_id, BillingMonthly.cliente_id == cliente_id)
+        .order_by(BillingMonthly.month.desc())
+    )
+    rows = [_row_dict(r) for r in res.scalars()]
+    for r in rows:
+        del r["cliente_id"]
+    return {"cliente_id": cliente_id, "meses": rows, "totales": _totals(rows)}
+
+
+async def total_paid(session: AsyncSession, profesional_id: int, cliente_id: int) -> float:
+    return await session.scalar(
+        select(func.coalesce(func.sum(BillingMonthly.paid_amount), 0.0))
+        .where(BillingMonthly.profesional_id == profesional_id, BillingMonthly.cliente_id == cliente_id)
+    ) or 0.0
+
+
+# ---------------------------------------------------------------------------
+# Reconciliación
+# ---------------------------------------------------------------------------
+async def reconcile(session: AsyncSession, profesional_id: int) -> int:
+    """
+    Recalcula los agregados de un profesional desde payments/bookings y corrige
+    las filas que difieren. Devuelve cuántas filas tenían drift.
+    """
+    params = {"pid": profesional_id}
+    # espera a que terminen las transacciones en vuelo del profesional y frena las nuevas
+    await session.execute(select(func.pg_advisory_xact_lock(LOCK_CLASS, profesional_id)))
+    fixed = len((await session.execute(text(_RECONCILE_UPSERT_SQL), params)).all())
+    deleted = len((await session.execute(text(_RECONCILE_DELETE_SQL), params)).all())
+    await session.commit()
+    if fixed or deleted:
+        logger.warning("billing drift en profesional %s: %d filas corregidas, %d borradas",
+                       profesional_id, fixed, deleted)
+    return fixed + deleted
+
+
+async def reconcile_all(session: AsyncSession) -> dict[int, int]:
+    """Reconcilia profesional por profesional (locks cortos). Devuelve {profesional_id: filas con drift}."""
+    ids = (await session.execute(select(Profesional.id).order_by(Profesional.id))).scalars().all()
+    drift: dict[int, int] = {}
+    for pid in ids:
+        n = await reconcile(session, pid)
+        if n:
+            drift[pid] = n
+    return drift
+
+
+def main(argv: list[str] | None = None) -> None:
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Agregados de cobros")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("reconcile", help="recalcula y corrige drift")
+    p_rec.add_argument("--profesional-id", type=int)
+    args = parser.parse_args(argv)
+
+    async def _run() -> None:
+        async with SessionLocal() as session:
+            if args.profesional_id is not None:
+                drift = {args.profesional_id: await reconcile(session, args.profesional_id)}
+            else:
+                drift = await reconcile_all(session)
+        total = sum(drift.values())
+        print(f"{total} filas con drift" + (f": {drift}" if total else ""))
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
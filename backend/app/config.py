@@ -19,6 +19,70 @@ class Settings(BaseSettings):
     PGVECTOR_DISTANCE: str
     PGVECTOR_INDEX_LISTS: int
     LOG_LEVEL: str
+
+    # Importación masiva de profesionales
+    IMPORT_BATCH_SIZE: int = 500
+    IMPORT_MAX_ERRORS: int = 1000
+
+    # WhatsApp Cloud API (envíos salientes)
+    WHATSAPP_SEND_ENABLED: bool = False
+    WHATSAPP_API_BASE: str = "https://graph.facebook.com/v20.0"
+    WHATSAPP_PHONE_NUMBER_ID: str = ""
+    WHATSAPP_TOKEN: str = ""
+    WHATSAPP_MAX_MPS: float = 80.0            # throughput por número (tier por defecto)
+    WHATSAPP_PAIR_INTERVAL_S: float = 6.0     # pair rate limit: ~1 msg cada 6 s por destinatario
+    WHATSAPP_PAIR_BURST: int = 10
+    WHATSAPP_MAX_RETRIES: int = 4
+    WHATSAPP_MAX_CONNECTIONS: int = 50
+    WHATSAPP_FANOUT_CONCURRENCY: int = 20
+
+    # Scheduler de recordatorios / avisos
+    SCHEDULER_ENABLED: bool = False
+    SCHEDULER_TZ: str = "America/Argentina/Buenos_Aires"   # zona horaria de bookings.fecha/hora
+    SCHEDULER_WINDOW_MIN: int = 15                         # cuánto adelante se carga en memoria
+    SCHEDULER_CATCHUP_MAX_MIN: int = 360                   # hasta cuánto atrás se recupera tras una caída
+    SCHEDULER_REMINDER_LEAD_MIN: int = 1440                # recordatorio de turno (24 h antes)
+    SCHEDULER_CANCEL_WARN_LEAD_MIN: int = 60               # aviso antes del límite de cancelación
+    SCHEDULER_PAYMENT_NUDGE_AFTER_MIN: int = 1440          # pago PENDING sin movimiento
+    SCHEDULER_CONCURRENCY: int = 20
+
+    # Admission control del webhook (límite en vuelo / espera máxima en cola)
+    ADMISSION_DB_LIMIT: int = 15                 # = pool_size + max_overflow por defecto
+    ADMISSION_DB_QUEUE_TIMEOUT_S: float = 2.0
+    ADMISSION_LLM_LIMIT: int = 8
+    ADMISSION_LLM_QUEUE_TIMEOUT_S: float = 1.0
+    ADMISSION_EMBEDDING_LIMIT: int = 2
+    ADMISSION_EMBEDDING_QUEUE_TIMEOUT_S: float = 5.0
+    ADMISSION_MAX_QUEUE: int = 200
+    # Particionado por profesional_id de bookings/payments/messages/relationship_state
+    TENANT_PARTITIONING: bool = False
+    TENANT_HASH_PARTITIONS: int = 8
+    # Cache semántico de respuestas (por profesional)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_THRESHOLD: float = 0.92
+    ANSWER_CACHE_TTL_S: float = 86_400.0
+    ANSWER_CACHE_MAX_ENTRIES: int = 10_000
+    ANSWER_CACHE_MAX_PER_PROF: int = 500
+    # Comprobantes de pago (media entrante)
+    MEDIA_DIR: str = str(BASE_DIR / "media")
+    MEDIA_MAX_BYTES: int = 10 * 1024 * 1024
+    MEDIA_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_WORKERS: int = 4
+    MEDIA_QUEUE_SIZE: int = 100
+    # Feed de agenda (JSON / iCalendar)
+    AGENDA_DEFAULT_DAYS: int = 60
+    AGENDA_CACHE_MAX_ENTRIES: int = 2000
+    # Clases recurrentes: se materializan ocurrencias sólo dentro de este horizonte
+    RECURRENCE_HORIZON_DAYS: int = 14
+    RECURRENCE_MAX_RANGE_DAYS: int = 180
+    # Prompts: presupuesto de tokens de entrada
+    LLM_PROMPT_TOKEN_BUDGET: int = 3000
+    # Búsqueda ANN sobre resúmenes de relación (HNSW, filtrada por profesional)
+    PGVECTOR_HNSW_M: int = 16
+    PGVECTOR_HNSW_EF_CONSTRUCTION: int = 64
+    CONTEXT_SEARCH_EXACT_MAX_ROWS: int = 2000     # hasta acá, búsqueda exacta (sin índice)
+    CONTEXT_SEARCH_EF_SEARCH: int = 100
+    CONTEXT_SEARCH_MAX_SCAN_TUPLES: int = 20_000  # tope del scan iterativo (pgvector ≥ 0.8)
     model_config = SettingsConfigDict(
         env_file=BASE_DIR / ".env",
         extra="ignore",
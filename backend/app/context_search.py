@@ -0,0 +1,254 @@
+# app/context_search.py
+"""
+Búsqueda por similitud sobre los resúmenes de relación (relationship_state)
+de UN profesional: "¿qué clientes de este profesional hablaron de algo así?".
+
+El filtro por `profesional_id` es lo que complica el ANN: un índice global
+devuelve los `ef_search` vecinos más cercanos de TODOS los tenants y después
+se filtra, así que en un profesional chico casi no queda nada (recall bajo).
+Estrategia:
+
+- Tenant chico (≤ CONTEXT_SEARCH_EXACT_MAX_ROWS filas): búsqueda exacta. Se
+  leen sus filas por el índice de profesional_id y se ordena en memoria; es
+  tan rápido como el índice y el recall es 1.
+- Tenant grande: HNSW (`idx_relationship_state_summary_hnsw`) con scan
+  iterativo (pgvector ≥ 0.8, `hnsw.iterative_scan = relaxed_order`): el
+  índice sigue recorriendo el grafo hasta juntar k filas que pasen el filtro.
+  Con pgvector más viejo se sube `hnsw.ef_search` al máximo como paliativo.
+- Con TENANT_PARTITIONING el índice se crea por partición: un tenant movido a
+  su propia partición (`python -m app.partitioning move-tenant`) tiene su
+  propio grafo. Sin particionado, `index-tenant` crea un índice parcial
+  (`WHERE profesional_id = N`) para los tenants más grandes; `reembed` los
+  reconstruye sobre la columna nueva y los conmuta junto con el principal.
+
+Uso:
+    python -m app.context_search bench [--profesional-id 42] [--queries 50] [-k 10]
+    python -m app.context_search index-tenant 42
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import admission
+from app.config import get_settings
+from app.db import HNSW_INDEX_TARGETS, SessionLocal, distance_operator, engine, hnsw_using
+
+settings = get_settings()
+logger = logging.getLogger("context_search")
+
+STRATEGIES = ("auto", "exact", "ann")
+HNSW_EF_SEARCH_MAX = 1000          # tope que acepta pgvector
+ITERATIVE_SCAN_MIN_VERSION = (0, 8, 0)
+SUMMARY_INDEX = next(idx for t, c, idx in HNSW_INDEX_TARGETS if (t, c) == ("relationship_state", "summary_embedding"))
+
+_versions: dict[str, tuple[int, ...]] = {}
+
+
+@dataclass
+class ContextSearchResult:
+    strategy: str                      # exact | ann
+    results: list[dict] = field(default_factory=list)
+
+
+def version_tuple(v: str) -> tuple[int, ...]:
+    return tuple(int(p) for p in v.split(".") if p.isdigit())
+
+
+def choose_strategy(tenant_rows: int, requested: str = "auto") -> str:
+    if requested not in STRATEGIES:
+        raise ValueError(f"strategy inválida: {requested}")
+    if requested != "auto":
+        return requested
+    return "exact" if tenant_rows <= settings.CONTEXT_SEARCH_EXACT_MAX_ROWS else "ann"
+
+
+def ann_settings(pgvector_version: tuple[int, ...], k: int) -> dict[str, str]:
+    """GUCs (locales a la transacción) para el scan HNSW filtrado."""
+    ef = max(settings.CONTEXT_SEARCH_EF_SEARCH, k)
+    if pgvector_version >= ITERATIVE_SCAN_MIN_VERSION:
+        return {
+            "hnsw.ef_search": str(min(ef, HNSW_EF_SEARCH_MAX)),
+            "hnsw.iterative_scan": "relaxed_order",
+            "hnsw.max_scan_tuples": str(settings.CONTEXT_SEARCH_MAX_SCAN_TUPLES),
+        }
+    # sin scan iterativo el filtro se aplica sobre ef_search candidatos: cuantos más, mejor
+    return {"hnsw.ef_search": str(HNSW_EF_SEARCH_MAX)}
+
+
+def recall_at_k(approx: Sequence[int], exact: Sequence[int]) -> float:
+    if not exact:
+        return 1.0
+    return len(set(approx) & set(exact)) / len(exact)
+
+
+def vector_literal(vec: Sequence[float]) -> str:
+    return "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
+
+
+async def pgvector_version(session: AsyncSession) -> tuple[int, ...]:
+    if "vector" not in _versions:
+        v = await session.scalar(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+        _versions["vector"] = version_tuple(v or "0")
+    return _versions["vector"]
+
+
+async def tenant_rows(session: AsyncSession, profesional_id: int, limit: int | None = None) -> int:
+    """Filas del profesional, contando como mucho `limit` + 1 (sólo importa si supera el umbral)."""
+    limit = settings.CONTEXT_SEARCH_EXACT_MAX_ROWS if limit is None else limit
+    return await session.scalar(text(
+        "SELECT count(*) FROM (SELECT 1 FROM relationship_state WHERE profesional_id = :pid LIMIT :lim) s"
+    ), {"pid": profesional_id, "lim": limit + 1})
+
+
+def _sql(profesional_id: int, strategy: str) -> str:
+    # profesional_id va como literal (es int): así el planner puede probar el
+    # predicado de un índice parcial y podar particiones en cualquier plan
+    pid = int(profesional_id)
+    cand = f"""
+        SELECT id, cliente_id, summary_text,
+               summary_embedding {distance_operator()} CAST(:qvec AS vector) AS distancia
+          FROM relationship_state
+         WHERE profesional_id = {pid}"""
+    if strategy == "exact":
+        # MATERIALIZED: la distancia se calcula fila a fila, nunca vía el índice ANN
+        return f"WITH c AS MATERIALIZED ({cand}) SELECT * FROM c ORDER BY distancia, id LIMIT :k"
+    # relaxed_order puede devolver los k algo desordenados: se reordena afuera
+    return f"WITH c AS MATERIALIZED ({cand} ORDER BY distancia LIMIT :k) SELECT * FROM c ORDER BY distancia, id"
+
+
+async def search(
+    session: AsyncSession,
+    profesional_id: int,
+    query_vec: Sequence[float],
+    k: int = 5,
+    *,
+    strategy: str = "auto",
+) -> ContextSearchResult:
+    """Los k resúmenes de relación del profesional más cercanos a `query_vec`."""
+    rows = await tenant_rows(session, profesional_id) if strategy == "auto" else 0
+    chosen = choose_strategy(rows, strategy)
+    if chosen == "ann":
+        for name, value in ann_settings(await pgvector_version(session), k).items():
+            await session.execute(text("SELECT set_config(:n, :v, true)"), {"n": name, "v": value})
+    res = await session.execute(
+        text(_sql(profesional_id, chosen)), {"qvec": vector_literal(query_vec), "k": k}
+    )
+    return ContextSearchResult(chosen, [dict(r) for r in res.mappings()])
+
+
+async def search_text(session: AsyncSession, profesional_id: int, query: str, k: int = 5) -> ContextSearchResult:
+    """Embebe la consulta pasando por la etapa de embeddings (puede lanzar `Shed`)."""
+    from app.embedding_service import embed_text
+    async with admission.embedding.admit():
+        vec = await asyncio.to_thread(embed_text, query)
+    return await search(session, profesional_id, vec, k)
+
+
+# ---------------------------------------------------------------------------
+# CLI: benchmark contra fuerza bruta + índice parcial por tenant
+# ---------------------------------------------------------------------------
+def _percentile(values: Sequence[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def _bench_tenant(profesional_id: int, n_queries: int, k: int, noise: float) -> dict:
+    async with SessionLocal() as session:
+        rows = await tenant_rows(session, profesional_id, limit=10**9)
+        res = await session.execute(text(
+            "SELECT summary_embedding::text FROM relationship_state "
+            "WHERE profesional_id = :pid ORDER BY random() LIMIT :n"
+        ), {"pid": profesional_id, "n": n_queries})
+        samples = [np.asarray(json.loads(v), dtype=np.float32) for (v,) in res.all()]
+
+    rng = np.random.default_rng(0)
+    latency: dict[str, list[float]] = {"exact": [], "ann": []}
+    recalls: list[float] = []
+    for base in samples:
+        # consulta "cercana pero no idéntica" a un resumen existente
+        q = base + rng.normal(0.0, noise, base.shape).astype(np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        ids: dict[str, list[int]] = {}
+        for strategy in ("exact", "ann"):
+            async with SessionLocal() as session:      # transacción nueva: set_config es local
+                t0 = time.perf_counter()
+                found = await search(session, profesional_id, q.tolist(), k, strategy=strategy)
+                latency[strategy].append((time.perf_counter() - t0) * 1000)
+                ids[strategy] = [r["id"] for r in found.results]
+        recalls.append(recall_at_k(ids["ann"], ids["exact"]))
+
+    return {
+        "profesional_id": profesional_id,
+        "rows": rows,
+        "queries": len(samples),
+        "auto": choose_strategy(rows),
+        **{
+            f"{s}_ms_p{q}": round(_percentile(latency[s], q), 2)
+            for s in ("exact", "ann") for q in (50, 95)
+        },
+        f"recall@{k}": round(float(np.mean(recalls)), 4) if recalls else None,
+    }
+
+
+async def bench(profesional_ids: Sequence[int] | None, n_queries: int, k: int, noise: float) -> list[dict]:
+    if not profesional_ids:
+        async with SessionLocal() as session:
+            res = await session.execute(text(
+                "SELECT profesional_id FROM relationship_state "
+                "GROUP BY profesional_id ORDER BY count(*) DESC LIMIT 3"
+            ))
+            profesional_ids = [pid for (pid,) in res.all()]
+    return [await _bench_tenant(pid, n_queries, k, noise) for pid in profesional_ids]
+
+
+async def index_tenant(profesional_id: int) -> str:
+    pid = int(profesional_id)
+    name = f"{SUMMARY_INDEX}_p{pid}"     # `reembed` reconoce este nombre y lo migra
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        relkind = await conn.scalar(text("SELECT relkind::text FROM pg_class WHERE relname = 'relationship_state'"))
+        if relkind == "p":
+            raise SystemExit(
+                "relationship_state está particionada: usá "
+                f"`python -m app.partitioning move-tenant {pid}` (el índice se crea por partición)"
+            )
+        await conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON relationship_state "
+            f"USING {hnsw_using('summary_embedding')} WHERE profesional_id = {pid}"
+        ))
+    return name
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Búsqueda ANN filtrada sobre resúmenes de relación")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_bench = sub.add_parser("bench", help="latencia y recall@k del ANN contra búsqueda exacta")
+    p_bench.add_argument("--profesional-id", type=int, action="append", help="repetible (default: los 3 más grandes)")
+    p_bench.add_argument("--queries", type=int, default=50)
+    p_bench.add_argument("-k", type=int, default=10)
+    p_bench.add_argument("--noise", type=float, default=0.05, help="ruido gaussiano sobre las consultas")
+
+    p_index = sub.add_parser("index-tenant", help="índice HNSW parcial para un profesional grande")
+    p_index.add_argument("profesional_id", type=int)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "bench":
+        for row in asyncio.run(bench(args.profesional_id, args.queries, args.k, args.noise)):
+            print(json.dumps(row, ensure_ascii=False))
+    elif args.cmd == "index-tenant":
+        print(asyncio.run(index_tenant(args.profesional_id)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    main()
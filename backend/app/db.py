@@ -1,12 +1,15 @@
 # app/db.py
 from __future__ import annotations
+import logging
 from typing import AsyncGenerator, Sequence
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy import text
 from app.config import get_settings
 from app.models import Base
+from app import agenda, answer_cache, billing, partitioning, recurrence
 
 settings = get_settings()
+logger = logging.getLogger("db")
 
 engine: AsyncEngine = create_async_engine(
     settings.DATABASE_URL,
@@ -36,15 +39,74 @@ def _opclass() -> str:
         return "vector_ip_ops"
     return "vector_cosine_ops"
 
+def distance_operator() -> str:
+    """Operador pgvector que coincide con el opclass de los índices (si no, no se usan)."""
+    return {
+        "vector_cosine_ops": "<=>",
+        "vector_l2_ops": "<->",
+        "vector_ip_ops": "<#>",
+    }[_opclass()]
+
 INDEX_TARGETS: Sequence[tuple[str, str, str]] = (
     ("profesionales", "embedding", "idx_profesionales_embedding_ivf"),
+    ("servicios", "embedding", "idx_servicios_embedding_ivf"),
+    ("clientes", "embedding", "idx_clientes_embedding_ivf"),
+)
+
+# HNSW donde la consulta siempre filtra por profesional: con ivfflat el filtro
+# se aplica después de las `probes` listas y se pierden resultados; HNSW +
+# scan iterativo sigue recorriendo el grafo hasta juntar k filas del tenant.
+HNSW_INDEX_TARGETS: Sequence[tuple[str, str, str]] = (
+    ("relationship_state", "summary_embedding", "idx_relationship_state_summary_hnsw"),
+)
+
+def hnsw_using(col: str, opclass: str | None = None) -> str:
+    return (
+        f"hnsw ({col} {opclass or _opclass()}) "
+        f"WITH (m={settings.PGVECTOR_HNSW_M}, ef_construction={settings.PGVECTOR_HNSW_EF_CONSTRUCTION})"
+    )
+
+# Expresión tsvector compartida entre índices y consultas (deben ser idénticas
+# para que el planner use el índice GIN).
+def tsv(*cols: str) -> str:
+    joined = " || ' ' || ".join(f"coalesce({c}, '')" for c in cols)
+    return f"to_tsvector('spanish'::regconfig, {joined})"
+
+# (tabla, nombre índice, método, expresión)
+LEXICAL_INDEX_TARGETS: Sequence[tuple[str, str, str, str]] = (
+    ("profesionales", "idx_profesionales_nombre_trgm", "gin", "nombre gin_trgm_ops"),
+    ("profesionales", "idx_profesionales_tsv", "gin", f"({tsv('nombre', 'bio')})"),
+    ("servicios", "idx_servicios_nombre_trgm", "gin", "nombre gin_trgm_ops"),
+    ("servicios", "idx_servicios_ubicacion_trgm", "gin", "ubicacion_text gin_trgm_ops"),
+    ("servicios", "idx_servicios_tsv", "gin", f"({tsv('nombre', 'ubicacion_text')})"),
+    ("clientes", "idx_clientes_nombre_trgm", "gin", "nombre gin_trgm_ops"),
+    ("clientes", "idx_clientes_tsv", "gin", f"({tsv('nombre', 'notas')})"),
+)
+
+# Tablas que publican sus cambios por LISTEN/NOTIFY (tabla, canal)
+NOTIFY_TARGETS: Sequence[tuple[str, str]] = (
+    ("bookings", "bookings_changed"),
+    ("payments", "payments_changed"),
 )
 
+NOTIFY_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION vallebot_notify_change() RETURNS trigger AS $$
+DECLARE r record;
+BEGIN
+  IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+  PERFORM pg_notify(
+    TG_ARGV[0],
+    json_build_object('op', TG_OP, 'id', r.id, 'profesional_id', r.profesional_id)::text
+  );
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+"""
+
 async def _table_exists(conn, table: str) -> bool:
     res = await conn.execute(text("""
         SELECT 1 FROM pg_class c
          JOIN pg_namespace n ON n.oid=c.relnamespace
-        WHERE c.relkind='r' AND c.relname=:t
+        WHERE c.relkind IN ('r', 'p') AND c.relname=:t
     """), {"t": table})
     return res.scalar_one_or_none() is not None
 
@@ -61,13 +123,70 @@ async def _create_index(conn, table: str, col: str, name: str, opclass: str, lis
     END$$;
     """))
 
+async def _create_hnsw_index(conn, table: str, col: str, name: str, opclass: str):
+    # en tablas particionadas se crea uno por partición (un grafo por tenant grande)
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {hnsw_using(col, opclass)}"))
+
+async def _create_lexical_index(conn, table: str, name: str, method: str, expr: str):
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {method} ({expr})"))
+
+async def _create_notify_trigger(conn, table: str, channel: str):
+    name = f"trg_{table}_notify"
+    await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+    await conn.execute(text(
+        f"CREATE TRIGGER {name} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION vallebot_notify_change('{channel}')"
+    ))
+
+async def install_triggers(conn):
+    """Triggers de NOTIFY y de integridad (también tras convertir una tabla a particionada)."""
+    await conn.execute(text(NOTIFY_FUNCTION_SQL))
+    for table, channel in NOTIFY_TARGETS:
+        await _create_notify_trigger(conn, table, channel)
+    await partitioning.install_integrity(conn)
+
+async def _check_vector_dims(conn):
+    """Avisa si las columnas vector no coinciden con EMBEDDING_DIM (modelo cambiado sin migrar)."""
+    res = await conn.execute(text("""
+        SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod) AS tipo
+          FROM pg_attribute a
+          JOIN pg_class c ON c.oid = a.attrelid
+         WHERE c.relname = ANY(:tables) AND c.relkind IN ('r', 'p')
+           AND a.attname IN ('embedding', 'summary_embedding') AND NOT a.attisdropped
+    """), {"tables": ["profesionales", "servicios", "clientes", "relationship_state"]})
+    expected = f"vector({settings.EMBEDDING_DIM})"
+    for table, col, tipo in res.all():
+        if tipo != expected:
+            logger.error(
+                "%s.%s es %s pero EMBEDDING_DIM=%s: ejecutá `python -m app.reembed run`",
+                table, col, tipo, settings.EMBEDDING_DIM,
+            )
+
 async def init_db():
     lists = settings.PGVECTOR_INDEX_LISTS
     opclass = _opclass()
     async with engine.begin() as conn:
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+        if settings.TENANT_PARTITIONING:
+            await conn.run_sync(partitioning.create_tables)
+        else:
+            await conn.run_sync(Base.metadata.create_all)
+        # create_all no agrega columnas a tablas existentes
+        await conn.execute(text("ALTER TABLE profesionales ADD COLUMN IF NOT EXISTS especialidad varchar"))
+        await _check_vector_dims(conn)
         for table, col, idx in INDEX_TARGETS:
             if await _table_exists(conn, table):
                 await _create_index(conn, table, col, idx, opclass, lists)
+        for table, col, idx in HNSW_INDEX_TARGETS:
+            if await _table_exists(conn, table):
+                await _create_hnsw_index(conn, table, col, idx, opclass)
+        for table, idx, method, expr in LEXICAL_INDEX_TARGETS:
+            if await _table_exists(conn, table):
+                await _create_lexical_index(conn, table, idx, method, expr)
+        await install_triggers(conn)
+        await billing.install(conn)
+        await recurrence.install(conn)      # antes que answer_cache: su trigger observa `recurrence`
+        await answer_cache.install(conn)
+        await agenda.install(conn)
         await conn.execute(text("ANALYZE;"))
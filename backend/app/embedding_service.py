@@ -10,7 +10,19 @@ def _load_model():
     # Usa el nombre correcto del config
     return SentenceTransformer(settings.EMBEDDING_MODEL, device=settings.EMBEDDING_DEVICE)
 
+def texto_profesional(nombre: str, especialidad: str | None, bio: str | None) -> str:
+    """Texto que se embebe por profesional; `reembed` arma el mismo en SQL."""
+    return f"{nombre}. Especialidad: {especialidad or ''}. {bio or ''}"
+
 def embed_text(text: str) -> list[float]:
     model = _load_model()
     vec = model.encode(text)
     return vec.tolist()
+
+def embed_texts(texts: list[str], batch_size: int = 64) -> list[list[float]]:
+    """Embebe varios textos en una sola llamada al modelo (mucho más rápido que N x embed_text)."""
+    if not texts:
+        return []
+    model = _load_model()
+    vecs = model.encode(texts, batch_size=batch_size)
+    return [v.tolist() for v in vecs]
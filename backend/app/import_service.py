@@ -0,0 +1,417 @@
+# app/import_service.py
+"""
+Importación masiva de profesionales (y sus servicios) desde JSON Lines o CSV.
+
+- La entrada se consume como stream de bytes: en memoria sólo vive un lote.
+- Los embeddings se calculan por lote (una llamada al modelo por lote).
+- Upsert multi-fila sobre `profesionales.telefono`; los servicios se
+  identifican por (profesional, nombre) y se insertan/actualizan en bloque.
+- Una fila inválida no aborta el lote: se reporta con su número de línea.
+
+CSV: columnas del profesional (nombre, telefono, email, bio, especialidad) y,
+opcionalmente, un servicio por fila con prefijo `servicio_` (servicio_nombre,
+servicio_tipo, servicio_duracion_min, ...). Varias filas con el mismo teléfono
+agregan servicios al mismo profesional.
+
+Uso CLI:
+    python -m app.import_service profesionales.jsonl
+    python -m app.import_service clinica.csv --format csv --batch-size 1000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.embedding_service import embed_texts, texto_profesional
+from app.models import Profesional, Servicio, ServicioTipo
+
+settings = get_settings()
+logger = logging.getLogger("import")
+
+# El upsert multi-fila de profesionales usa 5 parámetros por fila y asyncpg
+# acepta como mucho 32767 por sentencia; además acota la memoria por lote.
+MAX_BATCH_SIZE = 5000
+
+# Tope de una línea (o de un registro CSV multilínea), en caracteres: sin él,
+# un archivo sin saltos de línea se acumularía entero en memoria.
+MAX_LINE_LENGTH = 1_000_000
+
+# Cada fila es (número de línea, dict) o (número de línea, error de parseo)
+RowStream = AsyncIterator[tuple[int, "dict[str, Any] | Exception"]]
+
+
+# ---------------------------------------------------------------------------
+# Esquemas de fila
+# ---------------------------------------------------------------------------
+class ServicioImport(BaseModel):
+    nombre: str
+    tipo: ServicioTipo = ServicioTipo.TURNO
+    duracion_min: int
+    capacidad: Optional[int] = None
+    precio: Optional[float] = None
+    cancellation_limit_min: Optional[int] = None
+    ubicacion_text: Optional[str] = None
+
+
+class ProfesionalImport(BaseModel):
+    nombre: str
+    telefono: str
+    email: Optional[str] = None
+    bio: Optional[str] = None
+    especialidad: Optional[str] = None
+    servicios: list[ServicioImport] = []
+
+
+def _texto_profesional(p: ProfesionalImport) -> str:
+    return texto_profesional(p.nombre, p.especialidad, p.bio)
+
+
+def _texto_servicio(s: ServicioImport) -> str:
+    return f"{s.nombre}. {s.ubicacion_text or ''}"
+
+
+# ---------------------------------------------------------------------------
+# Parsers en streaming
+# ---------------------------------------------------------------------------
+def _line_too_long() -> ValueError:
+    return ValueError(f"línea de más de {MAX_LINE_LENGTH} caracteres")
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str | ValueError]:
+    """Líneas de texto; una línea que supera MAX_LINE_LENGTH sale como un ValueError y se descarta."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    skipping = False  # descartando el resto de una línea demasiado larga
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            if skipping:
+                skipping = False  # es la cola de la línea ya reportada
+                continue
+            yield line.rstrip("\r") if len(line) <= MAX_LINE_LENGTH else _line_too_long()
+        if len(buf) > MAX_LINE_LENGTH:
+            if not skipping:
+                yield _line_too_long()
+                skipping = True
+            buf = ""
+    buf += decoder.decode(b"", final=True)
+    if buf and not skipping:
+        yield buf.rstrip("\r") if len(buf) <= MAX_LINE_LENGTH else _line_too_long()
+
+
+async def iter_jsonl(chunks: AsyncIterator[bytes]) -> RowStream:
+    line_no = 0
+    async for line in _iter_lines(chunks):
+        line_no += 1
+        if isinstance(line, Exception):
+            yield line_no, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ValueError(f"JSON inválido: {e.msg}")
+            continue
+        if not isinstance(data, dict):
+            yield line_no, ValueError("se esperaba un objeto JSON")
+            continue
+        yield line_no, data
+
+
+def _csv_row(rec: dict[str, str]) -> dict[str, Any]:
+    data: dict[str, Any] = {}
+    servicio: dict[str, Any] = {}
+    for k, v in rec.items():
+        if v is None or not v.strip():
+            continue
+        if k.startswith("servicio_"):
+            servicio[k.removeprefix("servicio_")] = v.strip()
+        else:
+            data[k] = v.strip()
+    if servicio:
+        data["servicios"] = [servicio]
+    return data
+
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> RowStream:
+    header: list[str] | None = None
+    pending = ""
+    start = line_no = 0
+    async for line in _iter_lines(chunks):
+        line_no += 1
+        if isinstance(line, Exception):
+            yield (start if pending else line_no), line
+            pending = ""
+            continue
+        if not pending:
+            if not line.strip():
+                continue
+            start = line_no
+            pending = line
+        else:
+            pending = f"{pending}\n{line}"
+        if pending.count('"') % 2:
+            if len(pending) > MAX_LINE_LENGTH:
+                yield start, ValueError(f"registro de más de {MAX_LINE_LENGTH} caracteres")
+                pending = ""
+            continue  # campo entre comillas con salto de línea: seguimos acumulando
+        rec = next(csv.reader([pending]))
+        pending = ""
+        if header is None:
+            header = [h.strip() for h in rec]
+            continue
+        if len(rec) != len(header):
+            yield start, ValueError(f"se esperaban {len(header)} columnas y hay {len(rec)}")
+            continue
+        yield start, _csv_row(dict(zip(header, rec)))
+    if pending:
+        yield start, ValueError("comillas sin cerrar al final del archivo")
+
+
+PARSERS = {
+    "jsonl": iter_jsonl,
+    "csv": iter_csv,
+}
+
+
+def detect_format(hint: str | None) -> str | None:
+    """Deduce el formato a partir de un content-type o un nombre de archivo."""
+    if not hint:
+        return None
+    hint = hint.lower()
+    if "csv" in hint:
+        return "csv"
+    if any(t in hint for t in ("ndjson", "jsonl", "json-lines", "jsonlines")):
+        return "jsonl"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Reporte
+# ---------------------------------------------------------------------------
+@dataclass
+class ImportReport:
+    max_errors: int
+    processed: int = 0
+    upserted: int = 0
+    servicios: int = 0
+    failed: int = 0
+    errors: list[dict] = field(default_factory=list)
+
+    def add_error(self, line: int, telefono: str | None, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "telefono": telefono, "error": error})
+
+    def as_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "upserted": self.upserted,
+            "servicios": self.servicios,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _fmt_validation(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+    )
+
+
+# ---------------------------------------------------------------------------
+# Escritura por lote
+# ---------------------------------------------------------------------------
+@dataclass
+class _Item:
+    line: int
+    prof: ProfesionalImport
+    embedding: list[float] = field(default_factory=list)
+    serv_embeddings: list[list[float]] = field(default_factory=list)
+
+
+def _dedupe(batch: list[tuple[int, ProfesionalImport]]) -> list[_Item]:
+    """Un mismo teléfono no puede aparecer dos veces en un ON CONFLICT: gana la última fila
+    y los servicios se acumulan (el último con el mismo nombre pisa al anterior)."""
+    by_tel: dict[str, _Item] = {}
+    for line, row in batch:
+        prev = by_tel.get(row.telefono)
+        if prev is not None:
+            servs = {s.nombre.lower(): s for s in prev.prof.servicios + row.servicios}
+            row = row.model_copy(update={"servicios": list(servs.values())})
+        by_tel[row.telefono] = _Item(line=line, prof=row)
+    return list(by_tel.values())
+
+
+async def _embed(items: list[_Item]) -> None:
+    texts = [_texto_profesional(it.prof) for it in items]
+    texts += [_texto_servicio(s) for it in items for s in it.prof.servicios]
+    vecs = await asyncio.to_thread(embed_texts, texts)
+    pos = len(items)
+    for it, vec in zip(items, vecs):
+        it.embedding = vec
+        n = len(it.prof.servicios)
+        it.serv_embeddings = vecs[pos:pos + n]
+        pos += n
+
+
+async def _upsert(session: AsyncSession, items: list[_Item]) -> int:
+    """Upsert de profesionales + servicios. Devuelve la cantidad de servicios escritos."""
+    stmt = pg_insert(Profesional).values([
+        {
+            "nombre": it.prof.nombre,
+            "telefono": it.prof.telefono,
+            "email": it.prof.email,
+            "bio": it.prof.bio,
+            "especialidad": it.prof.especialidad,
+            "embedding": it.embedding,
+        }
+        for it in items
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Profesional.telefono],
+        set_={
+            "nombre": stmt.excluded.nombre,
+            "email": func.coalesce(stmt.excluded.email, Profesional.email),
+            "bio": func.coalesce(stmt.excluded.bio, Profesional.bio),
+            "especialidad": func.coalesce(stmt.excluded.especialidad, Profesional.especialidad),
+            "embedding": stmt.excluded.embedding,
+        },
+    ).returning(Profesional.id, Profesional.telefono)
+    ids = {tel: pid for pid, tel in (await session.execute(stmt)).all()}
+
+    if not any(it.prof.servicios for it in items):
+        return 0
+
+    existing_res = await session.execute(
+        select(Servicio.id, Servicio.profesional_id, Servicio.nombre)
+        .where(Servicio.profesional_id.in_(list(ids.values())))
+    )
+    existing = {(pid, nombre.lower()): sid for sid, pid, nombre in existing_res.all()}
+
+    nuevos: list[dict] = []
+    cambios: list[dict] = []
+    for it in items:
+        pid = ids[it.prof.telefono]
+        for serv, vec in zip(it.prof.servicios, it.serv_embeddings):
+            vals = {**serv.model_dump(), "profesional_id": pid, "embedding": vec}
+            sid = existing.get((pid, serv.nombre.lower()))
+            if sid is None:
+                nuevos.append(vals)
+            else:
+                cambios.append({"id": sid, **vals})
+    if nuevos:
+        await session.execute(insert(Servicio), nuevos)
+    if cambios:
+        await session.execute(update(Servicio), cambios)
+    return len(nuevos) + len(cambios)
+
+
+async def _flush(session: AsyncSession, batch: list[tuple[int, ProfesionalImport]], report: ImportReport) -> None:
+    items = _dedupe(batch)
+    await _embed(items)
+    try:
+        report.servicios += await _upsert(session, items)
+        await session.commit()
+        report.upserted += len(items)
+        return
+    except SQLAlchemyError:
+        await session.rollback()
+        logger.warning("Lote de %d filas falló; reintentando fila por fila", len(items))
+
+    # Aislamos las filas conflictivas sin perder el resto del lote
+    for it in items:
+        try:
+            async with session.begin_nested():
+                n = await _upsert(session, [it])
+        except SQLAlchemyError as e:
+            report.add_error(it.line, it.prof.telefono, str(getattr(e, "orig", None) or e))
+            continue
+        report.servicios += n
+        report.upserted += 1
+    await session.commit()
+
+
+async def import_profesionales(
+    session: AsyncSession,
+    rows: RowStream,
+    *,
+    batch_size: int | None = None,
+    max_errors: int | None = None,
+) -> ImportReport:
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f"batch_size debe estar entre 1 y {MAX_BATCH_SIZE}")
+    report = ImportReport(max_errors=max_errors or settings.IMPORT_MAX_ERRORS)
+    batch: list[tuple[int, ProfesionalImport]] = []
+
+    async for line, data in rows:
+        report.processed += 1
+        if isinstance(data, Exception):
+            report.add_error(line, None, str(data))
+            continue
+        try:
+            batch.append((line, ProfesionalImport.model_validate(data)))
+        except ValidationError as e:
+            report.add_error(line, data.get("telefono"), _fmt_validation(e))
+            continue
+        if len(batch) >= batch_size:
+            await _flush(session, batch, report)
+            batch = []
+            logger.info("Importación: %d filas procesadas", report.processed)
+
+    if batch:
+        await _flush(session, batch, report)
+    return report
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+async def _file_chunks(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            yield chunk
+
+
+async def _main(argv: list[str] | None = None) -> None:
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Importación masiva de profesionales")
+    parser.add_argument("path", help="archivo .jsonl o .csv")
+    parser.add_argument("--format", choices=sorted(PARSERS), default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("no se pudo deducir el formato; usá --format")
+    if args.batch_size is not None and not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f"--batch-size debe estar entre 1 y {MAX_BATCH_SIZE}")
+
+    async with SessionLocal() as session:
+        report = await import_profesionales(
+            session, PARSERS[fmt](_file_chunks(args.path)), batch_size=args.batch_size
+        )
+    print(json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    asyncio.run(_main())
@@ -6,6 +6,7 @@ Cliente liviano para llamar a un modelo LLM (OpenAI ChatGPT)
 from __future__ import annotations
 
 import logging
+from collections import Counter
 from typing import Any, AsyncIterator, Iterator, Mapping, Optional, Sequence
 
 from openai import OpenAI, AsyncOpenAI  # SDK ≥ 1.14
@@ -23,9 +24,27 @@ _client_sync = OpenAI(api_key=_api_key,timeout=settings.LLM_TIMEOUT or 60.0)
 _client_async = AsyncOpenAI(api_key=_api_key,timeout=settings.LLM_TIMEOUT or 60.0)
 
 
+# Tokens acumulados por proceso (se exponen en /metrics)
+usage: Counter[str] = Counter()
+
+
 # ------------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------------
+def _record_usage(response) -> None:
+    """Registra los tokens que reporta el proveedor, incluidos los servidos desde su caché de prompt."""
+    u = getattr(response, "usage", None)
+    if u is None:
+        return
+    details = getattr(u, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) if details else None) or 0
+    usage["calls"] += 1
+    usage["prompt_tokens"] += u.prompt_tokens or 0
+    usage["cached_prompt_tokens"] += cached
+    usage["completion_tokens"] += u.completion_tokens or 0
+    logger.info("LLM tokens → prompt=%s (cache=%s) completion=%s", u.prompt_tokens, cached, u.completion_tokens)
+
+
 def _build_messages(
     prompt: str | None = None,
     system_prompt: str | None = None,
@@ -94,6 +113,7 @@ def chat_completion(
             max_tokens=max_tokens,
         )
         logger.info("LLM response → %s", response)
+        _record_usage(response)
 
         return response.choices[0].message.content
 
@@ -149,5 +169,6 @@ async def achat_completion(
             **extra,
         )
         logger.info("LLM response → %s", response)
+        _record_usage(response)
 
         return response.choices[0].message.content
@@ -7,9 +7,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import get_settings
 from app.db import init_db, get_session
-from app.embedding_service import embed_text
+from app.embedding_service import embed_text, texto_profesional
 from app.models import Profesional
-from app.routers import whatsapp  # – agrega invites.router si lo mantienes
+from app import admission, answer_cache, search_service
+from app.admission import Shed
+from app import agenda as agenda_feed
+from app.whatsapp_sender import close_sender
+from app import llm_client
+from app.pg_events import listener as pg_listener
+from app.scheduler import scheduler
+from app.media_service import pipeline as media_pipeline
+from app.routers import whatsapp, imports, billing, agenda, clases, relaciones  # – agrega invites.router si lo mantienes
 import logging
 
 settings = get_settings()
@@ -28,7 +36,8 @@ class ProfesionalIn(BaseModel):
 class SemanticQuery(BaseModel):
     query: str
     top_k: int = 3
-    scope: str = "profesionales"  # único por ahora
+    scope: str = "profesionales"  # profesionales | servicios | clientes
+    mode: str = "hybrid"          # hybrid | lexical | vector
 
 
 # ---------------------------------------------------------------------------
@@ -39,13 +48,28 @@ async def lifespan(app: FastAPI):
     await init_db()
     from app.embedding_service import _load_model  # warm‑up
     _load_model()
+    if settings.SCHEDULER_ENABLED:
+        scheduler.subscribe(pg_listener)
+        await scheduler.start()
+    agenda_feed.subscribe(pg_listener)
+    await pg_listener.start()
+    await media_pipeline.start()
     yield
+    await media_pipeline.stop()
+    await scheduler.stop()
+    await pg_listener.stop()
+    await close_sender()
 
 
 app = FastAPI(title="Vallebot API", lifespan=lifespan)
 
 # Routers (WhatsApp webhook)
 app.include_router(whatsapp.router)
+app.include_router(imports.router)
+app.include_router(billing.router)
+app.include_router(agenda.router)
+app.include_router(clases.router)
+app.include_router(relaciones.router)
 # app.include_router(invites.router)  # si lo usas
 
 
@@ -61,17 +85,30 @@ async def health():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Contadores en proceso (por worker)."""
+    return {
+        "admission": admission.snapshot(),
+        "answer_cache": answer_cache.cache.snapshot(),
+        "media": media_pipeline.snapshot(),
+        "agenda_cache": agenda_feed.cache.snapshot(),
+        "llm_usage": dict(llm_client.usage),
+    }
+
+
 @app.post("/profesionales", summary="Alta manual (fuera de WhatsApp)")
 async def create_profesional(
     data: ProfesionalIn,
     session: AsyncSession = Depends(get_session),
 ):
-    text_src = f"{data.nombre}. Especialidad: {data.especialidad or ''}. {data.bio or ''}"
+    text_src = texto_profesional(data.nombre, data.especialidad, data.bio)
     prof = Profesional(
         nombre=data.nombre,
         telefono=data.telefono,
         email=data.email,
         bio=data.bio,
+        especialidad=data.especialidad,
         embedding=embed_text(text_src),
     )
     session.add(prof)
@@ -85,21 +122,14 @@ async def semantic_search(
     q: SemanticQuery,
     session: AsyncSession = Depends(get_session),
 ):
-    if q.scope != "profesionales":
-        raise HTTPException(400, "scope inválido (solo 'profesionales' disponible)")
-
-    vec = embed_text(q.query)
-    vec_literal = "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
-
-    sql = text("""
-        SELECT id, nombre, embedding <-> :qvec::vector AS distancia
-        FROM profesionales
-        ORDER BY distancia ASC
-        LIMIT :k
-    """)
-
-    rows = (
-        await session.execute(sql, {"qvec": vec_literal, "k": q.top_k})
-    ).mappings().all()
-
-    return {"results": rows, "query": q.query}
+    if q.scope not in search_service.SCOPES:
+        raise HTTPException(400, f"scope inválido (disponibles: {', '.join(search_service.SCOPES)})")
+    if q.mode not in search_service.MODES:
+        raise HTTPException(400, f"mode inválido (disponibles: {', '.join(search_service.MODES)})")
+
+    try:
+        return await search_service.search(
+            session, q.query, scope=q.scope, mode=q.mode, top_k=q.top_k
+        )
+    except Shed:
+        raise HTTPException(503, "Búsqueda saturada, reintentá en unos segundos", headers={"Retry-After": "5"})
@@ -0,0 +1,291 @@
+# app/media_service.py
+"""
+Ingesta de comprobantes de pago (imagen / PDF) recibidos por WhatsApp.
+
+1. El webhook encola un `ReceiptJob` y responde enseguida; si la cola está
+   llena lanza `Shed` (503 → la Cloud API reintenta).
+2. Un pool acotado de workers resuelve la URL de la media en la Cloud API y
+   la descarga en streaming a disco, por chunks: la memoria por descarga queda
+   acotada a MEDIA_CHUNK_SIZE y se aborta al superar MEDIA_MAX_BYTES.
+3. El sha256 se calcula mientras se escribe. El archivo se guarda como
+   `<sha256><ext>` (un mismo comprobante ocupa disco una sola vez) y un hash ya
+   visto se registra como duplicado: señal de fraude, no se asocia al pago.
+4. Si no es duplicado se asocia al último pago PENDING sin comprobante del
+   cliente (`Payment.comprobante_url`).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.admission import Shed
+from app.config import get_settings
+from app.db import SessionLocal
+from app.models import Cliente, MediaReceipt, Payment, PaymentStatus
+from app.whatsapp_sender import Recipient, get_sender, notify
+
+settings = get_settings()
+logger = logging.getLogger("media")
+
+MIME_EXT = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+
+
+class MediaError(Exception):
+    pass
+
+
+class MediaTooLarge(MediaError):
+    pass
+
+
+@dataclass
+class StoredMedia:
+    sha256: str
+    path: Path
+    size: int
+    mime_type: str
+
+
+@dataclass
+class ReceiptJob:
+    media_id: str
+    telefono: str
+    mime_type: Optional[str] = None
+
+
+@dataclass
+class ReceiptResult:
+    status: str                       # attached | unmatched | duplicate | already_ingested
+    receipt_id: int
+    sha256: str
+    payment_id: Optional[int] = None
+    duplicate_of: Optional[int] = None
+
+
+async def stream_to_disk(
+    client: httpx.AsyncClient,
+    url: str,
+    dest_dir: Path,
+    *,
+    mime_type: str,
+    max_bytes: int,
+    chunk_size: int,
+) -> StoredMedia:
+    """Descarga `url` por chunks a `dest_dir/<sha256><ext>` calculando el hash al vuelo."""
+    ext = MIME_EXT.get(mime_type)
+    if ext is None:
+        raise MediaError(f"tipo de archivo no soportado: {mime_type}")
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    tmp = dest_dir / f".part-{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            declared = int(resp.headers.get("content-length") or 0)
+            if declared > max_bytes:
+                raise MediaTooLarge(f"{declared} bytes > {max_bytes}")
+            with open(tmp, "wb") as f:
+                async for chunk in resp.aiter_bytes(chunk_size):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaTooLarge(f"más de {max_bytes} bytes")
+                    digest.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)     # no bloquear el loop con I/O de disco
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    final = dest_dir / f"{digest.hexdigest()}{ext}"
+    if final.exists():
+        tmp.unlink()
+    else:
+        os.replace(tmp, final)
+    return StoredMedia(sha256=digest.hexdigest(), path=final, size=size, mime_type=mime_type)
+
+
+async def resolve_media(client: httpx.AsyncClient, media_id: str, base_url: str | None = None) -> tuple[str, str]:
+    """GET /{media_id} de la Cloud API → (url de descarga, mime_type)."""
+    base = (base_url or settings.WHATSAPP_API_BASE).rstrip("/")
+    resp = await client.get(f"{base}/{media_id}")
+    resp.raise_for_status()
+    data = resp.json()
+    return data["url"], data.get("mime_type", "")
+
+
+async def ingest_receipt(
+    session: AsyncSession,
+    client: httpx.AsyncClient,
+    job: ReceiptJob,
+    *,
+    dest_dir: Path | None = None,
+) -> ReceiptResult:
+    # La Cloud API reentrega webhooks: el mismo media_id se procesa una sola vez
+    prev = await session.scalar(select(MediaReceipt).where(MediaReceipt.wa_media_id == job.media_id))
+    if prev is not None:
+        return ReceiptResult("already_ingested", prev.id, prev.sha256, prev.payment_id, prev.duplicate_of)
+    # la descarga puede tardar: que no retenga una conexión del pool ni un snapshot abierto
+    await session.commit()
+
+    url, mime_type = await resolve_media(client, job.media_id)
+    stored = await stream_to_disk(
+        client, url, Path(dest_dir or settings.MEDIA_DIR),
+        mime_type=mime_type or job.mime_type or "",
+        max_bytes=settings.MEDIA_MAX_BYTES,
+        chunk_size=settings.MEDIA_CHUNK_SIZE,
+    )
+
+    # Serializa por hash: dos envíos simultáneos del mismo archivo no pueden ser ambos "originales"
+    await session.execute(select(func.pg_advisory_xact_lock(func.hashtextextended(stored.sha256, 0))))
+    first = await session.scalar(
+        select(MediaReceipt)
+        .where(MediaReceipt.sha256 == stored.sha256, MediaReceipt.duplicate_of.is_(None))
+        .order_by(MediaReceipt.id)
+        .limit(1)
+    )
+    payment = None
+    if first is None:
+        payment = await session.scalar(
+            select(Payment)
+            .join(Cliente, Cliente.id == Payment.cliente_id)
+            .where(
+                Cliente.telefono == job.telefono,
+                Payment.status == PaymentStatus.PENDING,
+                Payment.comprobante_url.is_(None),
+            )
+            .order_by(Payment.created_at.desc())
+            .limit(1)
+            .with_for_update(of=Payment, skip_locked=True)
+        )
+    values = dict(
+        sha256=stored.sha256,
+        telefono=job.telefono,
+        wa_media_id=job.media_id,
+        mime_type=stored.mime_type,
+        size_bytes=stored.size,
+        storage_url=str(stored.path),
+        profesional_id=payment.profesional_id if payment else None,
+        payment_id=payment.id if payment else None,
+        duplicate_of=first.id if first else None,
+    )
+    # Dos reentregas simultáneas del mismo media_id pasan ambas el chequeo de
+    # arriba: la segunda no inserta nada y devuelve lo que registró la primera.
+    receipt_id = await session.scalar(
+        pg_insert(MediaReceipt).values(**values)
+        .on_conflict_do_nothing(index_elements=["wa_media_id"])
+        .returning(MediaReceipt.id)
+    )
+    if receipt_id is None:
+        await session.rollback()
+        prev = await session.scalar(select(MediaReceipt).where(MediaReceipt.wa_media_id == job.media_id))
+        return ReceiptResult("already_ingested", prev.id, prev.sha256, prev.payment_id, prev.duplicate_of)
+    if payment is not None:
+        payment.comprobante_url = values["storage_url"]
+    await session.commit()
+
+    if first is not None:
+        logger.warning(
+            "Comprobante duplicado de %s (sha256 %s, original #%s de %s)",
+            job.telefono, stored.sha256[:12], first.id, first.telefono,
+        )
+        return ReceiptResult("duplicate", receipt_id, stored.sha256, duplicate_of=first.id)
+    status = "attached" if payment else "unmatched"
+    return ReceiptResult(status, receipt_id, stored.sha256, payment_id=values["payment_id"])
+
+
+REPLIES = {
+    "attached": "¡Gracias! Recibimos tu comprobante y lo asociamos a tu pago.",
+    "unmatched": "Recibimos tu comprobante. No encontramos un pago pendiente: el profesional lo va a revisar.",
+    "duplicate": "Este comprobante ya fue enviado anteriormente. Si es un pago nuevo, mandá el comprobante correspondiente.",
+}
+
+
+class MediaPipeline:
+    """Cola acotada + N workers. `submit` nunca espera: si está llena, `Shed`."""
+
+    def __init__(self, workers: int, queue_size: int, client: httpx.AsyncClient | None = None):
+        self.workers = workers
+        self._queue: asyncio.Queue[ReceiptJob] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._client = client
+        self.stats: Counter[str] = Counter()
+
+    def submit(self, job: ReceiptJob) -> None:
+        if not job.media_id:
+            self.stats["rejected"] += 1
+            raise MediaError("mensaje de media sin id")
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["shed"] += 1
+            raise Shed("media") from None
+        self.stats["queued"] += 1
+
+    async def _process(self, job: ReceiptJob) -> None:
+        client = self._client or get_sender().client
+        async with SessionLocal() as session:
+            try:
+                res = await ingest_receipt(session, client, job)
+            except MediaTooLarge as e:
+                self.stats["too_large"] += 1
+                logger.warning("Comprobante de %s descartado: %s", job.telefono, e)
+                return
+            except (MediaError, httpx.HTTPError) as e:
+                self.stats["failed"] += 1
+                logger.warning("No se pudo descargar la media %s: %s", job.media_id, e)
+                return
+            self.stats[res.status] += 1
+            if settings.WHATSAPP_SEND_ENABLED and res.status in REPLIES:
+                await notify(session, [Recipient(telefono=job.telefono)], REPLIES[res.status])
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Error procesando comprobante %s", job.media_id)
+            finally:
+                self._queue.task_done()
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"media-{i}") for i in range(self.workers)
+            ]
+
+    async def stop(self, drain_timeout_s: float = 10.0) -> None:
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout_s)
+        except asyncio.TimeoutError:
+            logger.warning("Se descartan %d comprobantes en cola al apagar", self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> dict:
+        return {"workers": len(self._tasks), "queued_now": self._queue.qsize(), **dict(self.stats)}
+
+
+pipeline = MediaPipeline(settings.MEDIA_WORKERS, settings.MEDIA_QUEUE_SIZE)
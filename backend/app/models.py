@@ -13,7 +13,11 @@ from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 from pgvector.sqlalchemy import Vector
 
-VECTOR_DIM = 768  # all-mpnet-base-v2
+from app.config import get_settings
+
+# Debe coincidir con el modelo de embeddings configurado (768 = all-mpnet-base-v2).
+# Para cambiar de modelo sin downtime ver app/reembed.py
+VECTOR_DIM = get_settings().EMBEDDING_DIM
 UTC = timezone.utc
 class Base(DeclarativeBase):
     pass
@@ -45,6 +49,8 @@ class Profesional(Base):
     telefono:  Mapped[str]            = mapped_column(String, unique=True, nullable=False)
     email:     Mapped[Optional[str]]  = mapped_column(String)
     bio:       Mapped[Optional[str]]  = mapped_column(String)
+    # se guarda porque forma parte del texto embebido (ver texto_profesional)
+    especialidad: Mapped[Optional[str]] = mapped_column(String)
 
     # Embedding para busquedas semánticas
     embedding: Mapped[List[float]]    = mapped_column(Vector(VECTOR_DIM), nullable=False)
@@ -53,6 +59,11 @@ class Profesional(Base):
         DateTime(timezone=True), default=lambda: datetime.now(UTC)
     )
 
+    # Incrementada por trigger ante cambios en sus servicios (ver app/answer_cache.py)
+    servicios_version: Mapped[int]    = mapped_column(default=0, server_default="0")
+    # Ídem ante cambios en sus bookings (ver app/agenda.py)
+    bookings_version: Mapped[int]     = mapped_column(default=0, server_default="0")
+
     # 🔹 RELACIÓN: lista de servicios que brinda
     servicios: Mapped[List["Servicio"]] = relationship(
         back_populates="profesional",
@@ -69,7 +80,7 @@ class Cliente(Base):
     email: Mapped[Optional[str]] = mapped_column(String(150))
     active: Mapped[bool] = mapped_column(default=True)
     notas: Mapped[Optional[str]] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     embedding: Mapped[List[float]] = mapped_column(Vector(VECTOR_DIM), nullable=False)
 
 class Servicio(Base):
@@ -85,6 +96,8 @@ class Servicio(Base):
     ubicacion_text: Mapped[Optional[str]] = mapped_column(String(200))
     activo: Mapped[bool] = mapped_column(default=True)
     embedding: Mapped[List[float]] = mapped_column(Vector(VECTOR_DIM), nullable=False)
+    # Regla semanal de una clase grupal (ver app/recurrence.py); las ocurrencias se materializan a demanda
+    recurrence: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSONB)
 
     profesional: Mapped["Profesional"] = relationship(back_populates="servicios")
     bookings: Mapped[List["Booking"]] = relationship(back_populates="servicio", cascade="all, delete-orphan")
@@ -101,8 +114,8 @@ class Booking(Base):
     status: Mapped[BookingStatus] = mapped_column(SAEnum(BookingStatus), default=BookingStatus.CONFIRMED)
     capacity_used: Mapped[int] = mapped_column(default=1)
     capacity_total: Mapped[Optional[int]]
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
-    updated_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC), onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow, onupdate=datetime.utcnow)
 
     servicio: Mapped["Servicio"] = relationship(back_populates="bookings")
     enrollments: Mapped[List["Enrollment"]] = relationship(back_populates="booking", cascade="all, delete-orphan")
@@ -112,6 +125,11 @@ class Booking(Base):
               "servicio_id", "fecha", "hora", "cliente_id",
               unique=True,
               postgresql_where=(cliente_id.isnot(None))),  # type: ignore
+        # Una sola ocurrencia materializada por clase y horario
+        Index("ix_booking_unique_clase",
+              "profesional_id", "servicio_id", "fecha", "hora",
+              unique=True,
+              postgresql_where=(cliente_id.is_(None))),  # type: ignore
     )
 
 class Enrollment(Base):
@@ -120,7 +138,7 @@ class Enrollment(Base):
     booking_id: Mapped[int] = mapped_column(ForeignKey("bookings.id", ondelete="CASCADE"), index=True)
     cliente_id: Mapped[int] = mapped_column(ForeignKey("clientes.id"), index=True)
     status: Mapped[str] = mapped_column(String(20), default="ENROLLED")
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
     booking: Mapped["Booking"] = relationship(back_populates="enrollments")
 
@@ -140,7 +158,7 @@ class Payment(Base):
     method: Mapped[Optional[str]] = mapped_column(String(30))
     status: Mapped[PaymentStatus] = mapped_column(SAEnum(PaymentStatus), default=PaymentStatus.PENDING)
     comprobante_url: Mapped[Optional[str]] = mapped_column(String(300))
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     verified_at: Mapped[Optional[datetime]]
 
 class Message(Base):
@@ -151,8 +169,13 @@ class Message(Base):
     profesional_id: Mapped[Optional[int]] = mapped_column(ForeignKey("profesionales.id"))
     cliente_id: Mapped[Optional[int]] = mapped_column(ForeignKey("clientes.id"))
     text: Mapped[str] = mapped_column(Text)
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     interpreted_action_id: Mapped[Optional[int]] = mapped_column(ForeignKey("interpreted_actions.id"))
+    # Solo salientes: estado de entrega reportado por la Cloud API
+    wa_message_id: Mapped[Optional[str]] = mapped_column(String(128), unique=True)
+    delivery_status: Mapped[Optional[str]] = mapped_column(String(20))  # queued | sent | delivered | read | failed
+    delivery_error: Mapped[Optional[str]] = mapped_column(Text)
+    status_updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
 
 class InterpretedAction(Base):
     __tablename__ = "interpreted_actions"
@@ -162,7 +185,7 @@ class InterpretedAction(Base):
     raw_json: Mapped[Dict[str, Any]] = mapped_column(JSONB)
     missing: Mapped[List[str]] = mapped_column(JSONB, default=list)
     status: Mapped[str] = mapped_column(String(20), default="PROCESSED")
-    created_at: Mapped[datetime] = mapped_column(default=datetime.now(UTC))
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
 class RelationshipState(Base):
     __tablename__ = "relationship_state"
@@ -191,4 +214,85 @@ class ProfessionalInvite(Base):
     missing_fields: Mapped[List[str]] = mapped_column(JSONB, default=list, nullable=False)
     profesional_id: Mapped[Optional[int]] = mapped_column(ForeignKey("profesionales.id"))
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
-    used_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
\ No newline at end of file
+    used_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+class EmbeddingMigration(Base):
+    """Checkpoint de la migración de re-embedding (ver app/reembed.py)."""
+    __tablename__ = "embedding_migrations"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    table_name: Mapped[str] = mapped_column(String(63))
+    column_name: Mapped[str] = mapped_column(String(63))
+    model: Mapped[str] = mapped_column(String(200))
+    dim: Mapped[int]
+    phase: Mapped[str] = mapped_column(String(20), default="shadow")  # shadow | backfill | index | ready | switched
+    last_id: Mapped[int] = mapped_column(default=0)
+    rows_done: Mapped[int] = mapped_column(default=0)
+    rows_total: Mapped[int] = mapped_column(default=0)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )
+
+    __table_args__ = (
+        UniqueConstraint("table_name", "column_name", "model", name="uq_embedding_migration"),
+    )
+
+class ScheduledNotification(Base):
+    """Registro de avisos disparados: el INSERT es el "claim" que garantiza un único envío."""
+    __tablename__ = "scheduled_notifications"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(30))          # booking_reminder | cancel_deadline | payment_nudge
+    ref_id: Mapped[int]                                    # bookings.id o payments.id según kind
+    due_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    fired_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    status: Mapped[str] = mapped_column(String(20), default="claimed")  # claimed | sent | failed | skipped
+
+    __table_args__ = (
+        UniqueConstraint("kind", "ref_id", "due_at", name="uq_sched_notif_kind_ref_due"),
+    )
+
+class BillingMonthly(Base):
+    """Agregado de cobros por profesional/cliente/mes, mantenido por triggers (ver app/billing.py)."""
+    __tablename__ = "billing_monthly"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    profesional_id: Mapped[int] = mapped_column(ForeignKey("profesionales.id"))
+    cliente_id: Mapped[int] = mapped_column(ForeignKey("clientes.id"))
+    month: Mapped[date] = mapped_column(Date)                # primer día del mes
+    paid_amount: Mapped[float] = mapped_column(default=0.0)      # payments VERIFIED
+    pending_amount: Mapped[float] = mapped_column(default=0.0)   # payments PENDING
+    rejected_amount: Mapped[float] = mapped_column(default=0.0)  # payments REJECTED
+    sessions_attended: Mapped[int] = mapped_column(default=0)    # bookings ATTENDED
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC)
+    )
+
+    __table_args__ = (
+        UniqueConstraint("profesional_id", "cliente_id", "month", name="uq_billing_prof_cli_month"),
+    )
+
+class MediaReceipt(Base):
+    """Comprobante recibido por WhatsApp. `sha256` repetido = comprobante duplicado (señal de fraude)."""
+    __tablename__ = "media_receipts"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), index=True)
+    telefono: Mapped[str] = mapped_column(String(50))
+    wa_media_id: Mapped[str] = mapped_column(String(128), unique=True)
+    mime_type: Mapped[str] = mapped_column(String(100))
+    size_bytes: Mapped[int]
+    storage_url: Mapped[str] = mapped_column(String(300))
+    profesional_id: Mapped[Optional[int]] = mapped_column(ForeignKey("profesionales.id"))
+    payment_id: Mapped[Optional[int]]                      # sin FK: payments puede estar particionada
+    duplicate_of: Mapped[Optional[int]] = mapped_column(ForeignKey("media_receipts.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+
+class BookingChange(Base):
+    """Último cambio de cada booking por profesional (tombstone si se borró): base de los deltas de agenda."""
+    __tablename__ = "booking_changes"
+    profesional_id: Mapped[int] = mapped_column(primary_key=True)
+    booking_id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int]
+    deleted: Mapped[bool] = mapped_column(default=False)
+
+    __table_args__ = (
+        Index("ix_booking_changes_prof_version", "profesional_id", "version"),
+    )
@@ -0,0 +1,386 @@
+# app/partitioning.py
+"""
+Particionado por tenant (`profesional_id`) de las tablas de alto volumen.
+
+Esquema (cuando TENANT_PARTITIONING=true):
+
+    bookings                      PARTITION BY LIST (profesional_id)
+    ├── bookings_p42              FOR VALUES IN (42)      ← tenants grandes (move-tenant)
+    └── bookings_default          DEFAULT PARTITION BY HASH (profesional_id)
+        ├── bookings_h0 … bookings_h{N-1}   (MODULUS TENANT_HASH_PARTITIONS)
+
+Una consulta con `profesional_id = X` poda a una sola partición hoja.
+
+Restricciones de Postgres que esto implica:
+- PK y UNIQUE deben incluir la clave de partición: se les agrega
+  `profesional_id`. Si la columna admite NULL, como en `messages`, quedan
+  como índices no únicos: `id` sigue saliendo de la secuencia y
+  `wa_message_id` lo verifica un trigger (ver INTEGRITY_SQL).
+- No puede haber FKs que apunten a una tabla particionada por `id` solo:
+  se omiten las FKs hacia `bookings` (enrollments.booking_id, payments.booking_id).
+  Las reemplazan triggers: la referencia se valida con FOR KEY SHARE,
+  borrar un booking borra sus enrollments (era ON DELETE CASCADE) y falla
+  si tiene pagos (era NO ACTION).
+
+init_db crea las tablas particionadas en una base nueva. Para una base
+existente y para mover tenants:
+
+    python -m app.partitioning convert bookings        # tabla existente → particionada
+    python -m app.partitioning move-tenant 42          # tenant 42 a su propia partición
+    python -m app.partitioning check 42                # verifica partition pruning
+    python -m app.partitioning status
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import re
+from typing import Sequence
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex, CreateTable, Table
+
+from app.config import get_settings
+from app.models import Base
+
+settings = get_settings()
+
+PARTITION_KEY = "profesional_id"
+PARTITIONED_TABLES: Sequence[str] = ("bookings", "payments", "messages", "relationship_state")
+
+
+def _key_nullable(table: Table) -> bool:
+    return table.c[PARTITION_KEY].nullable
+
+
+def _cols(spec: str) -> list[str]:
+    return [c.strip() for c in spec.split(",")]
+
+
+def partitioned_table_ddl(table: Table, dialect, modulus: int | None = None, name: str | None = None) -> list[str]:
+    """DDL (en orden) para crear `table` particionada: padre, default, hash e índices."""
+    modulus = modulus or settings.TENANT_HASH_PARTITIONS
+    name = name or table.name
+    nullable = _key_nullable(table)
+    fks = [fk for fk in table.foreign_key_constraints if fk.referred_table.name not in PARTITIONED_TABLES]
+    ddl = str(CreateTable(table, include_foreign_key_constraints=fks).compile(dialect=dialect)).strip()
+
+    lines = ddl.splitlines()
+    items = [ln.strip().rstrip(",").strip() for ln in lines[1:-1]]
+    out_items: list[str] = []
+    extra_indexes: list[str] = []
+    for item in items:
+        if item == "PRIMARY KEY (id)":
+            if nullable:
+                extra_indexes.append(f"CREATE INDEX ix_{name}_id ON {name} (id)")
+            else:
+                out_items.append(f"PRIMARY KEY (id, {PARTITION_KEY})")
+            continue
+        m = re.fullmatch(r"(CONSTRAINT (\w+) )?UNIQUE \(([^)]*)\)", item)
+        if m and PARTITION_KEY not in _cols(m.group(3)):
+            cols = m.group(3)
+            if nullable:
+                idx = m.group(2) or f"ix_{name}_{'_'.join(_cols(cols))}"
+                extra_indexes.append(f"CREATE INDEX {idx} ON {name} ({cols})")
+            else:
+                out_items.append(f"{m.group(1) or ''}UNIQUE ({cols}, {PARTITION_KEY})")
+            continue
+        out_items.append(item)
+
+    create = (
+        f"CREATE TABLE {name} (\n\t" + ",\n\t".join(out_items) + f"\n) PARTITION BY LIST ({PARTITION_KEY})"
+    )
+    stmts = [
+        create,
+        f"CREATE TABLE {name}_default PARTITION OF {name} DEFAULT PARTITION BY HASH ({PARTITION_KEY})",
+    ]
+    stmts += [
+        f"CREATE TABLE {name}_h{i} PARTITION OF {name}_default FOR VALUES WITH (MODULUS {modulus}, REMAINDER {i})"
+        for i in range(modulus)
+    ]
+
+    for idx in table.indexes:
+        sql = str(CreateIndex(idx).compile(dialect=dialect))
+        if name != table.name:
+            sql = sql.replace(f" ON {table.name} ", f" ON {name} ", 1)
+        cols = [c.name for c in idx.columns]
+        if idx.unique and PARTITION_KEY not in cols:
+            if nullable:
+                sql = sql.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+            else:
+                sql = re.sub(rf" ON {name} \(([^)]*)\)", rf" ON {name} (\1, {PARTITION_KEY})", sql, count=1)
+        stmts.append(sql)
+    return stmts + extra_indexes
+
+
+def create_tables(conn: Connection) -> None:
+    """
+    Crea (si faltan) todas las tablas del modelo, las de PARTITIONED_TABLES
+    particionadas. Pensado para `conn.run_sync` desde init_db.
+    """
+    existing = set(inspect(conn).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name in existing:
+            continue
+        if table.name in PARTITIONED_TABLES:
+            for col in table.columns:
+                if hasattr(col.type, "create"):   # tipos ENUM de Postgres
+                    col.type.create(conn, checkfirst=True)
+            for stmt in partitioned_table_ddl(table, conn.dialect):
+                conn.exec_driver_sql(stmt)
+        elif any(fk.referred_table.name in PARTITIONED_TABLES for fk in table.foreign_key_constraints):
+            fks = [fk for fk in table.foreign_key_constraints if fk.referred_table.name not in PARTITIONED_TABLES]
+            conn.execute(CreateTable(table, include_foreign_key_constraints=fks))
+            for idx in table.indexes:
+                conn.execute(CreateIndex(idx))
+        else:
+            table.create(conn)
+
+
+# ---------------------------------------------------------------------------
+# Integridad que las tablas particionadas ya no pueden declarar
+# ---------------------------------------------------------------------------
+INTEGRITY_SQL: Sequence[str] = ("""
+CREATE OR REPLACE FUNCTION vallebot_booking_ref_check() RETURNS trigger AS $$
+BEGIN
+    IF NEW.booking_id IS NOT NULL THEN
+        -- mismo lock que toma una FK: el booking no puede borrarse hasta el commit
+        PERFORM 1 FROM bookings WHERE id = NEW.booking_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'booking % no existe (%.booking_id)', NEW.booking_id, TG_TABLE_NAME
+                USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""", """
+CREATE OR REPLACE FUNCTION vallebot_booking_delete() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM enrollments WHERE booking_id = OLD.id;
+    IF EXISTS (SELECT 1 FROM payments WHERE booking_id = OLD.id) THEN
+        RAISE EXCEPTION 'booking % tiene pagos asociados', OLD.id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql
+""", """
+CREATE OR REPLACE FUNCTION vallebot_messages_wamid_unique() RETURNS trigger AS $$
+BEGIN
+    IF NEW.wa_message_id IS NOT NULL THEN
+        -- serializa a quienes escriben el mismo wamid: el segundo ve la fila del primero
+        PERFORM pg_advisory_xact_lock(hashtext('messages.wa_message_id'), hashtext(NEW.wa_message_id));
+        IF EXISTS (SELECT 1 FROM messages WHERE wa_message_id = NEW.wa_message_id AND id <> NEW.id) THEN
+            RAISE EXCEPTION 'wa_message_id % duplicado', NEW.wa_message_id
+                USING ERRCODE = 'unique_violation';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""")
+
+# (tabla particionada, tabla con el trigger, nombre, momento y eventos, función)
+INTEGRITY_TRIGGERS: Sequence[tuple[str, str, str, str, str]] = (
+    ("bookings", "enrollments", "trg_enrollments_booking_fk", "BEFORE INSERT OR UPDATE OF booking_id",
+     "vallebot_booking_ref_check"),
+    ("bookings", "payments", "trg_payments_booking_fk", "BEFORE INSERT OR UPDATE OF booking_id",
+     "vallebot_booking_ref_check"),
+    ("bookings", "bookings", "trg_bookings_fk_delete", "BEFORE DELETE", "vallebot_booking_delete"),
+    ("messages", "messages", "trg_messages_wamid_unique", "BEFORE INSERT OR UPDATE OF wa_message_id",
+     "vallebot_messages_wamid_unique"),
+)
+
+
+async def install_integrity(conn) -> None:
+    """Triggers de INTEGRITY_SQL, sólo donde la tabla está particionada (idempotente)."""
+    for sql in INTEGRITY_SQL:
+        await conn.execute(text(sql))
+    for partitioned, table, name, when, fn in INTEGRITY_TRIGGERS:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        if await _is_partitioned(conn, partitioned):
+            await conn.execute(text(f"CREATE TRIGGER {name} {when} ON {table} FOR EACH ROW EXECUTE FUNCTION {fn}()"))
+
+
+# ---------------------------------------------------------------------------
+# Operaciones sobre una base existente
+# ---------------------------------------------------------------------------
+async def _is_partitioned(conn, table: str) -> bool:
+    # relkind es "char": asyncpg lo devuelve como bytes si no se castea
+    res = await conn.execute(text("SELECT relkind::text FROM pg_class WHERE relname = :t"), {"t": table})
+    return res.scalar_one_or_none() == "p"
+
+
+async def convert(conn, table_name: str) -> None:
+    """
+    Convierte una tabla existente en particionada (una transacción, con la tabla
+    bloqueada durante la copia). La tabla vieja queda como `<tabla>_legacy`.
+    """
+    from app.db import install_triggers
+
+    if table_name not in PARTITIONED_TABLES:
+        raise SystemExit(f"{table_name} no está en {PARTITIONED_TABLES}")
+    if await _is_partitioned(conn, table_name):
+        print(f"{table_name} ya está particionada")
+        return
+    table = Base.metadata.tables[table_name]
+    legacy = f"{table_name}_legacy"
+
+    await conn.execute(text(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE"))
+    # FKs de otras tablas que apuntan a esta (no pueden apuntar a la particionada)
+    fks = (await conn.execute(text("""
+        SELECT conrelid::regclass::text AS tbl, conname
+          FROM pg_constraint
+         WHERE contype = 'f' AND confrelid = CAST(:t AS regclass)
+    """), {"t": table_name})).all()
+    for tbl, con in fks:
+        await conn.execute(text(f'ALTER TABLE {tbl} DROP CONSTRAINT "{con}"'))
+
+    await conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {legacy}"))
+    # los nombres de índices/constraints son globales: liberamos los de la tabla vieja
+    idx_names = (await conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": legacy}
+    )).scalars().all()
+    for idx in idx_names:
+        await conn.execute(text(f'ALTER INDEX "{idx}" RENAME TO "{idx[:55]}_legacy"'))
+
+    for stmt in partitioned_table_ddl(table, conn.dialect):
+        await conn.execute(text(stmt))
+
+    legacy_cols = set((await conn.execute(text("""
+        SELECT column_name FROM information_schema.columns WHERE table_name = :t
+    """), {"t": legacy})).scalars().all())
+    cols = ", ".join(c.name for c in table.columns if c.name in legacy_cols)
+    await conn.execute(text(f"INSERT INTO {table_name} ({cols}) SELECT {cols} FROM {legacy}"))
+    await conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+        f"coalesce((SELECT max(id) FROM {table_name}), 0) + 1, false)"
+    ))
+    await install_triggers(conn)
+
+
+async def move_tenant(conn, profesional_id: int, tables: Sequence[str] = PARTITIONED_TABLES) -> None:
+    """
+    Mueve un tenant grande desde la partición DEFAULT (hash) a una partición LIST propia.
+
+    Las filas viajan con INSERT + DELETE, pero no cambian: los triggers de
+    usuario (billing, agenda, NOTIFY, integridad) no deben verlo como un
+    borrado. Se apagan con `session_replication_role = replica`, local a la
+    transacción (requiere superusuario o, en PG ≥ 15, `GRANT SET ON PARAMETER`).
+    """
+    pid = int(profesional_id)
+    role = await conn.scalar(text("SELECT current_setting('session_replication_role')"))
+    await conn.execute(text("SELECT set_config('session_replication_role', 'replica', true)"))
+    await _move_tenant(conn, pid, tables)
+    # si falló, el rollback ya deshace el SET LOCAL
+    await conn.execute(text("SELECT set_config('session_replication_role', :r, true)"), {"r": role})
+
+
+async def _move_tenant(conn, pid: int, tables: Sequence[str]) -> None:
+    for t in tables:
+        if not await _is_partitioned(conn, t):
+            raise SystemExit(f"{t} no está particionada (ejecutá `convert {t}` primero)")
+        part = f"{t}_p{pid}"
+        exists = (await conn.execute(text("SELECT 1 FROM pg_class WHERE relname = :p"), {"p": part})).first()
+        if exists:
+            print(f"{part} ya existe")
+            continue
+        # bloqueamos escrituras en la tabla mientras se mueven las filas del tenant
+        await conn.execute(text(f"LOCK TABLE {t} IN SHARE ROW EXCLUSIVE MODE"))
+        await conn.execute(text(f"CREATE TABLE {part} (LIKE {t} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        # el CHECK evita que ATTACH tenga que re-escanear la partición nueva
+        await conn.execute(text(
+            f"ALTER TABLE {part} ADD CONSTRAINT {part}_tenant CHECK ({PARTITION_KEY} IS NOT NULL AND {PARTITION_KEY} = {pid})"
+        ))
+        moved = await conn.execute(text(f"INSERT INTO {part} SELECT * FROM {t} WHERE {PARTITION_KEY} = {pid}"))
+        await conn.execute(text(f"DELETE FROM {t} WHERE {PARTITION_KEY} = {pid}"))
+        await conn.execute(text(f"ALTER TABLE {t} ATTACH PARTITION {part} FOR VALUES IN ({pid})"))
+        print(f"{t}: {moved.rowcount} filas → {part}")
+
+
+async def pruned_partitions(conn, table: str, profesional_id: int) -> list[str]:
+    """Particiones que el planner efectivamente escanea para `profesional_id = X`."""
+    plan = (await conn.execute(text(
+        f"EXPLAIN (FORMAT JSON) SELECT * FROM {table} WHERE {PARTITION_KEY} = {int(profesional_id)}"
+    ))).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found: list[str] = []
+
+    def walk(node: dict) -> None:
+        if "Relation Name" in node:
+            found.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return found
+
+
+async def check(conn, profesional_id: int) -> bool:
+    ok = True
+    for t in PARTITIONED_TABLES:
+        if not await _is_partitioned(conn, t):
+            print(f"{t:<20} sin particionar")
+            ok = False
+            continue
+        parts = await pruned_partitions(conn, t, profesional_id)
+        pruned = len(parts) == 1
+        ok &= pruned
+        print(f"{t:<20} {'OK' if pruned else 'SIN PODA'}  → {', '.join(parts)}")
+    return ok
+
+
+async def status(conn) -> None:
+    rows = (await conn.execute(text("""
+        SELECT parent.relname AS parent, child.relname AS part,
+               pg_get_expr(child.relpartbound, child.oid) AS bound,
+               child.reltuples::bigint AS rows_est
+          FROM pg_inherits i
+          JOIN pg_class parent ON parent.oid = i.inhparent
+          JOIN pg_class child  ON child.oid  = i.inhrelid
+         WHERE parent.relname = ANY(:tables) OR parent.relname LIKE ANY(:defaults)
+         ORDER BY parent.relname, child.relname
+    """), {
+        "tables": list(PARTITIONED_TABLES),
+        "defaults": [f"{t}_default" for t in PARTITIONED_TABLES],
+    })).all()
+    for r in rows:
+        print(f"{r.parent:<28} {r.part:<32} {r.bound:<50} ~{max(r.rows_est, 0)} filas")
+
+
+def main(argv: list[str] | None = None) -> None:
+    from app.db import engine
+
+    parser = argparse.ArgumentParser(description="Particionado por profesional_id")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_conv = sub.add_parser("convert", help="convierte una tabla existente en particionada")
+    p_conv.add_argument("tables", nargs="*", default=list(PARTITIONED_TABLES))
+    p_move = sub.add_parser("move-tenant", help="mueve un tenant a su propia partición")
+    p_move.add_argument("profesional_id", type=int)
+    p_check = sub.add_parser("check", help="verifica partition pruning para un tenant")
+    p_check.add_argument("profesional_id", type=int)
+    sub.add_parser("status", help="lista particiones")
+    args = parser.parse_args(argv)
+
+    async def _run() -> int:
+        async with engine.begin() as conn:
+            if args.cmd == "convert":
+                for t in args.tables:
+                    await convert(conn, t)
+            elif args.cmd == "move-tenant":
+                await move_tenant(conn, args.profesional_id)
+            elif args.cmd == "check":
+                return 0 if await check(conn, args.profesional_id) else 1
+            else:
+                await status(conn)
+        return 0
+
+    raise SystemExit(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# app/pg_events.py
+"""
+Escucha de cambios vía LISTEN/NOTIFY de Postgres.
+
+Los triggers instalados en init_db (`NOTIFY_TARGETS`) publican
+{"op", "id", "profesional_id"} en un canal por tabla. Este listener mantiene
+una conexión asyncpg dedicada (fuera del pool de SQLAlchemy), se reconecta
+si se cae y reparte cada evento a los handlers suscriptos.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from app.db import engine
+
+logger = logging.getLogger("pg_events")
+
+Handler = Callable[[dict], Awaitable[None] | None]
+
+
+def raw_dsn() -> str:
+    """DSN para asyncpg a partir del DATABASE_URL de SQLAlchemy."""
+    return engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class PgEventListener:
+    def __init__(self, reconnect_delay_s: float = 2.0):
+        self._handlers: dict[str, list[Handler]] = defaultdict(list)
+        self._conn: asyncpg.Connection | None = None
+        self._task: asyncio.Task | None = None
+        self._reconnect_delay_s = reconnect_delay_s
+        self._on_reconnect: list[Callable[[], Awaitable[None] | None]] = []
+        # El loop sólo guarda referencias débiles a las tareas: las retenemos hasta que terminen
+        self._handler_tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel].append(handler)
+
+    def on_reconnect(self, fn: Callable[[], Awaitable[None] | None]) -> None:
+        """Callback tras (re)conectar: los eventos perdidos mientras tanto no se reenvían."""
+        self._on_reconnect.append(fn)
+
+    def _dispatch(self, _conn, _pid, channel: str, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Payload inválido en %s: %r", channel, payload)
+            return
+        for handler in self._handlers.get(channel, ()):
+            try:
+                res = handler(event)
+                if asyncio.iscoroutine(res):
+                    task = asyncio.create_task(res, name=f"pg-events:{channel}")
+                    self._handler_tasks.add(task)
+                    task.add_done_callback(self._handler_done)
+            except Exception:
+                logger.exception("Handler de %s falló", channel)
+
+    def _handler_done(self, task: asyncio.Task) -> None:
+        self._handler_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Handler %s falló", task.get_name(), exc_info=task.exception())
+
+    async def _run(self) -> None:
+        first = True
+        while True:
+            try:
+                self._conn = await asyncpg.connect(raw_dsn())
+                for channel in self._handlers:
+                    await self._conn.add_listener(channel, self._dispatch)
+                logger.info("Escuchando %s", ", ".join(self._handlers))
+                if not first:
+                    for fn in self._on_reconnect:
+                        res = fn()
+                        if asyncio.iscoroutine(res):
+                            await res
+                first = False
+                # La conexión queda abierta; detectamos caídas con un ping periódico
+                while not self._conn.is_closed():
+                    await asyncio.sleep(5)
+                    await self._conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener desconectado; reintento en %.1fs", self._reconnect_delay_s)
+            finally:
+                if self._conn is not None and not self._conn.is_closed():
+                    await self._conn.close()
+                self._conn = None
+            await asyncio.sleep(self._reconnect_delay_s)
+
+    async def start(self) -> None:
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._run(), name="pg-events")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._handler_tasks):
+            task.cancel()
+        await asyncio.gather(*self._handler_tasks, return_exceptions=True)
+
+
+listener = PgEventListener()
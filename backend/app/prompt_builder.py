@@ -0,0 +1,183 @@
+# app/prompt_builder.py
+"""
+Armado de prompts compactos, con presupuesto de tokens.
+
+Orden de los mensajes (de más estable a más variable), para que el prompt
+caching del proveedor reutilice el prefijo entre llamadas:
+
+    1. system   instrucciones estáticas (idénticas en cada llamada)
+    2. system   estado de la relación (RelationshipState.state_json, JSON compacto)
+    3. user     historial reciente, del más viejo al más nuevo ("C: …" / "B: …")
+    4. user     la tarea / mensaje actual
+
+Si no entra en el presupuesto se descartan primero los mensajes más viejos
+del historial (con una marca de cuántos se omitieron); después el estado; por
+último se recorta la tarea. Los tokens se cuentan localmente con tiktoken si
+está instalado, o con una estimación conservadora si no.
+
+Por ahora el único llamador es el extractor del alta (sin estado ni
+historial): el webhook todavía no tiene una conversación profesional-cliente
+de la que cargar `state_json` y mensajes.
+"""
+from __future__ import annotations
+
+import json
+import math
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional, Sequence
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Tokens fijos por mensaje en el formato chat de OpenAI (rol + separadores)
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+_WORDS = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    enc = _encoding(model or settings.LLM_MODEL)
+    if enc is not None:
+        return len(enc.encode(text))
+    # Sin tiktoken: ~1.4 tokens por palabra/signo en español, redondeando hacia arriba
+    return math.ceil(len(_WORDS.findall(text)) * 1.4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str | None = None) -> str:
+    """Recorta `text` (conservando el final, lo más reciente) a `max_tokens`."""
+    if max_tokens <= 0:
+        return ""
+    if max_tokens == 1:
+        return "…"                          # sólo entra la marca de recorte
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    enc = _encoding(model or settings.LLM_MODEL)
+    if enc is not None:
+        return "…" + enc.decode(enc.encode(text)[-(max_tokens - 1):])
+    lo, hi = 0, len(text)
+    while lo < hi:                          # menor recorte que entra
+        mid = (lo + hi) // 2
+        if count_tokens("…" + text[mid:], model) <= max_tokens:
+            hi = mid
+        else:
+            lo = mid + 1
+    return "…" + text[lo:]
+
+
+def compact_json(data: Any) -> str:
+    """JSON sin espacios, claves ordenadas (estable entre llamadas) y sin vacíos."""
+    def prune(v):
+        if isinstance(v, dict):
+            return {k: p for k, p in ((k, prune(x)) for k, x in v.items()) if p not in (None, "", [], {})}
+        if isinstance(v, list):
+            return [prune(x) for x in v if x not in (None, "", [], {})]
+        if isinstance(v, float):
+            return round(v, 2)
+        return v
+    return json.dumps(prune(data), ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def history_line(direction: str, text: str) -> str:
+    who = "C" if direction == "IN" else "B"
+    return f"{who}: {' '.join(text.split())}"
+
+
+@dataclass
+class Prompt:
+    messages: list[dict[str, str]]
+    prompt_tokens: int                       # estimación local (antes de llamar)
+    budget: int
+    history_used: int = 0
+    history_dropped: int = 0
+    state_dropped: bool = False
+    task_truncated: bool = False
+    sections: dict[str, int] = field(default_factory=dict)   # tokens por sección
+
+
+def build_prompt(
+    *,
+    system: str,
+    task: str,
+    state: Optional[dict] = None,
+    history: Sequence[tuple[str, str]] = (),
+    budget: int | None = None,
+    model: str | None = None,
+) -> Prompt:
+    """
+    `history`: (direction, text) del más viejo al más nuevo; direction IN | OUT.
+    `budget`: tokens máximos del prompt (sin contar la respuesta).
+    """
+    budget = budget or settings.LLM_PROMPT_TOKEN_BUDGET
+    cost = lambda s: count_tokens(s, model) + TOKENS_PER_MESSAGE  # noqa: E731
+
+    used = TOKENS_REPLY_PRIMING + cost(system)
+    sections = {"system": used}
+    state_msg = f"Estado de la relación (JSON): {compact_json(state)}" if state else None
+    task_tokens = cost(task)
+
+    state_dropped = False
+    if state_msg and used + cost(state_msg) + task_tokens > budget:
+        state_msg, state_dropped = None, True
+    if state_msg:
+        sections["state"] = cost(state_msg)
+        used += sections["state"]
+
+    task_truncated = False
+    if used + task_tokens > budget:
+        task = truncate_to_tokens(task, budget - used - TOKENS_PER_MESSAGE, model)
+        task_tokens, task_truncated = cost(task), True
+    sections["task"] = task_tokens
+    used += task_tokens
+
+    # Historial: del más nuevo hacia atrás mientras entre (incluida la marca de omitidos)
+    lines = [history_line(d, t) for d, t in history]
+    kept: list[str] = []
+    hist_tokens = TOKENS_PER_MESSAGE + count_tokens("Conversación reciente:", model)
+    marker_reserve = count_tokens("(99 mensajes anteriores omitidos)", model) + 1
+    for line in reversed(lines):
+        line_tokens = count_tokens(line, model) + 1          # + salto de línea
+        reserve = marker_reserve if len(kept) + 1 < len(lines) else 0
+        if used + hist_tokens + line_tokens + reserve > budget:
+            break
+        kept.append(line)
+        hist_tokens += line_tokens
+    kept.reverse()
+    dropped = len(lines) - len(kept)
+
+    messages = [{"role": "system", "content": system}]
+    if state_msg:
+        messages.append({"role": "system", "content": state_msg})
+    if kept:
+        head = [f"({dropped} mensajes anteriores omitidos)"] if dropped else []
+        content = "\n".join(["Conversación reciente:", *head, *kept])
+        messages.append({"role": "user", "content": content})
+        sections["history"] = cost(content)
+    messages.append({"role": "user", "content": task})
+
+    total = TOKENS_REPLY_PRIMING + sum(cost(m["content"]) for m in messages)
+    return Prompt(
+        messages=messages,
+        prompt_tokens=total,
+        budget=budget,
+        history_used=len(kept),
+        history_dropped=dropped,
+        state_dropped=state_dropped,
+        task_truncated=task_truncated,
+        sections=sections,
+    )
@@ -0,0 +1,269 @@
+# app/recurrence.py
+"""
+Clases grupales recurrentes con ocurrencias materializadas a demanda.
+
+`Servicio.recurrence` guarda la regla semanal:
+
+    {"semanal": [{"dia": 0, "hora": "18:00"}, {"dia": 3, "hora": "09:30"}],   # 0 = lunes
+     "desde": "2026-10-01", "hasta": null,
+     "excepciones": ["2026-12-25"],                     # días sin clase
+     "excepciones_horario": ["2026-11-10T18:00"]}       # una ocurrencia puntual
+
+En vez de pre-crear meses de `bookings`, una ocurrencia se vuelve fila real
+sólo cuando se consulta dentro del horizonte (RECURRENCE_HORIZON_DAYS desde
+hoy) o cuando alguien se inscribe. Una consulta por rango mezcla las filas
+reales con los slots virtuales que salen de expandir la regla. Editar el
+horario es actualizar la regla: sólo se limpian las ocurrencias futuras ya
+materializadas y sin inscriptos que dejaron de existir.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, Optional
+from zoneinfo import ZoneInfo
+
+from pydantic import BaseModel, Field, field_validator
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.models import Booking, BookingStatus, Enrollment, Servicio
+
+settings = get_settings()
+
+
+class RecurrenceError(ValueError):
+    """La ocurrencia pedida no existe, está llena o el rango es inválido."""
+
+
+class WeeklySlot(BaseModel):
+    dia: int = Field(ge=0, le=6)      # 0 = lunes … 6 = domingo
+    hora: time
+
+
+class RecurrenceRule(BaseModel):
+    semanal: list[WeeklySlot] = Field(min_length=1)
+    desde: date
+    hasta: Optional[date] = None
+    excepciones: list[date] = []
+    excepciones_horario: list[datetime] = []
+
+    @field_validator("hasta")
+    @classmethod
+    def _hasta_posterior(cls, v: Optional[date], info):
+        if v is not None and v < info.data.get("desde", v):
+            raise ValueError("hasta debe ser posterior a desde")
+        return v
+
+    def expand(self, desde: date, hasta: date) -> Iterator[tuple[date, time]]:
+        """Ocurrencias (fecha, hora) de la regla en [desde, hasta], en orden."""
+        start = max(desde, self.desde)
+        end = min(hasta, self.hasta) if self.hasta else hasta
+        skip_days = set(self.excepciones)
+        skip_slots = {(dt.date(), dt.time()) for dt in self.excepciones_horario}
+        by_day: dict[int, list[time]] = {}
+        for slot in self.semanal:
+            by_day.setdefault(slot.dia, []).append(slot.hora)
+        d = start
+        while d <= end:
+            if d not in skip_days:
+                for hora in sorted(by_day.get(d.weekday(), ())):
+                    if (d, hora) not in skip_slots:
+                        yield d, hora
+            d += timedelta(days=1)
+
+    def has(self, fecha: date, hora: time) -> bool:
+        return (fecha, hora) in set(self.expand(fecha, fecha))
+
+
+async def install(conn) -> None:
+    """Columna de la regla (bases existentes) + índice único de ocurrencias (idempotente)."""
+    await conn.execute(text("ALTER TABLE servicios ADD COLUMN IF NOT EXISTS recurrence jsonb"))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_booking_unique_clase "
+        "ON bookings (profesional_id, servicio_id, fecha, hora) WHERE cliente_id IS NULL"
+    ))
+
+
+def rule_of(servicio: Servicio) -> Optional[RecurrenceRule]:
+    return RecurrenceRule.model_validate(servicio.recurrence) if servicio.recurrence else None
+
+
+def today() -> date:
+    return datetime.now(ZoneInfo(settings.SCHEDULER_TZ)).date()
+
+
+def _slot(servicio: Servicio, fecha: date, hora: time, booking: Booking | None = None) -> dict:
+    if booking is None:
+        return {
+            "booking_id": None,
+            "virtual": True,
+            "fecha": fecha.isoformat(),
+            "hora": hora.strftime("%H:%M"),
+            "status": BookingStatus.CONFIRMED.value,
+            "capacity_used": 0,
+            "capacity_total": servicio.capacidad,
+        }
+    return {
+        "booking_id": booking.id,
+        "virtual": False,
+        "fecha": booking.fecha.isoformat(),
+        "hora": booking.hora.strftime("%H:%M"),
+        "status": booking.status.value,
+        "capacity_used": booking.capacity_used,
+        "capacity_total": booking.capacity_total,
+    }
+
+
+async def _materialize_many(session: AsyncSession, servicio: Servicio, slots: list[tuple[date, time]]) -> None:
+    if not slots:
+        return
+    await session.execute(
+        pg_insert(Booking)
+        .values([
+            {
+                "servicio_id": servicio.id,
+                "profesional_id": servicio.profesional_id,
+                "fecha": fecha,
+                "hora": hora,
+                "cliente_id": None,
+                "tipo": "clase",
+                "status": BookingStatus.CONFIRMED,
+                "capacity_used": 0,
+                "capacity_total": servicio.capacidad,
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow(),
+            }
+            for fecha, hora in slots
+        ])
+        .on_conflict_do_nothing(
+            index_elements=["profesional_id", "servicio_id", "fecha", "hora"],
+            index_where=Booking.cliente_id.is_(None),
+        )
+    )
+
+
+async def list_occurrences(
+    session: AsyncSession, servicio: Servicio, desde: date, hasta: date, *, materialize: bool = True,
+) -> list[dict]:
+    """
+    Ocurrencias de la clase en [desde, hasta]: filas reales + slots virtuales de
+    la regla. Con `materialize`, los slots dentro del horizonte se crean como filas.
+    """
+    if hasta < desde:
+        raise RecurrenceError("hasta debe ser posterior a desde")
+    if (hasta - desde).days > settings.RECURRENCE_MAX_RANGE_DAYS:
+        raise RecurrenceError(f"rango máximo: {settings.RECURRENCE_MAX_RANGE_DAYS} días")
+    rule = rule_of(servicio)
+    expanded = list(rule.expand(desde, hasta)) if rule else []
+
+    async def _real() -> dict[tuple[date, time], Booking]:
+        res = await session.execute(
+            select(Booking)
+            .where(
+                Booking.profesional_id == servicio.profesional_id,
+                Booking.servicio_id == servicio.id,
+                Booking.cliente_id.is_(None),
+                Booking.fecha.between(desde, hasta),
+            )
+            .execution_options(populate_existing=True)
+        )
+        return {(b.fecha, b.hora): b for b in res.scalars()}
+
+    real = await _real()
+    if materialize:
+        hoy = today()
+        limite = hoy + timedelta(days=settings.RECURRENCE_HORIZON_DAYS)
+        missing = [(f, h) for f, h in expanded if hoy <= f <= limite and (f, h) not in real]
+        if missing:
+            await _materialize_many(session, servicio, missing)
+            await session.commit()
+            real = await _real()
+
+    merged = {key: _slot(servicio, *key, b) for key, b in real.items()}
+    for key in expanded:
+        merged.setdefault(key, _slot(servicio, *key))
+    return [merged[k] for k in sorted(merged)]
+
+
+async def materialize(session: AsyncSession, servicio: Servicio, fecha: date, hora: time) -> Booking:
+    """Fila real de la ocurrencia (la crea si la regla la define). Queda bloqueada FOR UPDATE."""
+    stmt = (
+        select(Booking)
+        .where(
+            Booking.profesional_id == servicio.profesional_id,
+            Booking.servicio_id == servicio.id,
+            Booking.cliente_id.is_(None),
+            Booking.fecha == fecha,
+            Booking.hora == hora,
+        )
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    booking = await session.scalar(stmt)
+    if booking is not None:
+        return booking
+    rule = rule_of(servicio)
+    if rule is None or not rule.has(fecha, hora):
+        raise RecurrenceError("No hay clase en ese día y horario")
+    await _materialize_many(session, servicio, [(fecha, hora)])
+    return await session.scalar(stmt)
+
+
+async def enroll(session: AsyncSession, servicio: Servicio, fecha: date, hora: time, cliente_id: int) -> Booking:
+    """Inscribe al cliente en la ocurrencia, materializándola si hace falta."""
+    if fecha < today():
+        raise RecurrenceError("La clase ya pasó")
+    booking = await materialize(session, servicio, fecha, hora)
+    if booking.status == BookingStatus.CANCELLED:
+        raise RecurrenceError("La clase está cancelada")
+    enrolled = await session.scalar(
+        select(Enrollment.id).where(Enrollment.booking_id == booking.id, Enrollment.cliente_id == cliente_id)
+    )
+    if enrolled is not None:
+        await session.commit()      # reintento de quien ya tiene lugar: no cuenta contra el cupo
+        return booking
+    if booking.capacity_total is not None and booking.capacity_used >= booking.capacity_total:
+        raise RecurrenceError("No quedan lugares en esa clase")
+    res = await session.execute(
+        pg_insert(Enrollment)
+        .values(booking_id=booking.id, cliente_id=cliente_id, status="ENROLLED", created_at=datetime.utcnow())
+        .on_conflict_do_nothing(constraint="uq_enrollment_booking_cliente")
+    )
+    if res.rowcount:
+        booking.capacity_used += 1
+    await session.commit()
+    return booking
+
+
+async def set_rule(session: AsyncSession, servicio: Servicio, rule: RecurrenceRule | None) -> int:
+    """
+    Reemplaza la regla. Borra las ocurrencias futuras materializadas, sin
+    inscriptos, que la regla nueva ya no genera. Devuelve cuántas borró.
+    """
+    servicio.recurrence = rule.model_dump(mode="json") if rule else None
+    hoy = today()
+    res = await session.execute(
+        select(Booking.id, Booking.fecha, Booking.hora)
+        .where(
+            Booking.profesional_id == servicio.profesional_id,
+            Booking.servicio_id == servicio.id,
+            Booking.cliente_id.is_(None),
+            Booking.fecha >= hoy,
+            Booking.capacity_used == 0,
+        )
+    )
+    rows = res.all()
+    if rows and rule is not None:
+        last = max(r.fecha for r in rows)
+        keep = set(rule.expand(hoy, last))
+        stale = [r.id for r in rows if (r.fecha, r.hora) not in keep]
+    else:
+        stale = [r.id for r in rows]
+    if stale:
+        await session.execute(
+            delete(Booking).where(Booking.profesional_id == servicio.profesional_id, Booking.id.in_(stale))
+        )
+    await session.commit()
+    return len(stale)
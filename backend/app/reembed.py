@@ -0,0 +1,379 @@
+# app/reembed.py
+"""
+Migración online de embeddings cuando cambia el modelo (EMBEDDING_MODEL / EMBEDDING_DIM).
+
+Fases por tabla (checkpoint en `embedding_migrations`, se puede cortar y relanzar):
+
+1. shadow   → agrega `<col>_next vector(<dim>)` y un trigger que la pone en NULL
+               si cambia el texto fuente (así las escrituras en vivo se re-embeben).
+2. backfill → recorre la tabla por id en lotes, embebe con el modelo nuevo y
+               guarda `last_id` en la misma transacción. Pausa entre lotes para
+               no quitarle conexiones/CPU al tráfico normal.
+3. index    → crea el índice ANN sobre la columna nueva (CONCURRENTLY), y
+               también los parciales por profesional de context_search.
+4. ready    → listo para `switch`.
+
+`switch` hace, en UNA transacción para todas las tablas: bloquea escrituras,
+embebe las filas que quedaron en NULL, renombra `<col>` → `<col>_prev` y
+`<col>_next` → `<col>`. Inmediatamente después hay que desplegar la app con
+el nuevo EMBEDDING_MODEL / EMBEDDING_DIM. `cleanup` borra las columnas `_prev`.
+
+Uso:
+    python -m app.reembed run --model sentence-transformers/all-MiniLM-L6-v2
+    python -m app.reembed status
+    python -m app.reembed switch --model sentence-transformers/all-MiniLM-L6-v2
+    python -m app.reembed cleanup
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+from sentence_transformers import SentenceTransformer
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.db import HNSW_INDEX_TARGETS, INDEX_TARGETS, SessionLocal, _opclass, engine, hnsw_using
+from app.models import EmbeddingMigration
+
+settings = get_settings()
+logger = logging.getLogger("reembed")
+
+
+@dataclass(frozen=True)
+class Target:
+    table: str
+    column: str
+    source_cols: tuple[str, ...]   # columnas que, si cambian, invalidan el vector
+    source_sql: str                # texto a embeber (SQL)
+
+    @property
+    def shadow(self) -> str:
+        return f"{self.column}_next"
+
+    @property
+    def prev(self) -> str:
+        return f"{self.column}_prev"
+
+    @property
+    def index(self) -> Optional[str]:
+        return {(t, c): idx for t, c, idx in (*INDEX_TARGETS, *HNSW_INDEX_TARGETS)}.get((self.table, self.column))
+
+    @property
+    def index_using(self) -> str:
+        if any((t, c) == (self.table, self.column) for t, c, _ in HNSW_INDEX_TARGETS):
+            return hnsw_using(self.shadow)
+        return f"ivfflat ({self.shadow} {_opclass()}) WITH (lists={settings.PGVECTOR_INDEX_LISTS})"
+
+    @property
+    def trigger(self) -> str:
+        return f"trg_reembed_{self.table}"
+
+
+TARGETS: Sequence[Target] = (
+    # mismo texto que embedding_service.texto_profesional
+    Target(
+        "profesionales", "embedding", ("nombre", "especialidad", "bio"),
+        "nombre || '. Especialidad: ' || coalesce(especialidad, '') || '. ' || coalesce(bio, '')",
+    ),
+    Target("servicios", "embedding", ("nombre", "ubicacion_text"), "nombre || '. ' || coalesce(ubicacion_text, '')"),
+    Target("clientes", "embedding", ("nombre", "notas"), "nombre || '. ' || coalesce(notas, '')"),
+    Target("relationship_state", "summary_embedding", ("summary_text",), "summary_text"),
+)
+
+
+def _vec_literal(vec) -> str:
+    return "[" + ",".join(f"{float(v):.6f}" for v in vec) + "]"
+
+
+async def _get_state(session: AsyncSession, t: Target, model: str, dim: int) -> EmbeddingMigration:
+    res = await session.execute(
+        select(EmbeddingMigration).where(
+            EmbeddingMigration.table_name == t.table,
+            EmbeddingMigration.column_name == t.column,
+            EmbeddingMigration.model == model,
+        )
+    )
+    st = res.scalar_one_or_none()
+    if st is None:
+        st = EmbeddingMigration(table_name=t.table, column_name=t.column, model=model, dim=dim, phase="shadow")
+        session.add(st)
+        await session.commit()
+    elif st.dim != dim:
+        raise SystemExit(f"{t.table}: migración previa de {model} usa dim={st.dim}, no {dim}")
+    return st
+
+
+# ---------------------------------------------------------------------------
+# Fases
+# ---------------------------------------------------------------------------
+async def _phase_shadow(session: AsyncSession, t: Target, st: EmbeddingMigration) -> None:
+    changed = " OR ".join(f"NEW.{c} IS DISTINCT FROM OLD.{c}" for c in t.source_cols)
+    await session.execute(text(f"ALTER TABLE {t.table} ADD COLUMN IF NOT EXISTS {t.shadow} vector({st.dim})"))
+    await session.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {t.trigger}_fn() RETURNS trigger AS $$
+        BEGIN
+          IF TG_OP = 'INSERT' OR {changed} THEN
+            NEW.{t.shadow} := NULL;
+          END IF;
+          RETURN NEW;
+        END $$ LANGUAGE plpgsql
+    """))
+    await session.execute(text(f"DROP TRIGGER IF EXISTS {t.trigger} ON {t.table}"))
+    await session.execute(text(
+        f"CREATE TRIGGER {t.trigger} BEFORE INSERT OR UPDATE ON {t.table} "
+        f"FOR EACH ROW EXECUTE FUNCTION {t.trigger}_fn()"
+    ))
+    st.rows_total = await session.scalar(text(f"SELECT count(*) FROM {t.table}")) or 0
+    st.phase = "backfill"
+    await session.commit()
+
+
+async def _embed_rows(session: AsyncSession, t: Target, model: SentenceTransformer, rows, batch_size: int) -> None:
+    vecs = await asyncio.to_thread(model.encode, [r[1] for r in rows], batch_size=batch_size)
+    await session.execute(
+        text(f"UPDATE {t.table} SET {t.shadow} = CAST(:v AS vector) WHERE id = :id"),
+        [{"id": r[0], "v": _vec_literal(v)} for r, v in zip(rows, vecs)],
+    )
+
+
+async def _phase_backfill(
+    session: AsyncSession, t: Target, st: EmbeddingMigration, model: SentenceTransformer,
+    batch_size: int, pause: float,
+) -> None:
+    # 1) pasada principal por id (reanudable desde last_id)
+    while True:
+        rows = (await session.execute(
+            text(f"SELECT id, {t.source_sql} FROM {t.table} WHERE id > :last ORDER BY id LIMIT :n"),
+            {"last": st.last_id, "n": batch_size},
+        )).all()
+        if not rows:
+            break
+        t0 = time.perf_counter()
+        await _embed_rows(session, t, model, rows, batch_size)
+        st.last_id = rows[-1][0]
+        st.rows_done += len(rows)
+        await session.commit()   # checkpoint atómico con los vectores del lote
+        total = max(st.rows_total, st.rows_done)
+        logger.info(
+            "%s: %d/%d (%.0f%%) — lote %d filas en %.2fs",
+            t.table, st.rows_done, total, 100.0 * st.rows_done / total, len(rows), time.perf_counter() - t0,
+        )
+        if pause:
+            await asyncio.sleep(pause)
+
+    # 2) filas insertadas/modificadas durante la pasada (el trigger las dejó en NULL)
+    pending = await _backfill_nulls(session, t, model, batch_size, pause)
+    if pending:
+        logger.info("%s: %d filas re-embebidas por cambios concurrentes", t.table, pending)
+    st.phase = "index"
+    await session.commit()
+
+
+async def _backfill_nulls(
+    session: AsyncSession, t: Target, model: SentenceTransformer, batch_size: int, pause: float = 0.0,
+) -> int:
+    done = 0
+    while True:
+        rows = (await session.execute(
+            text(f"SELECT id, {t.source_sql} FROM {t.table} WHERE {t.shadow} IS NULL ORDER BY id LIMIT :n"),
+            {"n": batch_size},
+        )).all()
+        if not rows:
+            return done
+        await _embed_rows(session, t, model, rows, batch_size)
+        await session.commit()
+        done += len(rows)
+        if pause:
+            await asyncio.sleep(pause)
+
+
+async def _index_valid(conn, name: str) -> Optional[bool]:
+    """None si el índice no existe; False si quedó INVALID (un CONCURRENTLY cortado a la mitad)."""
+    return await conn.scalar(text("""
+        SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE c.relname = :n
+    """), {"n": name})
+
+
+async def _tenant_indexes(conn, t: Target, suffix: str = "") -> list[tuple[str, str]]:
+    """
+    Índices parciales por profesional `<index>_p<id>` (los crea
+    `python -m app.context_search index-tenant`): [(nombre, predicado)].
+    """
+    if not t.index:
+        return []
+    res = await conn.execute(text("""
+        SELECT c.relname, pg_get_expr(i.indpred, i.indrelid)
+          FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE c.relname ~ :pat
+         ORDER BY c.relname
+    """), {"pat": f"^{t.index}_p[0-9]+{suffix}$"})
+    return [(name, pred) for name, pred in res.all()]
+
+
+async def _index_names(conn, t: Target) -> list[str]:
+    """Índice ANN de la columna + sus parciales por profesional (se migran todos juntos)."""
+    if not t.index:
+        return []
+    return [t.index, *(name for name, _ in await _tenant_indexes(conn, t))]
+
+
+async def _missing_next(conn, t: Target) -> list[str]:
+    return [f"{n}_next" for n in await _index_names(conn, t) if not await _index_valid(conn, f"{n}_next")]
+
+
+async def _phase_index(session: AsyncSession, t: Target, st: EmbeddingMigration) -> None:
+    # CONCURRENTLY espera a todas las transacciones abiertas, también a la de
+    # `session` (cualquier SELECT previo la deja abierta): sin esto se bloquea sola
+    await session.commit()
+    if t.index:
+        # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            relkind = (await conn.execute(
+                text("SELECT relkind::text FROM pg_class WHERE relname = :t"), {"t": t.table}
+            )).scalar_one()
+            # las tablas particionadas no admiten CONCURRENTLY (se indexa cada partición)
+            concurrently = "" if relkind == "p" else "CONCURRENTLY "
+            for base, where in [(t.index, None), *await _tenant_indexes(conn, t)]:
+                name = f"{base}_next"
+                # un build interrumpido deja el índice INVALID: IF NOT EXISTS lo saltearía
+                if await _index_valid(conn, name) is False:
+                    logger.warning("%s: índice %s inválido (build interrumpido), se reconstruye", t.table, name)
+                    await conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+                logger.info("%s: creando índice %s", t.table, name)
+                await conn.execute(text(
+                    f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {t.table} USING {t.index_using}"
+                    + (f" WHERE {where}" if where else "")
+                ))
+    st.phase = "ready"
+    await session.commit()
+
+
+# ---------------------------------------------------------------------------
+# Comandos
+# ---------------------------------------------------------------------------
+async def run(model_name: str, dim: int | None, batch_size: int, pause: float) -> None:
+    model = SentenceTransformer(model_name, device=settings.EMBEDDING_DEVICE)
+    model_dim = model.get_sentence_embedding_dimension()
+    if dim is not None and dim != model_dim:
+        raise SystemExit(f"--dim={dim} pero el modelo produce vectores de {model_dim}")
+
+    async with SessionLocal() as session:
+        for t in TARGETS:
+            st = await _get_state(session, t, model_name, model_dim)
+            if st.phase == "shadow":
+                await _phase_shadow(session, t, st)
+            if st.phase == "backfill":
+                await _phase_backfill(session, t, st, model, batch_size, pause)
+            if st.phase == "ready" and await _missing_next(session, t):
+                st.phase = "index"          # falta un índice, quedó inválido o hay un parcial nuevo
+            if st.phase == "index":
+                await _phase_index(session, t, st)
+            logger.info("%s: fase %s", t.table, st.phase)
+
+
+async def switch(model_name: str, batch_size: int) -> None:
+    model = SentenceTransformer(model_name, device=settings.EMBEDDING_DEVICE)
+    async with SessionLocal() as session:
+        states = [await _get_state(session, t, model_name, model.get_sentence_embedding_dimension()) for t in TARGETS]
+        not_ready = [st.table_name for st in states if st.phase != "ready"]
+        if not_ready:
+            raise SystemExit(f"Tablas sin terminar: {', '.join(not_ready)} (ejecutá `run` primero)")
+        broken = [name for t in TARGETS for name in await _missing_next(session, t)]
+        if broken:
+            raise SystemExit(f"Índices faltantes o inválidos: {', '.join(broken)} (ejecutá `run` de nuevo)")
+
+        # Achicamos la ventana con escrituras bloqueadas
+        for t in TARGETS:
+            await _backfill_nulls(session, t, model, batch_size)
+
+        index_names = {t.table: await _index_names(session, t) for t in TARGETS}
+
+        # Todo en una transacción: o se conmutan las cuatro tablas o ninguna
+        for t in TARGETS:
+            await session.execute(text(f"LOCK TABLE {t.table} IN SHARE ROW EXCLUSIVE MODE"))
+        for t in TARGETS:
+            rows = (await session.execute(
+                text(f"SELECT id, {t.source_sql} FROM {t.table} WHERE {t.shadow} IS NULL")
+            )).all()
+            if rows:
+                await _embed_rows(session, t, model, rows, batch_size)
+            await session.execute(text(f"DROP TRIGGER IF EXISTS {t.trigger} ON {t.table}"))
+            await session.execute(text(f"DROP FUNCTION IF EXISTS {t.trigger}_fn()"))
+            await session.execute(text(f"ALTER TABLE {t.table} RENAME COLUMN {t.column} TO {t.prev}"))
+            await session.execute(text(f"ALTER TABLE {t.table} ALTER COLUMN {t.prev} DROP NOT NULL"))
+            await session.execute(text(f"ALTER TABLE {t.table} RENAME COLUMN {t.shadow} TO {t.column}"))
+            await session.execute(text(f"ALTER TABLE {t.table} ALTER COLUMN {t.column} SET NOT NULL"))
+            for name in index_names[t.table]:
+                await session.execute(text(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_prev"))
+                await session.execute(text(f"ALTER INDEX IF EXISTS {name}_next RENAME TO {name}"))
+        for st in states:
+            st.phase = "switched"
+        await session.commit()
+    logger.info(
+        "Switch completo. Desplegá con EMBEDDING_MODEL=%s EMBEDDING_DIM=%s",
+        model_name, model.get_sentence_embedding_dimension(),
+    )
+
+
+async def cleanup() -> None:
+    async with SessionLocal() as session:
+        for t in TARGETS:
+            if t.index:
+                await session.execute(text(f"DROP INDEX IF EXISTS {t.index}_prev"))
+            for name, _ in await _tenant_indexes(session, t, suffix="_prev"):
+                await session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            await session.execute(text(f"ALTER TABLE {t.table} DROP COLUMN IF EXISTS {t.prev}"))
+        await session.commit()
+
+
+async def status() -> None:
+    async with SessionLocal() as session:
+        res = await session.execute(select(EmbeddingMigration).order_by(EmbeddingMigration.id))
+        for st in res.scalars():
+            pct = 100.0 * st.rows_done / st.rows_total if st.rows_total else 0.0
+            print(
+                f"{st.model:<50} {st.table_name:<20} {st.phase:<9} "
+                f"{st.rows_done:>9}/{st.rows_total:<9} ({pct:5.1f}%) last_id={st.last_id} "
+                f"actualizado={st.updated_at:%Y-%m-%d %H:%M:%S}"
+            )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-embedding online al cambiar de modelo")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="columnas shadow + backfill + índices (reanudable)")
+    p_run.add_argument("--model", required=True)
+    p_run.add_argument("--dim", type=int, default=None, help="validación opcional de la dimensión")
+    p_run.add_argument("--batch-size", type=int, default=256)
+    p_run.add_argument("--pause", type=float, default=0.2, help="segundos de pausa entre lotes")
+
+    p_sw = sub.add_parser("switch", help="conmuta lecturas a las columnas nuevas (atómico)")
+    p_sw.add_argument("--model", required=True)
+    p_sw.add_argument("--batch-size", type=int, default=256)
+
+    sub.add_parser("status", help="progreso de la migración")
+    sub.add_parser("cleanup", help="borra columnas e índices *_prev tras el switch")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "run":
+        asyncio.run(run(args.model, args.dim, args.batch_size, args.pause))
+    elif args.cmd == "switch":
+        asyncio.run(switch(args.model, args.batch_size))
+    elif args.cmd == "status":
+        asyncio.run(status())
+    else:
+        asyncio.run(cleanup())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    main()
@@ -0,0 +1,62 @@
+# app/routers/agenda.py
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.db import get_session
+from app import agenda
+
+settings = get_settings()
+router = APIRouter(prefix="/profesionales", tags=["agenda"])
+
+async def _feed(
+    session: AsyncSession,
+    profesional_id: int,
+    fmt: str,
+    desde: date | None,
+    hasta: date | None,
+    if_none_match: str | None,
+) -> Response:
+    if fmt not in agenda.FORMATS:
+        raise HTTPException(400, f"format inválido (disponibles: {', '.join(agenda.FORMATS)})")
+    desde = desde or datetime.now(ZoneInfo(settings.SCHEDULER_TZ)).date()
+    hasta = hasta or desde + timedelta(days=settings.AGENDA_DEFAULT_DAYS)
+    if hasta < desde:
+        raise HTTPException(400, "hasta debe ser posterior a desde")
+
+    rendered = await agenda.render(session, profesional_id, fmt, desde, hasta, if_none_match)
+    if rendered is None:
+        raise HTTPException(404, "Profesional inexistente")
+    headers = {"ETag": rendered.etag, "Cache-Control": "no-cache", "X-Agenda-Version": str(rendered.version)}
+    if agenda.etag_matches(if_none_match, rendered.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(rendered.body, media_type=rendered.media_type, headers=headers)
+
+@router.get("/{profesional_id}/agenda", summary="Agenda del profesional (JSON / iCalendar, o delta con ?since=)")
+async def agenda_feed(
+    profesional_id: int,
+    fmt: str = Query("json", alias="format"),
+    desde: date | None = None,
+    hasta: date | None = None,
+    since: int | None = None,
+    if_none_match: str | None = Header(default=None),
+    session: AsyncSession = Depends(get_session),
+):
+    if since is not None:
+        d = await agenda.delta(session, profesional_id, since)
+        if d is None:
+            raise HTTPException(404, "Profesional inexistente")
+        return d
+    return await _feed(session, profesional_id, fmt, desde, hasta, if_none_match)
+
+@router.get("/{profesional_id}/agenda.ics", summary="Agenda en iCalendar (suscripción desde calendarios)")
+async def agenda_ics(
+    profesional_id: int,
+    desde: date | None = None,
+    hasta: date | None = None,
+    if_none_match: str | None = Header(default=None),
+    session: AsyncSession = Depends(get_session),
+):
+    return await _feed(session, profesional_id, "ics", desde, hasta, if_none_match)
@@ -0,0 +1,29 @@
+# app/routers/billing.py
+from datetime import date, datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_session
+from app import billing
+
+router = APIRouter(prefix="/profesionales", tags=["cobros"])
+
+@router.get("/{profesional_id}/cobros", summary="Estado de cobros del mes, por cliente")
+async def cobros_del_mes(
+    profesional_id: int,
+    mes: str | None = None,   # YYYY-MM (default: mes actual)
+    session: AsyncSession = Depends(get_session),
+):
+    try:
+        month = datetime.strptime(mes, "%Y-%m").date() if mes else date.today()
+    except ValueError:
+        raise HTTPException(400, "mes inválido: usá el formato YYYY-MM")
+    return await billing.month_summary(session, profesional_id, month)
+
+@router.get("/{profesional_id}/clientes/{cliente_id}/cobros", summary="Saldo de un cliente, por mes")
+async def saldo_cliente(
+    profesional_id: int,
+    cliente_id: int,
+    session: AsyncSession = Depends(get_session),
+):
+    return await billing.client_balance(session, profesional_id, cliente_id)
@@ -0,0 +1,70 @@
+# app/routers/clases.py
+from datetime import date, time, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_session
+from app.models import Servicio, ServicioTipo
+from app import recurrence
+from app.recurrence import RecurrenceError, RecurrenceRule
+
+router = APIRouter(prefix="/servicios", tags=["clases"])
+
+class InscripcionIn(BaseModel):
+    fecha: date
+    hora: time
+    cliente_id: int
+
+async def _clase(session: AsyncSession, servicio_id: int) -> Servicio:
+    servicio = await session.get(Servicio, servicio_id)
+    if servicio is None:
+        raise HTTPException(404, "Servicio inexistente")
+    if servicio.tipo != ServicioTipo.GRUPAL:
+        raise HTTPException(400, "El servicio no es una clase grupal")
+    return servicio
+
+@router.put("/{servicio_id}/recurrencia", summary="Define (o quita) la regla semanal de la clase")
+async def set_recurrencia(
+    servicio_id: int,
+    rule: RecurrenceRule | None = None,
+    session: AsyncSession = Depends(get_session),
+):
+    servicio = await _clase(session, servicio_id)
+    borradas = await recurrence.set_rule(session, servicio, rule)
+    return {"servicio_id": servicio_id, "recurrence": servicio.recurrence, "ocurrencias_borradas": borradas}
+
+@router.get("/{servicio_id}/ocurrencias", summary="Ocurrencias en un rango (reales + virtuales)")
+async def ocurrencias(
+    servicio_id: int,
+    desde: date | None = None,
+    hasta: date | None = None,
+    session: AsyncSession = Depends(get_session),
+):
+    servicio = await _clase(session, servicio_id)
+    desde = desde or recurrence.today()
+    hasta = hasta or desde + timedelta(days=28)
+    try:
+        items = await recurrence.list_occurrences(session, servicio, desde, hasta)
+    except RecurrenceError as e:
+        raise HTTPException(400, str(e))
+    return {"servicio_id": servicio_id, "desde": desde.isoformat(), "hasta": hasta.isoformat(), "ocurrencias": items}
+
+@router.post("/{servicio_id}/inscripciones", summary="Inscribe un cliente en una ocurrencia")
+async def inscribir(
+    servicio_id: int,
+    data: InscripcionIn,
+    session: AsyncSession = Depends(get_session),
+):
+    servicio = await _clase(session, servicio_id)
+    try:
+        booking = await recurrence.enroll(session, servicio, data.fecha, data.hora, data.cliente_id)
+    except RecurrenceError as e:
+        raise HTTPException(409, str(e))
+    return {
+        "booking_id": booking.id,
+        "fecha": booking.fecha.isoformat(),
+        "hora": booking.hora.strftime("%H:%M"),
+        "capacity_used": booking.capacity_used,
+        "capacity_total": booking.capacity_total,
+    }
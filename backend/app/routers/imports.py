@@ -0,0 +1,22 @@
+# app/routers/imports.py
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_session
+from app import import_service
+
+router = APIRouter(prefix="/profesionales", tags=["import"])
+
+@router.post("/import", summary="Importación masiva (JSON Lines o CSV en streaming)")
+async def import_profesionales(
+    request: Request,
+    fmt: str | None = Query(None, alias="format"),
+    batch_size: int | None = Query(None, ge=1, le=import_service.MAX_BATCH_SIZE),
+    session: AsyncSession = Depends(get_session),
+):
+    fmt = fmt or import_service.detect_format(request.headers.get("content-type"))
+    if fmt not in import_service.PARSERS:
+        raise HTTPException(400, "Formato no soportado: usá ?format=jsonl|csv o Content-Type text/csv / application/x-ndjson")
+
+    rows = import_service.PARSERS[fmt](request.stream())
+    report = await import_service.import_profesionales(session, rows, batch_size=batch_size)
+    return report.as_dict()
@@ -0,0 +1,28 @@
+# app/routers/relaciones.py
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_session
+from app import context_search
+from app.admission import Shed
+
+router = APIRouter(prefix="/profesionales", tags=["relaciones"])
+
+
+class ContextQuery(BaseModel):
+    query: str
+    top_k: int = Field(5, ge=1, le=50)
+
+
+@router.post("/{profesional_id}/relaciones/buscar", summary="Clientes con resúmenes de relación similares")
+async def buscar_relaciones(
+    profesional_id: int,
+    q: ContextQuery,
+    session: AsyncSession = Depends(get_session),
+):
+    try:
+        found = await context_search.search_text(session, profesional_id, q.query, q.top_k)
+    except Shed:
+        raise HTTPException(503, "Búsqueda saturada, reintentá en unos segundos", headers={"Retry-After": "5"})
+    return {"strategy": found.strategy, "results": found.results}
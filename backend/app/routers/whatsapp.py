@@ -1,20 +1,30 @@
 # app/routers/whatsapp.py
-import re, json
+import asyncio, re, json
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.db import get_session
+from app.db import get_session, SessionLocal
 from app.models import ProfessionalInvite, Profesional
-from app.embedding_service import embed_text
+from app.embedding_service import embed_text, texto_profesional
 from app.config import get_settings
 from app.llm_client import achat_completion  # tu wrapper a ollama / OpenAI
+from app.prompt_builder import build_prompt
+from app.whatsapp_sender import Recipient, apply_status_updates, notify
+from app.sender_lock import lock_sender_xact, sender_locks
+from app.media_service import ReceiptJob, pipeline as media_pipeline
+from app import admission
+from app.admission import Shed
 import logging
 settings = get_settings()
 logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger("whatsapp")
 router = APIRouter(prefix="/webhook/whatsapp", tags=["whatsapp"])
 
+# Tipos de mensaje que se tratan como comprobante de pago
+MEDIA_TYPES = ("image", "document")
+
 # Campos requeridos para crear profesional
 REQUIRED_FIELDS = ["nombre"]   # puedes añadir "telefono" si quisieras reconfirmar, etc.
 
@@ -34,27 +44,27 @@ def simple_parse(texto: str) -> dict:
         out["bio"] = m.group(1).strip()
     return out
 
-async def llm_parse_if_needed(texto: str) -> dict:
-    SYSTEM = (
+# Prefijo estático del extractor: idéntico en cada llamada (prompt caching del proveedor)
+EXTRACTOR_SYSTEM = (
     "Eres un extractor de datos. Devuelves **EXCLUSIVAMENTE** un JSON "
     "válido con estas claves: nombre, email, bio.\n"
     "- `nombre` debe tener AL MENOS dos palabras con mayúscula inicial.\n"
     "- Si no encuentras un dato, deja el valor \"\".\n"
     "NO añadas explicaciones."
-    )
+)
 
-    USER_TEMPLATE = (
-        "Extrae datos del siguiente mensaje.\n\n"
-        "MENSAJE: «{texto}»"
+async def llm_parse_if_needed(texto: str) -> dict:
+    prompt = build_prompt(
+        system=EXTRACTOR_SYSTEM,
+        task=f"Extrae datos del siguiente mensaje.\n\nMENSAJE: «{texto}»",
+    )
+    logger.info("LLM extractor: %d tokens de prompt (estimados)", prompt.prompt_tokens)
+    resp = await achat_completion(
+        messages=prompt.messages,
+        model=settings.LLM_MODEL,
+        temperature=0.0,
+        stop=None,
     )
-    
-
-    
-    resp = await achat_completion(messages=[{"role": "system", "content": SYSTEM},
-            {"role": "user", "content": USER_TEMPLATE.format(texto=texto)}],
-            model= settings.LLM_MODEL,
-            temperature=0.0,        
-            stop=None)
     try:
         return json.loads(resp)
     except Exception:
@@ -72,16 +82,49 @@ def build_missing_message(missing: list) -> str:
             "\n".join(instrucciones))
 
 @router.post("")
-async def whatsapp_webhook(payload: dict, session: AsyncSession = Depends(get_session)):
+async def whatsapp_webhook(
+    payload: dict,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_session),
+):
     """
     Recibe mensajes de WhatsApp Cloud API. Simplicado:
+    - Callbacks de estado (sent/delivered/read/failed) => actualiza `messages`
     - Identifica el número
     - Si ya es profesional => responde 'ya registrado'
     - Si invitación no consumida: agrega datos y crea cuando se completa 'nombre'
+    La respuesta se devuelve en el body y, si WHATSAPP_SEND_ENABLED, se envía por la Cloud API.
     """
+    # ---- 0. Callbacks de estado de mensajes salientes ----
+    try:
+        value = payload["entry"][0]["changes"][0]["value"]
+    except (KeyError, IndexError, TypeError):
+        value = {}
+    if value.get("statuses") and not value.get("messages"):
+        try:
+            async with admission.db.admit():
+                applied = await apply_status_updates(session, value["statuses"])
+        except Shed:
+            return _busy()
+        return {"status": "ok", "statuses": applied}
+
+    # ---- 1a. Comprobantes (imagen / PDF): se encolan y se procesan en background ----
+    message = (value.get("messages") or [{}])[0]
+    if message.get("type") in MEDIA_TYPES and message.get("from"):
+        media = message.get(message["type"]) or {}
+        if not media.get("id"):
+            return {"status": "error", "reply": "Formato WhatsApp inválido"}
+        try:
+            media_pipeline.submit(ReceiptJob(
+                media_id=media.get("id", ""), telefono=message["from"], mime_type=media.get("mime_type"),
+            ))
+        except Shed:
+            return _busy()
+        return {"status": "ok", "reply": "Recibimos tu comprobante, lo estamos procesando."}
+
     # ---- 1. Extraer mensaje y teléfono ----
     try:
-        message = payload["entry"][0]["changes"][0]["value"]["messages"][0]
+        message = value["messages"][0]
         texto = message["text"]["body"]
         telefono_from = message["from"]
     except (KeyError, IndexError):
@@ -90,44 +133,103 @@ async def whatsapp_webhook(payload: dict, session: AsyncSession = Depends(get_se
         logger.info("Whatsapp response %s",resp)
         return resp
 
-    # ---- 2. ¿Ya es profesional? ----
+    # Mensajes del mismo número: en orden; de números distintos: en paralelo
+    try:
+        async with sender_locks.hold(telefono_from):
+            resp = await _procesar_mensaje(session, texto, telefono_from)
+    except Shed as e:
+        logger.warning("Webhook descartado (%s) para %s", e, telefono_from)
+        return _busy()
+    logger.info("Whatsapp response %s",resp)
+    if settings.WHATSAPP_SEND_ENABLED:
+        background_tasks.add_task(_enviar_respuesta, telefono_from, resp)
+    return resp
+
+
+def _busy() -> JSONResponse:
+    """503 + Retry-After: la Cloud API reintenta la entrega del webhook más tarde."""
+    admission.degraded["webhook_busy"] += 1
+    return JSONResponse(
+        {"status": "busy", "reply": "Estamos procesando muchos mensajes, en breve te respondemos."},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+async def _enviar_respuesta(telefono: str, resp: dict) -> None:
+    async with SessionLocal() as session:
+        await notify(
+            session,
+            [Recipient(telefono=telefono, profesional_id=resp.get("profesional_id"))],
+            resp["reply"],
+        )
+
+
+def _ya_registrado(prof: Profesional) -> dict:
+    return {
+        "status": "ok",
+        "reply": f"Ya estás registrado como {prof.nombre}. (Alta previa)"
+    }
+
+
+def _texto_embedding(partial: dict) -> str:
+    return texto_profesional(partial['nombre'].strip(), None, partial.get('bio'))
+
+
+async def _invitacion_consumida(session: AsyncSession, telefono: str) -> dict:
+    """Otro mensaje completó el alta mientras procesábamos este."""
     prof_res = await session.execute(
-        select(Profesional).where(Profesional.telefono == telefono_from)
+        select(Profesional).where(Profesional.telefono == telefono)
     )
     prof = prof_res.scalar_one_or_none()
+    await session.commit()
     if prof:
-        resp = {
-            "status": "ok",
-            "reply": f"Ya estás registrado como {prof.nombre}. (Alta previa)"
-        }
-        logger.info("Whatsapp response %s",resp)
-        return resp
+        return _ya_registrado(prof)
+    return {
+        "status": "warning",
+        "reply": "Tu invitación figura consumida, pero no encuentro registro. Contacta al admin."
+    }
 
 
-    # ---- 3. ¿Existe invitación para ese teléfono? ----
-    inv_res = await session.execute(
-        select(ProfessionalInvite).where(ProfessionalInvite.telefono == telefono_from)
-    )
-    invite = inv_res.scalar_one_or_none()
-    if not invite:
-        resp = {
-            "status": "error",
-            "reply": "Tu número no está invitado todavía. Pide al administrador que te habilite."
-        }
-        logger.info("Whatsapp response %s",resp)
-        return resp
+async def _procesar_mensaje(session: AsyncSession, texto: str, telefono_from: str) -> dict:
+    """
+    Lógica del alta incremental. Cada tramo que usa DB / LLM / embeddings pasa
+    por su etapa de admission control; si DB o embeddings están saturados se
+    propaga `Shed` (el webhook responde 503 y la Cloud API reintenta).
+    """
+    async with admission.db.admit():
+        # ---- 2. ¿Ya es profesional? ----
+        prof_res = await session.execute(
+            select(Profesional).where(Profesional.telefono == telefono_from)
+        )
+        prof = prof_res.scalar_one_or_none()
+        if prof:
+            return _ya_registrado(prof)
 
 
-    if invite.consumed:
-        # Consistencia: debería existir profesional, pero por si no
-        resp = {
-            "status": "warning",
-            "reply": "Tu invitación figura consumida, pero no encuentro registro. Contacta al admin."
-        }
-        logger.info("Whatsapp response %s",resp)
-        return resp
+        # ---- 3. ¿Existe invitación para ese teléfono? ----
+        inv_res = await session.execute(
+            select(ProfessionalInvite).where(ProfessionalInvite.telefono == telefono_from)
+        )
+        invite = inv_res.scalar_one_or_none()
+        if not invite:
+            resp = {
+                "status": "error",
+                "reply": "Tu número no está invitado todavía. Pide al administrador que te habilite."
+            }
+            return resp
+
 
+        if invite.consumed:
+            # Consistencia: debería existir profesional, pero por si no
+            resp = {
+                "status": "warning",
+                "reply": "Tu invitación figura consumida, pero no encuentro registro. Contacta al admin."
+            }
+            return resp
 
+        # Cerramos la transacción de lectura: no la mantenemos abierta durante el LLM
+        await session.commit()
 
     # ---- 4. Parse incremental ----
     parsed = simple_parse(texto)
@@ -135,59 +237,85 @@ async def whatsapp_webhook(payload: dict, session: AsyncSession = Depends(get_se
         
     # Si falta nombre y no lo extrajo regex, podríamos intentar LLM:
     if "nombre" not in parsed:
-        llm_extra = await llm_parse_if_needed(texto)
+        try:
+            async with admission.llm.admit():
+                llm_extra = await llm_parse_if_needed(texto)
+        except Shed:
+            # Modo degradado: seguimos sólo con lo que extrajo la regex
+            admission.degraded["llm_regex_only"] += 1
+            logger.warning("LLM saturado: se usa sólo simple_parse para %s", telefono_from)
+            llm_extra = {}
         for k, v in llm_extra.items():
             if k not in parsed and v:
                 parsed[k] = v
 
-    # ---- 5. Actualizar partial_data ----
-    partial = dict(invite.partial_data)  # copia
-    partial.update({k: v for k, v in parsed.items() if v})
+    async with admission.db.admit():
+        # ---- 5. Actualizar partial_data (sección crítica por remitente) ----
+        # Otro worker pudo procesar un mensaje del mismo número mientras parseábamos:
+        # tomamos el advisory lock y releemos la invitación antes de mergear.
+        await lock_sender_xact(session, telefono_from)
+        await session.refresh(invite)
+        if invite.consumed:
+            return await _invitacion_consumida(session, telefono_from)
 
-    # Determinar faltantes: required que no estén aún
-    missing = [f for f in REQUIRED_FIELDS if f not in partial or not partial[f]]
+        partial = dict(invite.partial_data)  # copia
+        partial.update({k: v for k, v in parsed.items() if v})
 
-    # (Si quieres volver opcional pedir bio/email posteriormente, puedes condicionar)
-    invite.partial_data = partial
-    invite.missing_fields = missing
+        # Determinar faltantes: required que no estén aún
+        missing = [f for f in REQUIRED_FIELDS if f not in partial or not partial[f]]
 
-    # ---- 6. ¿Faltan datos? -> pedirlos ----
-    if missing:
+        # (Si quieres volver opcional pedir bio/email posteriormente, puedes condicionar)
+        invite.partial_data = partial
+        invite.missing_fields = missing
+        # Se guarda ya: el embedding de abajo no debe retener lock, transacción ni slot de DB
         await session.commit()
-        resp = {
-            "status": "pending",
-            "reply": build_missing_message(missing),
-            "missing": missing
-        }
-        logger.info("Whatsapp response %s",resp)
-        return resp
 
+        # ---- 6. ¿Faltan datos? -> pedirlos ----
+        if missing:
+            resp = {
+                "status": "pending",
+                "reply": build_missing_message(missing),
+                "missing": missing
+            }
+            return resp
 
     # ---- 7. Crear Profesional ----
-    nombre = partial["nombre"].strip()
-    email = partial.get("email")
-    bio = partial.get("bio")
-
-    embedding = embed_text(f"{nombre}. {bio or ''}")
-    nuevo = Profesional(
-        nombre=nombre,
-        telefono=invite.telefono,
-        email=email,
-        bio=bio,
-        embedding=embedding
-    )
-    logger.info("Whatsapp nuevo profesional: nombre:%s bio:%s telefono:%s", nuevo.nombre,nuevo.bio,nuevo.telefono)
-    session.add(nuevo)
-    invite.consumed = True
-    invite.used_at = datetime.now(timezone.utc)
-    await session.commit()
-    await session.refresh(nuevo)
+    # El embedding se calcula fuera de la etapa DB. Si otro mensaje del mismo
+    # número cambió nombre/bio mientras tanto, se vuelve a calcular.
+    while True:
+        texto_embedding = _texto_embedding(partial)
+        # Shed → 503: lo parseado ya quedó guardado y el reintento completa el alta
+        async with admission.embedding.admit():
+            embedding = await asyncio.to_thread(embed_text, texto_embedding)
+
+        async with admission.db.admit():
+            await lock_sender_xact(session, telefono_from)
+            await session.refresh(invite)
+            if invite.consumed:
+                return await _invitacion_consumida(session, telefono_from)
+            partial = dict(invite.partial_data)
+            if _texto_embedding(partial) != texto_embedding:
+                await session.commit()
+                continue
+
+            nuevo = Profesional(
+                nombre=partial["nombre"].strip(),
+                telefono=invite.telefono,
+                email=partial.get("email"),
+                bio=partial.get("bio"),
+                embedding=embedding
+            )
+            logger.info("Whatsapp nuevo profesional: nombre:%s bio:%s telefono:%s", nuevo.nombre,nuevo.bio,nuevo.telefono)
+            session.add(nuevo)
+            invite.consumed = True
+            invite.used_at = datetime.now(timezone.utc)
+            await session.commit()
+            await session.refresh(nuevo)
+            break
 
     resp = {
         "status": "ok",
         "reply": f"¡Registro exitoso {nuevo.nombre}! Ya podés usar el servicio.",
         "profesional_id": nuevo.id
     }
-    logger.info("Whatsapp response %s",resp)
     return resp
-
@@ -0,0 +1,383 @@
+# app/scheduler.py
+"""
+Scheduler de recordatorios y avisos.
+
+- booking_reminder: SCHEDULER_REMINDER_LEAD_MIN antes del turno.
+- cancel_deadline:  SCHEDULER_CANCEL_WARN_LEAD_MIN antes de que venza
+                    `Servicio.cancellation_limit_min`.
+- payment_nudge:    pago PENDING sin comprobante tras SCHEDULER_PAYMENT_NUDGE_AFTER_MIN.
+
+En lugar de consultar `bookings` cada minuto:
+
+1. Se carga por ventanas (SCHEDULER_WINDOW_MIN) lo que vence pronto a un heap
+   en memoria y se duerme hasta el próximo vencimiento.
+2. Los cambios en bookings/payments llegan por LISTEN/NOTIFY (app.pg_events) y
+   sólo se recalculan las filas afectadas.
+3. Un único worker es líder (pg_try_advisory_lock en una conexión dedicada);
+   además cada disparo se "reclama" con un INSERT único en
+   `scheduled_notifications`, así un aviso sale una sola vez aunque cambie el
+   líder a mitad de camino.
+4. Al asumir el liderazgo se recupera lo vencido en las últimas
+   SCHEDULER_CATCHUP_MAX_MIN que no figure como disparado.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import asyncpg
+from sqlalchemy import text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.db import SessionLocal
+from app.models import Booking, Cliente, Payment, ScheduledNotification, Servicio
+from app.pg_events import PgEventListener, raw_dsn
+from app.whatsapp_sender import Recipient, notify
+
+settings = get_settings()
+logger = logging.getLogger("scheduler")
+
+LOCK_KEY = 0x56_41_4C_4C_45_01          # "VALLE" + 1: advisory lock del líder
+LEADER_RETRY_S = 10.0
+MAX_SLEEP_S = 30.0
+CANCEL_LOOKAHEAD_DAYS = 14              # cota para cancellation_limit_min en la consulta
+
+BOOKING_KINDS = ("booking_reminder", "cancel_deadline")
+PAYMENT_KINDS = ("payment_nudge",)
+
+
+@dataclass(frozen=True, order=True)
+class DueItem:
+    due_at: datetime
+    kind: str
+    ref_id: int
+
+
+class DueQueue:
+    """
+    Min-heap por vencimiento con invalidación perezosa: si un item se
+    re-agenda (o se descarta) la entrada vieja queda en el heap pero se
+    ignora al salir.
+    """
+
+    def __init__(self):
+        self._heap: list[DueItem] = []
+        self._current: dict[tuple[str, int], datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    def push(self, item: DueItem) -> bool:
+        key = (item.kind, item.ref_id)
+        if self._current.get(key) == item.due_at:
+            return False
+        self._current[key] = item.due_at
+        heapq.heappush(self._heap, item)
+        return True
+
+    def discard(self, kind: str, ref_id: int) -> None:
+        self._current.pop((kind, ref_id), None)
+
+    def _valid(self, item: DueItem) -> bool:
+        return self._current.get((item.kind, item.ref_id)) == item.due_at
+
+    def pop_due(self, now: datetime) -> list[DueItem]:
+        out = []
+        while self._heap and self._heap[0].due_at <= now:
+            item = heapq.heappop(self._heap)
+            if self._valid(item):
+                del self._current[(item.kind, item.ref_id)]
+                out.append(item)
+        return out
+
+    def next_due(self) -> Optional[datetime]:
+        while self._heap and not self._valid(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0].due_at if self._heap else None
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._current.clear()
+
+
+# ---------------------------------------------------------------------------
+# Consulta de vencimientos
+# ---------------------------------------------------------------------------
+_DUE_SQL = """
+WITH due AS (
+    SELECT 'booking_reminder'::text AS kind, b.id AS ref_id,
+           ((b.fecha + b.hora) AT TIME ZONE :tz) - make_interval(mins => :reminder_lead) AS due_at
+      FROM bookings b
+     WHERE b.status = 'CONFIRMED' AND b.cliente_id IS NOT NULL
+       AND b.fecha BETWEEN :rem_d0 AND :rem_d1
+       {booking_filter}
+    UNION ALL
+    SELECT 'cancel_deadline', b.id,
+           ((b.fecha + b.hora) AT TIME ZONE :tz)
+             - make_interval(mins => s.cancellation_limit_min + :cancel_warn)
+      FROM bookings b
+      JOIN servicios s ON s.id = b.servicio_id
+     WHERE b.status = 'CONFIRMED' AND b.cliente_id IS NOT NULL
+       AND s.cancellation_limit_min IS NOT NULL
+       AND b.fecha BETWEEN :can_d0 AND :can_d1
+       {booking_filter}
+    UNION ALL
+    SELECT 'payment_nudge', p.id,
+           (p.created_at AT TIME ZONE 'UTC') + make_interval(mins => :nudge_after)
+      FROM payments p
+     WHERE p.status = 'PENDING' AND p.comprobante_url IS NULL
+       AND p.created_at BETWEEN :pay_t0 AND :pay_t1
+       {payment_filter}
+)
+SELECT d.kind, d.ref_id, d.due_at
+  FROM due d
+ WHERE d.due_at >= :start AND d.due_at < :end
+   AND NOT EXISTS (
+        SELECT 1 FROM scheduled_notifications n
+         WHERE n.kind = d.kind AND n.ref_id = d.ref_id AND n.due_at = d.due_at
+   )
+"""
+
+
+async def query_due(
+    session: AsyncSession,
+    start: datetime,
+    end: datetime,
+    *,
+    booking_id: int | None = None,
+    payment_id: int | None = None,
+) -> list[DueItem]:
+    """Items que vencen en [start, end) y todavía no se dispararon."""
+    tz = ZoneInfo(settings.SCHEDULER_TZ)
+    lead = timedelta(minutes=settings.SCHEDULER_REMINDER_LEAD_MIN)
+    nudge = timedelta(minutes=settings.SCHEDULER_PAYMENT_NUDGE_AFTER_MIN)
+    one_day = timedelta(days=1)
+
+    booking_filter, payment_filter = "", ""
+    if booking_id is not None:
+        booking_filter, payment_filter = "AND b.id = :booking_id", "AND false"
+    elif payment_id is not None:
+        booking_filter, payment_filter = "AND false", "AND p.id = :payment_id"
+
+    params = {
+        "tz": settings.SCHEDULER_TZ,
+        "start": start,
+        "end": end,
+        "reminder_lead": settings.SCHEDULER_REMINDER_LEAD_MIN,
+        "cancel_warn": settings.SCHEDULER_CANCEL_WARN_LEAD_MIN,
+        "nudge_after": settings.SCHEDULER_PAYMENT_NUDGE_AFTER_MIN,
+        # cotas sobre columnas indexadas (fecha / created_at)
+        "rem_d0": (start + lead).astimezone(tz).date() - one_day,
+        "rem_d1": (end + lead).astimezone(tz).date() + one_day,
+        "can_d0": start.astimezone(tz).date() - one_day,
+        "can_d1": end.astimezone(tz).date() + timedelta(days=CANCEL_LOOKAHEAD_DAYS),
+        "pay_t0": (start - nudge).astimezone(timezone.utc).replace(tzinfo=None),
+        "pay_t1": (end - nudge).astimezone(timezone.utc).replace(tzinfo=None),
+    }
+    if booking_id is not None:
+        params["booking_id"] = booking_id
+    if payment_id is not None:
+        params["payment_id"] = payment_id
+
+    sql = _DUE_SQL.format(booking_filter=booking_filter, payment_filter=payment_filter)
+    rows = (await session.execute(text(sql), params)).all()
+    return [DueItem(due_at=r.due_at, kind=r.kind, ref_id=r.ref_id) for r in rows]
+
+
+# ---------------------------------------------------------------------------
+# Armado y envío de cada aviso
+# ---------------------------------------------------------------------------
+def _fmt(fecha: date, hora) -> str:
+    return f"{fecha:%d/%m} a las {hora:%H:%M}"
+
+
+async def build_notification(session: AsyncSession, item: DueItem) -> Optional[tuple[Recipient, str]]:
+    if item.kind in BOOKING_KINDS:
+        booking = await session.get(Booking, item.ref_id)
+        if booking is None or booking.cliente_id is None:
+            return None
+        cli = await session.get(Cliente, booking.cliente_id)
+        serv = await session.get(Servicio, booking.servicio_id)
+        recipient = Recipient(cli.telefono, profesional_id=booking.profesional_id, cliente_id=cli.id)
+        if item.kind == "booking_reminder":
+            return recipient, f"Recordatorio: tenés {serv.nombre} el {_fmt(booking.fecha, booking.hora)}."
+        tz = ZoneInfo(settings.SCHEDULER_TZ)
+        start = datetime.combine(booking.fecha, booking.hora, tzinfo=tz)
+        limite = start - timedelta(minutes=serv.cancellation_limit_min or 0)
+        if limite <= datetime.now(timezone.utc):
+            return None   # recuperado tarde: el plazo ya venció
+        return recipient, (
+            f"Si necesitás cancelar {serv.nombre} del {_fmt(booking.fecha, booking.hora)}, "
+            f"avisá antes del {_fmt(limite.date(), limite.time())}."
+        )
+
+    if item.kind == "payment_nudge":
+        pay = await session.get(Payment, item.ref_id)
+        if pay is None:
+            return None
+        cli = await session.get(Cliente, pay.cliente_id)
+        recipient = Recipient(cli.telefono, profesional_id=pay.profesional_id, cliente_id=cli.id)
+        return recipient, f"Recordá enviar el comprobante del pago de {pay.currency} {pay.amount:.2f}."
+    return None
+
+
+class Scheduler:
+    def __init__(self):
+        self.queue = DueQueue()
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(settings.SCHEDULER_CONCURRENCY)
+        self._task: asyncio.Task | None = None
+        self._leading = False
+        self._loaded_until: datetime | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    # ---- integración con LISTEN/NOTIFY ----
+    def subscribe(self, listener: PgEventListener) -> None:
+        listener.subscribe("bookings_changed", self._on_booking_event)
+        listener.subscribe("payments_changed", self._on_payment_event)
+        listener.on_reconnect(self._force_reload)
+
+    def _force_reload(self) -> None:
+        # se pudieron perder eventos: recargamos la ventana completa
+        self._loaded_until = None
+        self._wake.set()
+
+    async def _on_booking_event(self, event: dict) -> None:
+        await self._refresh(event, BOOKING_KINDS, booking_id=event["id"])
+
+    async def _on_payment_event(self, event: dict) -> None:
+        await self._refresh(event, PAYMENT_KINDS, payment_id=event["id"])
+
+    async def _refresh(self, event: dict, kinds: tuple[str, ...], **ref) -> None:
+        if not self._leading or self._loaded_until is None:
+            return
+        for kind in kinds:
+            self.queue.discard(kind, event["id"])
+        if event.get("op") != "DELETE":
+            now = datetime.now(timezone.utc)
+            start = now - timedelta(minutes=settings.SCHEDULER_CATCHUP_MAX_MIN)
+            async with SessionLocal() as session:
+                for item in await query_due(session, start, self._loaded_until, **ref):
+                    self.queue.push(item)
+        self._wake.set()
+
+    # ---- ciclo del líder ----
+    async def _load_window(self, now: datetime) -> None:
+        start = self._loaded_until or now - timedelta(minutes=settings.SCHEDULER_CATCHUP_MAX_MIN)
+        end = now + timedelta(minutes=settings.SCHEDULER_WINDOW_MIN)
+        async with SessionLocal() as session:
+            items = await query_due(session, start, end)
+        added = sum(1 for it in items if self.queue.push(it))
+        self._loaded_until = end
+        logger.info("Ventana %s → %s: %d avisos nuevos (%d en memoria)", start, end, added, len(self.queue))
+
+    async def _fire(self, item: DueItem) -> None:
+        async with self._sem:
+            try:
+                async with SessionLocal() as session:
+                    # ¿Sigue vigente con el mismo vencimiento y sin disparar?
+                    ref = {"booking_id": item.ref_id} if item.kind in BOOKING_KINDS else {"payment_id": item.ref_id}
+                    still_due = await query_due(
+                        session, item.due_at, item.due_at + timedelta(microseconds=1), **ref
+                    )
+                    if item not in still_due:
+                        return
+                    claim = await session.execute(
+                        pg_insert(ScheduledNotification)
+                        .values(kind=item.kind, ref_id=item.ref_id, due_at=item.due_at)
+                        .on_conflict_do_nothing(constraint="uq_sched_notif_kind_ref_due")
+                        .returning(ScheduledNotification.id)
+                    )
+                    notif_id = claim.scalar_one_or_none()
+                    await session.commit()
+                    if notif_id is None:
+                        return   # otro worker ya lo reclamó
+
+                    status = "skipped"
+                    built = await build_notification(session, item)
+                    if built is not None and settings.WHATSAPP_SEND_ENABLED:
+                        recipient, body = built
+                        (res,) = await notify(session, [recipient], body)
+                        status = res.status
+                    elif built is not None:
+                        logger.info("Aviso %s (envío deshabilitado): %s", item, built[1])
+                    await session.execute(
+                        update(ScheduledNotification)
+                        .where(ScheduledNotification.id == notif_id)
+                        .values(status=status)
+                    )
+                    await session.commit()
+            except Exception:
+                logger.exception("Falló el aviso %s", item)
+
+    async def _lead(self, lock_conn: asyncpg.Connection) -> None:
+        self._leading = True
+        self.queue.clear()
+        self._loaded_until = None
+        try:
+            while True:
+                now = datetime.now(timezone.utc)
+                window = timedelta(minutes=settings.SCHEDULER_WINDOW_MIN)
+                if self._loaded_until is None or self._loaded_until - now < window / 2:
+                    await self._load_window(now)
+
+                for item in self.queue.pop_due(now):
+                    task = asyncio.create_task(self._fire(item))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+
+                nxt = self.queue.next_due()
+                sleep = min(MAX_SLEEP_S, (self._loaded_until - now - window / 2).total_seconds())
+                if nxt is not None:
+                    sleep = min(sleep, (nxt - now).total_seconds())
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=max(sleep, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+                # si se cayó la conexión del lock, perdimos el liderazgo
+                await lock_conn.execute("SELECT 1")
+        finally:
+            self._leading = False
+
+    async def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(raw_dsn())
+                if await conn.fetchval("SELECT pg_try_advisory_lock($1)", LOCK_KEY):
+                    logger.info("Scheduler: este worker es líder")
+                    await self._lead(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduler: error en el ciclo del líder")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()   # libera el advisory lock
+            await asyncio.sleep(LEADER_RETRY_S)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="scheduler")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+scheduler = Scheduler()
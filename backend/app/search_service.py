@@ -0,0 +1,181 @@
+# app/search_service.py
+"""
+Búsqueda híbrida (léxica + vectorial) con reciprocal-rank fusion (RRF).
+
+- Léxica: pg_trgm (word_similarity sobre nombres) + tsvector ('spanish').
+- Vectorial: ANN sobre la columna `embedding` de cada tabla.
+- Fusión: score = Σ 1 / (RRF_K + rank) sobre ambas listas.
+
+Si la búsqueda léxica encuentra un match exacto (nombre idéntico, sin
+distinguir mayúsculas) se devuelve directamente sin calcular el embedding.
+El embedding de la consulta pasa por la etapa de embeddings de admission
+control (puede lanzar `Shed`).
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import admission
+from app.db import distance_operator, tsv
+from app.embedding_service import embed_text
+
+RRF_K = 60            # constante estándar de RRF
+CANDIDATES_MIN = 20   # profundidad mínima de cada lista antes de fusionar
+
+MODES = ("hybrid", "lexical", "vector")
+
+
+@dataclass(frozen=True)
+class _Scope:
+    table: str
+    extra_cols: str      # columnas adicionales a devolver (", col1, col2")
+    lexical_sql: str     # debe devolver id, nombre, exact, sim, ts (+extra)
+
+
+_Q = "websearch_to_tsquery('spanish'::regconfig, :q)"
+
+# Profesionales: además de nombre/bio, matchea por sus servicios (nombre y ubicación)
+_LEX_PROFESIONALES = f"""
+    WITH cand AS (
+        SELECT p.id,
+               word_similarity(:q, p.nombre) AS sim,
+               ts_rank({tsv('p.nombre', 'p.bio')}, {_Q}) AS ts,
+               lower(p.nombre) = lower(:q) AS exact
+          FROM profesionales p
+         WHERE :q <% p.nombre
+            OR {tsv('p.nombre', 'p.bio')} @@ {_Q}
+        UNION ALL
+        SELECT s.profesional_id,
+               greatest(word_similarity(:q, s.nombre),
+                        word_similarity(:q, coalesce(s.ubicacion_text, ''))),
+               ts_rank({tsv('s.nombre', 's.ubicacion_text')}, {_Q}),
+               lower(s.nombre) = lower(:q)
+          FROM servicios s
+         WHERE s.activo
+           AND (:q <% s.nombre
+                OR :q <% s.ubicacion_text
+                OR {tsv('s.nombre', 's.ubicacion_text')} @@ {_Q})
+    )
+    SELECT p.id, p.nombre, bool_or(c.exact) AS exact, max(c.sim) AS sim, max(c.ts) AS ts
+      FROM cand c
+      JOIN profesionales p ON p.id = c.id
+     GROUP BY p.id, p.nombre
+     ORDER BY exact DESC, sim DESC, ts DESC
+     LIMIT :k
+"""
+
+_LEX_SERVICIOS = f"""
+    SELECT s.id, s.nombre, s.profesional_id,
+           lower(s.nombre) = lower(:q) AS exact,
+           greatest(word_similarity(:q, s.nombre),
+                    word_similarity(:q, coalesce(s.ubicacion_text, ''))) AS sim,
+           ts_rank({tsv('s.nombre', 's.ubicacion_text')}, {_Q}) AS ts
+      FROM servicios s
+     WHERE s.activo
+       AND (:q <% s.nombre
+            OR :q <% s.ubicacion_text
+            OR {tsv('s.nombre', 's.ubicacion_text')} @@ {_Q})
+     ORDER BY exact DESC, sim DESC, ts DESC
+     LIMIT :k
+"""
+
+_LEX_CLIENTES = f"""
+    SELECT c.id, c.nombre,
+           lower(c.nombre) = lower(:q) AS exact,
+           word_similarity(:q, c.nombre) AS sim,
+           ts_rank({tsv('c.nombre', 'c.notas')}, {_Q}) AS ts
+      FROM clientes c
+     WHERE :q <% c.nombre
+        OR {tsv('c.nombre', 'c.notas')} @@ {_Q}
+     ORDER BY exact DESC, sim DESC, ts DESC
+     LIMIT :k
+"""
+
+SCOPES: dict[str, _Scope] = {
+    "profesionales": _Scope("profesionales", "", _LEX_PROFESIONALES),
+    "servicios": _Scope("servicios", ", profesional_id", _LEX_SERVICIOS),
+    "clientes": _Scope("clientes", "", _LEX_CLIENTES),
+}
+
+
+def rrf_fuse(rankings: Sequence[Sequence[Any]], k: int = RRF_K) -> list[tuple[Any, float]]:
+    """
+    Reciprocal-rank fusion de varias listas ordenadas de ids.
+    Devuelve [(id, score)] ordenado por score descendente (estable ante empates).
+    """
+    scores: dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+async def lexical_search(session: AsyncSession, scope: str, query: str, k: int) -> list[dict]:
+    sc = SCOPES[scope]
+    rows = (await session.execute(text(sc.lexical_sql), {"q": query, "k": k})).mappings().all()
+    return [dict(r) for r in rows]
+
+
+async def vector_search(session: AsyncSession, scope: str, query: str, k: int) -> list[dict]:
+    sc = SCOPES[scope]
+    async with admission.embedding.admit():
+        vec = await asyncio.to_thread(embed_text, query)
+    vec_literal = "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
+    where = "WHERE activo" if sc.table == "servicios" else ""
+    sql = text(f"""
+        SELECT id, nombre{sc.extra_cols}, embedding {distance_operator()} CAST(:qvec AS vector) AS distancia
+          FROM {sc.table}
+          {where}
+         ORDER BY distancia ASC
+         LIMIT :k
+    """)
+    rows = (await session.execute(sql, {"qvec": vec_literal, "k": k})).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def _public(row: dict) -> dict:
+    return {k: v for k, v in row.items() if k not in ("exact", "sim", "ts")}
+
+
+async def search(
+    session: AsyncSession,
+    query: str,
+    *,
+    scope: str = "profesionales",
+    mode: str = "hybrid",
+    top_k: int = 3,
+) -> dict:
+    if scope not in SCOPES:
+        raise ValueError(f"scope inválido: {scope}")
+    if mode not in MODES:
+        raise ValueError(f"mode inválido: {mode}")
+
+    if mode == "vector":
+        rows = await vector_search(session, scope, query, top_k)
+        return {"results": rows, "query": query, "mode": mode, "fast_path": False}
+
+    depth = max(top_k * 4, CANDIDATES_MIN)
+    lexical = await lexical_search(session, scope, query, depth)
+
+    # Fast path: match exacto → no pagamos el embedding
+    if mode == "lexical" or (lexical and lexical[0]["exact"]):
+        results = [
+            {**_public(r), "score": None, "distancia": None}
+            for r in lexical[:top_k]
+        ]
+        return {"results": results, "query": query, "mode": mode, "fast_path": mode != "lexical"}
+
+    vector = await vector_search(session, scope, query, depth)
+
+    by_id: dict[int, dict] = {r["id"]: {**_public(r), "distancia": None} for r in lexical}
+    for r in vector:
+        by_id.setdefault(r["id"], {}).update(r)
+
+    fused = rrf_fuse([[r["id"] for r in lexical], [r["id"] for r in vector]])
+    results = [{**by_id[i], "score": round(score, 6)} for i, score in fused[:top_k]]
+    return {"results": results, "query": query, "mode": mode, "fast_path": False}
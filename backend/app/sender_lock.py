@@ -0,0 +1,54 @@
+# app/sender_lock.py
+"""
+Ejecución ordenada por remitente ("mailbox" por teléfono).
+
+- En proceso: un asyncio.Lock por teléfono (FIFO), así los mensajes del mismo
+  número se procesan en orden de llegada y los de números distintos en paralelo.
+- Entre workers: advisory lock transaccional de Postgres sobre el teléfono,
+  tomado sólo alrededor del read-modify-write (se libera en el commit), para
+  no mantener transacciones abiertas durante la llamada al LLM.
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class KeyedLock:
+    """asyncio.Lock por clave; la entrada se borra cuando nadie la usa."""
+
+    def __init__(self):
+        self._locks: dict[str, tuple[asyncio.Lock, list[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = (asyncio.Lock(), [0])
+        lock, users = entry
+        users[0] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            users[0] -= 1
+            if users[0] == 0:
+                del self._locks[key]
+
+
+sender_locks = KeyedLock()
+
+
+async def lock_sender_xact(session: AsyncSession, telefono: str) -> None:
+    """Advisory lock hasta el fin de la transacción actual de `session`."""
+    await session.execute(
+        text("SELECT pg_advisory_xact_lock(hashtextextended(:k, 0))"),
+        {"k": f"wa:{telefono}"},
+    )
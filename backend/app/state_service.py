@@ -1,12 +1,13 @@
 # state_service.py
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from models import (
+from app.models import (
     Booking, BookingStatus, RelationshipState,
-    Payment, PaymentStatus, Profesional, Cliente, Servicio
+    Profesional, Cliente, Servicio
 )
-from embedding_service import embed_text
+from app.embedding_service import embed_text
+from app import billing
 
 async def refresh_relationship_state(
     session: AsyncSession,
@@ -23,7 +24,7 @@ async def refresh_relationship_state(
         .where(
             Booking.profesional_id == profesional_id,
             Booking.cliente_id == cliente_id,
-            Booking.status.in_([BookingStatus.CONFIRMED, BookingStatus.ATTENDED, BookingStatus.PENDING])
+            Booking.status.in_([BookingStatus.CONFIRMED, BookingStatus.ATTENDED])
         )
         .order_by(Booking.fecha, Booking.hora)
         .limit(1)
@@ -40,15 +41,8 @@ async def refresh_relationship_state(
     )
     recent_list = list(recent_res.scalars())
 
-    # Pagos verificados
-    total_pagado = await session.scalar(
-        select(func.coalesce(func.sum(Payment.amount), 0.0))
-        .where(
-            Payment.profesional_id == profesional_id,
-            Payment.cliente_id == cliente_id,
-            Payment.status == PaymentStatus.VERIFIED
-        )
-    ) or 0.0
+    # Pagos verificados (agregado mensual, sin recorrer payments)
+    total_pagado = await billing.total_paid(session, profesional_id, cliente_id)
 
     # Sesiones asistidas * (precio promedio servicio principal) (simplificado)
     # Podés mejorar esto según tu modelo de pricing.
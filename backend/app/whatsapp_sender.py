@@ -0,0 +1,318 @@
+# app/whatsapp_sender.py
+"""
+Envío saliente a WhatsApp Cloud API.
+
+- Un único httpx.AsyncClient compartido (keep-alive, pool acotado).
+- Rate limiting global (msgs/s del número) y por destinatario (pair rate limit).
+- Reintentos con backoff exponencial + jitter ante 429 / 5xx / errores de red
+  y los códigos de throttling de la Cloud API.
+- Fan-out en lote (p.ej. cancelar una clase a todos los inscriptos) con
+  concurrencia acotada y estado de entrega persistido en `messages`.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Sequence
+
+import httpx
+from sqlalchemy import case, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.models import Message
+
+settings = get_settings()
+logger = logging.getLogger("whatsapp.sender")
+
+# Códigos de error de la Cloud API que indican throttling (reintentables)
+RETRYABLE_API_CODES = {4, 80007, 130429, 131048, 131056}
+
+# Orden de los estados: nunca "bajamos" de read a delivered si llegan desordenados
+STATUS_RANK = {"queued": 0, "sent": 1, "failed": 2, "delivered": 3, "read": 4}
+
+
+def _advances(status: str):
+    """Condición SQL: `status` es más nuevo que el que tiene guardado el mensaje."""
+    lower = [s for s, rank in STATUS_RANK.items() if rank < STATUS_RANK[status]]
+    return Message.delivery_status.is_(None) | Message.delivery_status.in_(lower)
+
+
+class TokenBucket:
+    """Token bucket async. Reserva el token antes de dormir, así el orden es FIFO."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._ts = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class SendResult:
+    to: str
+    ok: bool
+    wa_message_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+    @property
+    def status(self) -> str:
+        return "sent" if self.ok else "failed"
+
+
+@dataclass
+class Recipient:
+    telefono: str
+    profesional_id: Optional[int] = None
+    cliente_id: Optional[int] = None
+
+
+class WhatsAppSender:
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        phone_number_id: str,
+        token: str,
+        client: httpx.AsyncClient | None = None,
+        max_mps: float = 80.0,
+        pair_interval_s: float = 6.0,
+        pair_burst: int = 10,
+        max_retries: int = 4,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 30.0,
+        max_connections: int = 50,
+        max_recipients_tracked: int = 10_000,
+    ):
+        self.url = f"{base_url.rstrip('/')}/{phone_number_id}/messages"
+        self._client = client or httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60.0,
+            ),
+        )
+        if client is not None and token:
+            self._client.headers["Authorization"] = f"Bearer {token}"
+        self._global = TokenBucket(rate=max_mps, burst=max_mps)
+        self._pair_rate = 1.0 / pair_interval_s
+        self._pair_burst = pair_burst
+        self._pairs: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._max_pairs = max_recipients_tracked
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _pair_bucket(self, to: str) -> TokenBucket:
+        bucket = self._pairs.get(to)
+        if bucket is None:
+            bucket = self._pairs[to] = TokenBucket(rate=self._pair_rate, burst=self._pair_burst)
+            if len(self._pairs) > self._max_pairs:
+                self._pairs.popitem(last=False)  # LRU: el más viejo
+        else:
+            self._pairs.move_to_end(to)
+        return bucket
+
+    def _backoff(self, attempt: int, retry_after: str | None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max_s)
+            except ValueError:
+                pass
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt))
+        return random.uniform(0, cap)  # full jitter
+
+    @staticmethod
+    def _retryable(resp: httpx.Response) -> bool:
+        if resp.status_code == 429 or resp.status_code >= 500:
+            return True
+        try:
+            code = resp.json().get("error", {}).get("code")
+        except ValueError:
+            return False
+        return code in RETRYABLE_API_CODES
+
+    async def send_text(self, to: str, body: str) -> SendResult:
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": to,
+            "type": "text",
+            "text": {"preview_url": False, "body": body},
+        }
+        await self._pair_bucket(to).acquire()
+        error: str | None = None
+        for attempt in range(self.max_retries + 1):
+            await self._global.acquire()
+            retry_after = None
+            try:
+                resp = await self._client.post(self.url, json=payload)
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if resp.is_success:
+                    wamid = (resp.json().get("messages") or [{}])[0].get("id")
+                    return SendResult(to=to, ok=True, wa_message_id=wamid, attempts=attempt + 1)
+                error = f"HTTP {resp.status_code}: {resp.text[:300]}"
+                if not self._retryable(resp):
+                    return SendResult(to=to, ok=False, error=error, attempts=attempt + 1)
+                retry_after = resp.headers.get("retry-after")
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logger.warning("Envío a %s falló (%s); reintento en %.2fs", to, error, delay)
+                await asyncio.sleep(delay)
+        return SendResult(to=to, ok=False, error=error, attempts=self.max_retries + 1)
+
+    async def send_many(self, recipients: Iterable[str], body: str, *, concurrency: int = 20) -> list[SendResult]:
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(to: str) -> SendResult:
+            async with sem:
+                return await self.send_text(to, body)
+
+        return list(await asyncio.gather(*(_one(to) for to in recipients)))
+
+
+# ---------------------------------------------------------------------------
+# Singleton (se cierra en el lifespan de la app)
+# ---------------------------------------------------------------------------
+_sender: WhatsAppSender | None = None
+
+
+def get_sender() -> WhatsAppSender:
+    global _sender
+    if _sender is None:
+        _sender = WhatsAppSender(
+            base_url=settings.WHATSAPP_API_BASE,
+            phone_number_id=settings.WHATSAPP_PHONE_NUMBER_ID,
+            token=settings.WHATSAPP_TOKEN,
+            max_mps=settings.WHATSAPP_MAX_MPS,
+            pair_interval_s=settings.WHATSAPP_PAIR_INTERVAL_S,
+            pair_burst=settings.WHATSAPP_PAIR_BURST,
+            max_retries=settings.WHATSAPP_MAX_RETRIES,
+            max_connections=settings.WHATSAPP_MAX_CONNECTIONS,
+        )
+    return _sender
+
+
+async def close_sender() -> None:
+    global _sender
+    if _sender is not None:
+        await _sender.aclose()
+        _sender = None
+
+
+# ---------------------------------------------------------------------------
+# Envío + persistencia en `messages`
+# ---------------------------------------------------------------------------
+async def notify(
+    session: AsyncSession,
+    recipients: Sequence[Recipient],
+    body: str,
+    *,
+    sender: WhatsAppSender | None = None,
+) -> list[SendResult]:
+    """
+    Registra los mensajes salientes (queued) en un único flush, los envía en
+    paralelo respetando los rate limits y guarda cada resultado apenas vuelve:
+    en un fan-out grande los webhooks de estado de los primeros envíos llegan
+    antes de que termine el lote, y sin `wa_message_id` no matchean ninguna fila.
+    """
+    sender = sender or get_sender()
+    rows = [
+        Message(
+            direction="OUT",
+            raw_sender=r.telefono,
+            profesional_id=r.profesional_id,
+            cliente_id=r.cliente_id,
+            text=body,
+            delivery_status="queued",
+        )
+        for r in recipients
+    ]
+    session.add_all(rows)
+    await session.commit()
+
+    sem = asyncio.Semaphore(settings.WHATSAPP_FANOUT_CONCURRENCY)
+    write_lock = asyncio.Lock()      # la sesión no admite uso concurrente
+
+    async def _one(m: Message) -> SendResult:
+        async with sem:
+            res = await sender.send_text(m.raw_sender, body)
+        async with write_lock:
+            await _save_result(session, m.id, res)
+        return res
+
+    results = list(await asyncio.gather(*(_one(m) for m in rows)))
+    failed = sum(1 for r in results if not r.ok)
+    if failed:
+        logger.warning("Fan-out: %d/%d envíos fallidos", failed, len(results))
+    return results
+
+
+async def _save_result(session: AsyncSession, message_id: int, res: SendResult) -> None:
+    # el estado sólo avanza: si un webhook ya dejó algo más nuevo, se conserva
+    newer = _advances(res.status)
+    await session.execute(
+        update(Message)
+        .where(Message.id == message_id)
+        .values(
+            wa_message_id=res.wa_message_id,
+            delivery_status=case((newer, res.status), else_=Message.delivery_status),
+            delivery_error=case((newer, res.error), else_=Message.delivery_error),
+            status_updated_at=case((newer, datetime.now(timezone.utc)), else_=Message.status_updated_at),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+async def apply_status_updates(session: AsyncSession, statuses: list[dict]) -> int:
+    """
+    Procesa `value.statuses` del webhook (sent / delivered / read / failed)
+    y actualiza el mensaje saliente correspondiente. Devuelve cuántos aplicó.
+    """
+    applied = 0
+    for st in statuses:
+        wamid = st.get("id")
+        status = st.get("status")
+        if not wamid or status not in STATUS_RANK:
+            continue
+        ts = st.get("timestamp")
+        when = datetime.fromtimestamp(int(ts), timezone.utc) if ts else datetime.now(timezone.utc)
+        errors = st.get("errors") or []
+        error = "; ".join(f"{e.get('code')}: {e.get('title')}" for e in errors) or None
+        res = await session.execute(
+            update(Message)
+            .where(Message.wa_message_id == wamid, _advances(status))
+            .values(delivery_status=status, delivery_error=error, status_updated_at=when)
+        )
+        applied += res.rowcount or 0
+    await session.commit()
+    return applied
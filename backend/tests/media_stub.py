@@ -0,0 +1,78 @@
+"""
+Servidor de media falso (endpoints de media de la Cloud API) para tests.
+
+    GET /{media_id}            → {"url", "mime_type", "sha256", "file_size", "id"}
+    GET /download/{media_id}   → bytes en streaming, por chunks
+
+En tests se usa en memoria vía httpx.ASGITransport; para pruebas manuales:
+    python -m tests.media_stub --port 8790 --size-kb 2048
+y WHATSAPP_API_BASE=http://localhost:8790
+"""
+import argparse
+import asyncio
+import hashlib
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+
+def create_media_stub_app(
+    files: dict[str, tuple[bytes, str]],
+    *,
+    chunk_size: int = 16 * 1024,
+    latency_ms: float = 0.0,
+    send_length: bool = True,
+) -> FastAPI:
+    """
+    - files: media_id → (contenido, mime_type)
+    - send_length: si False se omite Content-Length (obliga a cortar por bytes leídos)
+    Las descargas quedan contadas en `app.state.downloads`.
+    """
+    app = FastAPI()
+    app.state.downloads = 0
+
+    @app.get("/download/{media_id}")
+    async def download(media_id: str):
+        if media_id not in files:
+            raise HTTPException(404)
+        app.state.downloads += 1
+        data, mime = files[media_id]
+
+        async def chunks():
+            for i in range(0, len(data), chunk_size):
+                if latency_ms:
+                    await asyncio.sleep(latency_ms / 1000)
+                yield data[i:i + chunk_size]
+
+        headers = {"Content-Length": str(len(data))} if send_length else {}
+        return StreamingResponse(chunks(), media_type=mime, headers=headers)
+
+    @app.get("/{media_id}")
+    async def metadata(media_id: str, request: Request):
+        if media_id not in files:
+            raise HTTPException(404)
+        data, mime = files[media_id]
+        return {
+            "messaging_product": "whatsapp",
+            "url": str(request.base_url) + f"download/{media_id}",
+            "mime_type": mime,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "file_size": len(data),
+            "id": media_id,
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import os
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    blob = os.urandom(args.size_kb * 1024)
+    stub = create_media_stub_app({"media1": (blob, "image/jpeg"), "media2": (blob, "image/jpeg")},
+                                 latency_ms=args.latency_ms)
+    uvicorn.run(stub, host="127.0.0.1", port=args.port)
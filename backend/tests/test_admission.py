@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.admission import Shed, Stage
+from app.config import get_settings
+
+settings = get_settings()
+
+
+@pytest.mark.asyncio
+async def test_stage_descarta_al_vencer_el_deadline_de_cola():
+    stage = Stage("llm", limit=1, queue_timeout_s=0.05, max_queue=10)
+    release, adentro = asyncio.Event(), asyncio.Event()
+
+    async def ocupar():
+        async with stage.admit():
+            adentro.set()
+            await release.wait()
+
+    holder = asyncio.create_task(ocupar())
+    await adentro.wait()
+
+    with pytest.raises(Shed):
+        async with stage.admit():
+            pass
+
+    release.set()
+    await holder
+    async with stage.admit():      # vuelve a admitir cuando se libera
+        pass
+
+    snap = stage.snapshot()
+    assert snap["admitted"] == 2 and snap["shed"] == 1
+    assert snap["inflight"] == 0 and snap["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stage_descarta_de_inmediato_con_cola_llena():
+    stage = Stage("db", limit=1, queue_timeout_s=10, max_queue=0)
+    release, adentro = asyncio.Event(), asyncio.Event()
+
+    async def ocupar():
+        async with stage.admit():
+            adentro.set()
+            await release.wait()
+
+    holder = asyncio.create_task(ocupar())
+    await adentro.wait()
+    t0 = asyncio.get_running_loop().time()
+    with pytest.raises(Shed):
+        async with stage.admit():
+            pass
+    assert asyncio.get_running_loop().time() - t0 < 0.1
+    release.set()
+    await holder
+
+
+@pytest.mark.asyncio
+async def test_embedding_del_alta_no_retiene_el_slot_de_db(monkeypatch):
+    from sqlalchemy import delete
+
+    from app import admission
+    from app.db import SessionLocal
+    from app.models import ProfessionalInvite, Profesional
+    from app.routers import whatsapp
+
+    tel = "5491110000098"
+    visto: list[int] = []
+
+    def embed(texto: str) -> list[float]:
+        visto.append(admission.db.inflight)
+        return [0.0] * settings.EMBEDDING_DIM
+
+    monkeypatch.setattr(whatsapp, "embed_text", embed)
+    async with SessionLocal() as s:
+        s.add(ProfessionalInvite(telefono=tel, consumed=False, partial_data={}, missing_fields=["nombre"]))
+        await s.commit()
+    try:
+        async with SessionLocal() as s:
+            resp = await whatsapp._procesar_mensaje(s, "Nombre: Ana Pérez", tel)
+        assert resp["status"] == "ok"
+        assert visto == [0]                 # ningún request ocupaba la etapa DB mientras se embebía
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(Profesional).where(Profesional.telefono == tel))
+            await s.execute(delete(ProfessionalInvite).where(ProfessionalInvite.telefono == tel))
+            await s.commit()
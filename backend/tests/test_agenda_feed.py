@@ -0,0 +1,171 @@
+import asyncio
+from datetime import date, time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete, update
+
+from app import agenda
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.main import app
+from app.models import Booking, BookingChange, Cliente, Profesional, Servicio, ServicioTipo
+
+ZERO = [0.0] * get_settings().EMBEDDING_DIM
+
+DESDE, HASTA = date(2026, 10, 1), date(2026, 10, 31)
+QS = f"desde={DESDE}&hasta={HASTA}"
+
+
+def _prefill(pid: int, version: int, body: str = '{"bookings": []}') -> agenda.Rendered:
+    etag = agenda.etag_for(pid, version, "json", DESDE, HASTA)
+    rendered = agenda.Rendered(version, etag, body, agenda.FORMATS["json"])
+    agenda.cache.put((pid, "json", DESDE, HASTA), rendered)
+    return rendered
+
+
+@pytest.mark.asyncio
+async def test_304_desde_cache_sin_tocar_la_db():
+    # no hay Postgres detrás: si el handler consultara la DB, fallaría
+    rendered = _prefill(9001, 7)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        r = await ac.get(f"/profesionales/9001/agenda?{QS}", headers={"If-None-Match": rendered.etag})
+        assert r.status_code == 304
+        assert r.headers["etag"] == rendered.etag
+
+        r = await ac.get(f"/profesionales/9001/agenda?{QS}", headers={"If-None-Match": 'W/"otro"'})
+        assert r.status_code == 200 and r.json() == {"bookings": []}
+
+
+def test_notify_de_bookings_invalida_solo_al_profesional():
+    _prefill(9002, 1)
+    _prefill(9003, 1)
+    agenda._on_booking_event({"op": "UPDATE", "id": 5, "profesional_id": 9002})
+    assert agenda.cache.get((9002, "json", DESDE, HASTA)) is None
+    assert agenda.cache.get((9003, "json", DESDE, HASTA)) is not None
+
+
+@pytest.mark.asyncio
+async def test_invalidacion_durante_el_render_no_deja_una_entrada_vieja(monkeypatch):
+    pid = 9004
+    agenda.cache.invalidate(pid)
+
+    async def version(session, profesional_id):
+        return 7
+
+    async def load(session, profesional_id, desde, hasta):
+        # llega el NOTIFY de un cambio entre la lectura de filas y el put
+        agenda._on_booking_event({"op": "INSERT", "id": 1, "profesional_id": profesional_id})
+        return []
+
+    monkeypatch.setattr(agenda, "current_version", version)
+    monkeypatch.setattr(agenda, "load_items", load)
+    stale_puts = agenda.cache.stale_puts
+
+    rendered = await agenda.render(None, pid, "json", DESDE, HASTA)
+    assert rendered is not None and rendered.body is not None       # se responde igual
+    assert agenda.cache.get((pid, "json", DESDE, HASTA)) is None     # pero no se cachea
+    assert agenda.cache.stale_puts == stale_puts + 1
+
+    monkeypatch.setattr(agenda, "load_items", lambda *a: asyncio.sleep(0, []))
+    await agenda.render(None, pid, "json", DESDE, HASTA)
+    assert agenda.cache.get((pid, "json", DESDE, HASTA)) is not None
+
+
+def test_clear_tambien_descarta_renders_en_vuelo():
+    gen = agenda.cache.generation(9005)
+    agenda.cache.clear()
+    agenda.cache.put((9005, "json", DESDE, HASTA), agenda.Rendered(1, "e", "{}", "application/json"), gen)
+    assert agenda.cache.get((9005, "json", DESDE, HASTA)) is None
+
+
+def test_etag_matches_acepta_lista_debil_y_comodin():
+    etag = agenda.etag_for(1, 3, "ics", DESDE, HASTA)
+    assert agenda.etag_matches(f'"x", {etag}', etag)
+    assert agenda.etag_matches(etag.removeprefix("W/"), etag)
+    assert agenda.etag_matches("*", etag)
+    assert not agenda.etag_matches(agenda.etag_for(1, 4, "ics", DESDE, HASTA), etag)
+
+
+def test_render_ics_escapa_y_pliega_lineas():
+    items = [{
+        "id": 1, "fecha": "2026-10-20", "hora": "10:00", "duracion_min": 60, "servicio": "Yoga; nivel 1",
+        "cliente": "Ana, " + "x" * 100, "status": "CANCELLED",
+    }]
+    ics = agenda.render_ics(1, 4, items)
+    lines = ics.split("\r\n")
+    assert lines[0] == "BEGIN:VCALENDAR" and ics.endswith("END:VCALENDAR\r\n")
+    assert all(len(line.encode()) <= 75 for line in lines)
+    assert r"SUMMARY:Yoga\; nivel 1 — Ana\, " in ics
+    assert "DTSTART:20261020T130000Z" in lines          # America/Argentina/Buenos_Aires = UTC-3
+    assert "STATUS:CANCELLED" in lines
+
+
+@pytest.mark.asyncio
+async def test_format_invalido_se_rechaza_antes_de_tocar_la_db():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        r = await ac.get(f"/profesionales/9006/agenda?format=xml&{QS}")
+        assert r.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_renombrar_servicio_o_cliente_cambia_el_etag():
+    await init_db()
+    async with SessionLocal() as s:
+        await s.execute(delete(Profesional).where(Profesional.telefono == "5491110000085"))
+        await s.execute(delete(Cliente).where(Cliente.telefono == "5491110000086"))
+        prof = Profesional(nombre="Agenda Feed", telefono="5491110000085", embedding=ZERO)
+        cli = Cliente(nombre="Ana", telefono="5491110000086", embedding=ZERO)
+        s.add_all([prof, cli])
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                        embedding=ZERO)
+        s.add(serv)
+        await s.flush()
+        b = Booking(servicio_id=serv.id, profesional_id=prof.id, cliente_id=cli.id, fecha=date(2026, 10, 5),
+                    hora=time(10), tipo="turno")
+        s.add(b)
+        await s.commit()
+        pid, cid, sid, bid = prof.id, cli.id, serv.id, b.id
+    url = f"/profesionales/{pid}/agenda?{QS}"
+
+    async def _get(ac, etag=None):
+        agenda.cache.invalidate(pid)        # sin listener en el test: hace de NOTIFY
+        return await ac.get(url, headers={"If-None-Match": etag} if etag else {})
+
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            r = await _get(ac)
+            etag, version = r.headers["etag"], int(r.headers["x-agenda-version"])
+            assert r.json()["bookings"][0]["servicio"] == "Yoga"
+            assert (await _get(ac, etag)).status_code == 304
+
+            async with SessionLocal() as s:
+                # sin cambio real no sube la versión
+                await s.execute(update(Servicio).where(Servicio.id == sid).values(nombre="Yoga"))
+                await s.commit()
+            assert (await _get(ac, etag)).status_code == 304
+
+            async with SessionLocal() as s:
+                await s.execute(update(Servicio).where(Servicio.id == sid).values(nombre="Yoga suave"))
+                await s.commit()
+            r = await _get(ac, etag)
+            assert r.status_code == 200 and r.headers["etag"] != etag
+            assert r.json()["bookings"][0]["servicio"] == "Yoga suave"
+            d = (await ac.get(f"/profesionales/{pid}/agenda?since={version}")).json()
+            assert [u["id"] for u in d["upserts"]] == [bid] and d["upserts"][0]["servicio"] == "Yoga suave"
+
+            etag = r.headers["etag"]
+            async with SessionLocal() as s:
+                await s.execute(update(Cliente).where(Cliente.id == cid).values(nombre="Ana María"))
+                await s.commit()
+            r = await _get(ac, etag)
+            assert r.status_code == 200 and r.json()["bookings"][0]["cliente"] == "Ana María"
+    finally:
+        async with SessionLocal() as s:
+            for model in (Booking, BookingChange):
+                await s.execute(delete(model).where(model.profesional_id == pid))
+            await s.execute(delete(Servicio).where(Servicio.id == sid))
+            await s.execute(delete(Profesional).where(Profesional.id == pid))
+            await s.execute(delete(Cliente).where(Cliente.id == cid))
+            await s.commit()
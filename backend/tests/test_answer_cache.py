@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+from sqlalchemy import delete, update
+
+from app import answer_cache
+from app.answer_cache import AnswerCache, cached_answer, servicios_version
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.models import Profesional, Servicio, ServicioTipo
+
+ZERO = [0.0] * get_settings().EMBEDDING_DIM
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+
+def _vec(*xs: float) -> list[float]:
+    return list(xs)
+
+
+def test_hit_por_similitud_y_aislado_por_profesional():
+    cache = AnswerCache(threshold=0.9)
+    cache.put(1, "¿cuánto sale la clase?", _vec(1, 0, 0), "Sale $5000", version=3)
+
+    hit = cache.get(1, _vec(0.98, 0.1, 0), version=3)
+    assert hit is not None and hit.answer == "Sale $5000"
+    assert cache.get(2, _vec(1, 0, 0), version=3) is None       # otro profesional
+    assert cache.get(1, _vec(0, 1, 0), version=3) is None       # pregunta distinta
+    assert cache.snapshot()["hit_rate"] == round(1 / 3, 4)
+
+
+def test_version_de_servicios_y_ttl_invalidan():
+    reloj = Reloj()
+    cache = AnswerCache(threshold=0.9, ttl_s=60, clock=reloj)
+    cache.put(1, "¿dónde queda?", _vec(0, 1), "En Palermo", version=1)
+
+    assert cache.get(1, _vec(0, 1), version=2) is None          # cambió un servicio
+    assert cache.stats["stale"] == 1 and len(cache) == 0
+
+    cache.put(1, "¿dónde queda?", _vec(0, 1), "En Belgrano", version=2)
+    reloj.t = 61
+    assert cache.get(1, _vec(0, 1), version=2) is None
+    assert cache.stats["expired"] == 1
+
+
+def test_desalojo_lru_por_profesional_y_global():
+    cache = AnswerCache(threshold=0.99, max_entries=3, max_per_profesional=2)
+    ejes = np.eye(4)
+    cache.put(1, "a", ejes[0], "A", version=0)
+    cache.put(1, "b", ejes[1], "B", version=0)
+    assert cache.get(1, ejes[0], version=0).answer == "A"       # "a" pasa a ser la más reciente
+    cache.put(1, "c", ejes[2], "C", version=0)                  # desaloja "b"
+    assert cache.get(1, ejes[1], version=0) is None
+
+    cache.put(2, "d", ejes[3], "D", version=0)
+    cache.put(2, "e", ejes[0], "E", version=0)                  # tope global: desaloja la más vieja ("a")
+    assert len(cache) == 3
+    assert cache.get(1, ejes[0], version=0) is None
+    assert cache.stats["evicted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_version_solo_sube_si_cambia_una_columna_versionada():
+    await init_db()
+    async with SessionLocal() as s:
+        prof = Profesional(nombre="Cache Test", telefono="5491110000081", embedding=ZERO)
+        s.add(prof)
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                        precio=5000.0, embedding=ZERO)
+        s.add(serv)
+        await s.commit()
+        pid, sid = prof.id, serv.id
+    try:
+        async with SessionLocal() as s:
+            v0 = await servicios_version(s, pid)
+            # mismo precio (como el upsert de la importación) + cambio de embedding: no invalida
+            await s.execute(update(Servicio).where(Servicio.id == sid).values(precio=5000.0, embedding=[1.0] * len(ZERO)))
+            await s.commit()
+            assert await servicios_version(s, pid) == v0
+            await s.execute(update(Servicio).where(Servicio.id == sid).values(precio=6000.0))
+            await s.commit()
+            assert await servicios_version(s, pid) == v0 + 1
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(Profesional).where(Profesional.id == pid))
+            await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_cached_answer_miss_hit_y_cambio_de_precio(monkeypatch):
+    monkeypatch.setattr(answer_cache, "cache", AnswerCache(threshold=0.99))
+    await init_db()
+    async with SessionLocal() as s:
+        await s.execute(delete(Profesional).where(Profesional.telefono == "5491110000083"))
+        prof = Profesional(nombre="Cache Answer", telefono="5491110000083", embedding=ZERO)
+        s.add(prof)
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                        precio=5000.0, embedding=ZERO)
+        s.add(serv)
+        await s.commit()
+        pid, sid = prof.id, serv.id
+    llamadas = []
+
+    async def generate():
+        llamadas.append(1)
+        return f"Sale {5000 * len(llamadas)}"
+
+    vec = _vec(1, 0)
+    try:
+        async with SessionLocal() as s:
+            assert await cached_answer(s, pid, "¿cuánto sale?", generate, embedding=vec) == ("Sale 5000", False)
+            assert await cached_answer(s, pid, "¿cuánto sale?", generate, embedding=vec) == ("Sale 5000", True)
+            await s.execute(update(Servicio).where(Servicio.id == sid).values(precio=10000.0))
+            await s.commit()
+            assert await cached_answer(s, pid, "¿cuánto sale?", generate, embedding=vec) == ("Sale 10000", False)
+            assert len(llamadas) == 2
+
+            monkeypatch.setattr(answer_cache.settings, "ANSWER_CACHE_ENABLED", False)
+            assert await cached_answer(s, pid, "¿cuánto sale?", generate, embedding=vec) == ("Sale 15000", False)
+            assert len(llamadas) == 3
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(Profesional).where(Profesional.id == pid))
+            await s.commit()
@@ -0,0 +1,69 @@
+from datetime import date, datetime, time
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select, text
+
+from app import billing
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.models import (
+    BillingMonthly, Booking, BookingStatus, Cliente, Payment, PaymentStatus, Profesional, Servicio, ServicioTipo,
+)
+
+settings = get_settings()
+ZERO = [0.0] * settings.EMBEDDING_DIM
+
+
+@pytest_asyncio.fixture
+async def prof_cliente():
+    await init_db()
+    async with SessionLocal() as s:
+        prof = Profesional(nombre="Cobros Test", telefono="5491110000077", embedding=ZERO)
+        cli = Cliente(nombre="Cliente Cobros", telefono="5491110000078", embedding=ZERO)
+        s.add_all([prof, cli])
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                        embedding=ZERO)
+        s.add(serv)
+        await s.commit()
+        ids = (prof.id, cli.id, serv.id)
+    yield ids
+    async with SessionLocal() as s:
+        for model in (Payment, Booking, BillingMonthly):
+            await s.execute(delete(model).where(model.profesional_id == ids[0]))
+        await s.execute(delete(Servicio).where(Servicio.id == ids[2]))
+        await s.execute(delete(Profesional).where(Profesional.id == ids[0]))
+        await s.execute(delete(Cliente).where(Cliente.id == ids[1]))
+        await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_agregados_siguen_las_transiciones_y_la_reconciliacion_corrige_drift(prof_cliente):
+    pid, cid, sid = prof_cliente
+    octubre = datetime(2026, 10, 5, 12, 0)
+    async with SessionLocal() as s:
+        p1 = Payment(profesional_id=pid, cliente_id=cid, amount=100.0, created_at=octubre)
+        p2 = Payment(profesional_id=pid, cliente_id=cid, amount=50.0, created_at=octubre)
+        b = Booking(servicio_id=sid, profesional_id=pid, cliente_id=cid, fecha=date(2026, 10, 7),
+                    hora=time(10), tipo="turno")
+        s.add_all([p1, p2, b])
+        await s.commit()
+
+        p1.status = PaymentStatus.VERIFIED
+        p2.status = PaymentStatus.REJECTED
+        b.status = BookingStatus.ATTENDED
+        await s.commit()
+
+        mes = await billing.month_summary(s, pid, date(2026, 10, 1))
+        assert mes["totales"] == {"paid": 100.0, "pending": 0.0, "rejected": 50.0, "sessions_attended": 1}
+
+        # drift: alguien escribió sin pasar por los triggers
+        await s.execute(text("UPDATE billing_monthly SET paid_amount = 0 WHERE profesional_id = :p"), {"p": pid})
+        await s.commit()
+        assert await billing.reconcile(s, pid) == 1
+        assert await billing.reconcile(s, pid) == 0
+
+        saldo = await billing.client_balance(s, pid, cid)
+        assert saldo["totales"]["paid"] == 100.0
+        assert await billing.total_paid(s, pid, cid) == 100.0
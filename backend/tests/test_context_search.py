@@ -0,0 +1,139 @@
+import random
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select, text
+
+from app import admission, context_search, reembed
+from app.config import get_settings
+from app.db import SessionLocal, engine, init_db
+from app.models import Cliente, Profesional, RelationshipState
+
+settings = get_settings()
+TELS = [f"54911100004{i:02d}" for i in range(2)]
+
+
+def test_tenant_chico_va_por_busqueda_exacta():
+    umbral = settings.CONTEXT_SEARCH_EXACT_MAX_ROWS
+    assert context_search.choose_strategy(umbral) == "exact"
+    assert context_search.choose_strategy(umbral + 1) == "ann"
+    assert context_search.choose_strategy(3, "ann") == "ann"
+    with pytest.raises(ValueError):
+        context_search.choose_strategy(3, "ivf")
+
+
+def test_scan_iterativo_solo_con_pgvector_08():
+    nuevo = context_search.ann_settings(context_search.version_tuple("0.8.0"), k=10)
+    assert nuevo["hnsw.iterative_scan"] == "relaxed_order"
+    assert "hnsw.max_scan_tuples" in nuevo
+    viejo = context_search.ann_settings(context_search.version_tuple("0.7.4"), k=10)
+    assert viejo == {"hnsw.ef_search": str(context_search.HNSW_EF_SEARCH_MAX)}
+
+
+def test_sql_filtra_por_tenant_literal_y_reordena():
+    exact = context_search._sql(42, "exact")
+    ann = context_search._sql(42, "ann")
+    assert "WHERE profesional_id = 42" in exact and "WHERE profesional_id = 42" in ann
+    # exacta: el ORDER BY va fuera del CTE materializado (no puede usar el índice ANN)
+    assert exact.index("ORDER BY") > exact.index(")")
+    # ANN: LIMIT dentro (usa el índice) y reorden afuera (relaxed_order)
+    assert ann.count("ORDER BY distancia") == 2
+
+
+def test_recall_at_k():
+    assert context_search.recall_at_k([1, 2, 3], [1, 2, 3]) == 1.0
+    assert context_search.recall_at_k([1, 9, 3, 8], [1, 2, 3, 4]) == 0.5
+    assert context_search.recall_at_k([], []) == 1.0
+
+
+def _vec(rng: random.Random) -> list[float]:
+    return [rng.uniform(-1, 1) for _ in range(settings.EMBEDDING_DIM)]
+
+
+async def _cleanup() -> None:
+    async with SessionLocal() as s:
+        clientes = select(Cliente.id).where(Cliente.telefono.like("54911100005%"))
+        await s.execute(delete(RelationshipState).where(RelationshipState.cliente_id.in_(clientes)))
+        await s.execute(delete(Cliente).where(Cliente.telefono.like("54911100005%")))
+        await s.execute(delete(Profesional).where(Profesional.telefono.in_(TELS)))
+        await s.commit()
+
+
+@pytest_asyncio.fixture
+async def tenants():
+    """Dos profesionales con resúmenes de relación; devuelve (pid grande, pid chico)."""
+    await init_db()
+    await _cleanup()
+    rng = random.Random(0)
+    async with SessionLocal() as s:
+        profs = [Profesional(nombre=f"Ctx {i}", telefono=tel, embedding=_vec(rng)) for i, tel in enumerate(TELS)]
+        s.add_all(profs)
+        await s.flush()
+        for i in range(30):
+            cli = Cliente(nombre=f"Ctx cli {i}", telefono=f"54911100005{i:02d}", embedding=_vec(rng))
+            s.add(cli)
+            await s.flush()
+            s.add(RelationshipState(
+                profesional_id=profs[0 if i < 24 else 1].id, cliente_id=cli.id, state_json={},
+                summary_text=f"resumen {i}", summary_embedding=_vec(rng),
+            ))
+        await s.commit()
+        pids = (profs[0].id, profs[1].id)
+    try:
+        yield pids
+    finally:
+        await _cleanup()
+
+
+@pytest.mark.asyncio
+async def test_exacta_y_ann_devuelven_solo_el_tenant(tenants):
+    grande, chico = tenants
+    q = _vec(random.Random(1))
+    found = {}
+    for strategy in ("exact", "ann"):
+        async with SessionLocal() as s:
+            found[strategy] = await context_search.search(s, chico, q, k=10, strategy=strategy)
+    assert len(found["exact"].results) == 6                # el tenant chico tiene 6 filas
+    ids = {r["id"] for r in found["exact"].results}
+    assert {r["id"] for r in found["ann"].results} == ids
+    async with SessionLocal() as s:
+        owners = set((await s.scalars(
+            text("SELECT profesional_id FROM relationship_state WHERE id = ANY(:ids)"), {"ids": list(ids)}
+        )).all())
+    assert owners == {chico}
+
+
+@pytest.mark.asyncio
+async def test_search_text_pasa_por_la_etapa_de_embeddings(tenants, monkeypatch):
+    import app.embedding_service as embedding_service
+    _, chico = tenants
+    monkeypatch.setattr(embedding_service, "embed_text", lambda q: _vec(random.Random(q)))
+    before = admission.embedding.admitted
+    async with SessionLocal() as s:
+        found = await context_search.search_text(s, chico, "dolor de rodilla", k=3)
+    assert admission.embedding.admitted == before + 1
+    assert len(found.results) == 3
+
+
+@pytest.mark.asyncio
+async def test_reembed_migra_el_indice_parcial_del_tenant(tenants):
+    grande, _ = tenants
+    t = next(t for t in reembed.TARGETS if t.table == "relationship_state")
+    name = await context_search.index_tenant(grande)
+    try:
+        async with SessionLocal() as s:
+            assert name in await reembed._index_names(s, t)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                f"ALTER TABLE relationship_state ADD COLUMN IF NOT EXISTS {t.shadow} vector({settings.EMBEDDING_DIM})"
+            ))
+        async with SessionLocal() as s:
+            assert f"{name}_next" in await reembed._missing_next(s, t)
+            await reembed._phase_index(s, t, type("St", (), {"phase": "index"})())
+            indexdef = await s.scalar(text("SELECT indexdef FROM pg_indexes WHERE indexname = :n"), {"n": f"{name}_next"})
+            assert await reembed._missing_next(s, t) == []
+        assert t.shadow in indexdef and f"(profesional_id = {grande})" in indexdef
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE relationship_state DROP COLUMN IF EXISTS {t.shadow}"))
+            await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
@@ -83,7 +83,7 @@ async def test_alta_incremental(invite_record):
             assert prof.nombre == TEST_NAME
             assert prof.telefono == TEST_PHONE
             assert prof.embedding is not None
-            assert len(prof.embedding) == 768  # ajusta si cambias el modelo
+            assert len(prof.embedding) == settings.EMBEDDING_DIM
 
         # 3) Mensaje posterior -> ya registrado
         r3 = await ac.post("/webhook/whatsapp", json=wa_payload("Hola otra vez"))
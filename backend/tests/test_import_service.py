@@ -0,0 +1,146 @@
+import json
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete, select
+
+from app import import_service
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.main import app
+from app.models import Profesional, Servicio
+
+settings = get_settings()
+TELS = [f"54911100003{i:02d}" for i in range(5)]
+
+
+async def _chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def _collect(rows):
+    return [row async for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_jsonl_en_chunks_cortados_a_mitad_de_linea_y_de_caracter():
+    data = "\n".join([
+        json.dumps({"nombre": "Ñandú", "telefono": "1"}, ensure_ascii=False),
+        "",
+        "{roto",
+        "[1, 2]",
+        json.dumps({"nombre": "Último", "telefono": "2"}, ensure_ascii=False),
+    ]).encode()
+    rows = await _collect(import_service.iter_jsonl(_chunks(data, 3)))   # corta bytes UTF-8 a la mitad
+
+    assert rows[0] == (1, {"nombre": "Ñandú", "telefono": "1"})
+    assert rows[1][0] == 3 and "JSON inválido" in str(rows[1][1])
+    assert rows[2][0] == 4 and "objeto" in str(rows[2][1])
+    assert rows[3] == (5, {"nombre": "Último", "telefono": "2"})
+
+
+@pytest.mark.asyncio
+async def test_csv_con_bom_comillas_multilinea_y_servicio():
+    data = (
+        "\ufeffnombre,telefono,bio,servicio_nombre,servicio_duracion_min\r\n"
+        'Ana,1,"Kinesióloga\r\ndeportiva",Sesión,45\r\n'
+        "Beto,2\r\n"
+        'Caro,3,"sin cerrar\n'
+    ).encode()
+    rows = await _collect(import_service.iter_csv(_chunks(data, 7)))
+
+    assert rows[0] == (2, {
+        "nombre": "Ana", "telefono": "1", "bio": "Kinesióloga\ndeportiva",
+        "servicios": [{"nombre": "Sesión", "duracion_min": "45"}],
+    })
+    assert rows[1][0] == 4 and "columnas" in str(rows[1][1])
+    assert rows[2][0] == 5 and "comillas" in str(rows[2][1])
+
+
+
+@pytest.mark.asyncio
+async def test_linea_demasiado_larga_se_reporta_y_se_descarta(monkeypatch):
+    monkeypatch.setattr(import_service, "MAX_LINE_LENGTH", 20)
+    data = ("x" * 100 + "\n" + '{"telefono": "1"}\n' + "y" * 100).encode()
+    rows = await _collect(import_service.iter_jsonl(_chunks(data, 7)))
+    assert [n for n, _ in rows] == [1, 2, 3]
+    assert "más de 20" in str(rows[0][1]) and "más de 20" in str(rows[2][1])
+    assert rows[1] == (2, {"telefono": "1"})
+
+    data = ("nombre,telefono\n" + 'Ana,"' + "z\n" * 30 + "Beto,2\n").encode()
+    rows = await _collect(import_service.iter_csv(_chunks(data, 5)))
+    assert rows[0][0] == 2 and "registro de más de 20" in str(rows[0][1])
+
+def test_dedupe_gana_la_ultima_fila_y_acumula_servicios():
+    P, S = import_service.ProfesionalImport, import_service.ServicioImport
+    items = import_service._dedupe([
+        (1, P(nombre="Ana", telefono="1", servicios=[S(nombre="Yoga", duracion_min=60)])),
+        (2, P(nombre="Otro", telefono="2")),
+        (3, P(nombre="Ana B", telefono="1", servicios=[
+            S(nombre="yoga", duracion_min=90), S(nombre="Pilates", duracion_min=50),
+        ])),
+    ])
+    assert [(it.line, it.prof.nombre) for it in items] == [(3, "Ana B"), (2, "Otro")]
+    servicios = {s.nombre: s.duracion_min for s in items[0].prof.servicios}
+    assert servicios == {"yoga": 90, "Pilates": 50}
+
+
+@pytest.mark.asyncio
+async def test_tope_de_errores_en_el_reporte():
+    async def rows():
+        for i in range(5):
+            yield i + 1, {"telefono": str(i)}       # falta nombre
+
+    report = await import_service.import_profesionales(None, rows(), max_errors=2)
+    out = report.as_dict()
+    assert (out["processed"], out["failed"], len(out["errors"])) == (5, 5, 2)
+    assert out["errors_truncated"] is True
+    assert out["errors"][0]["line"] == 1 and out["errors"][0]["telefono"] == "0"
+
+
+@pytest.mark.asyncio
+async def test_batch_size_acotado():
+    async def rows():
+        yield 1, {}
+
+    for size in (-1, import_service.MAX_BATCH_SIZE + 1):
+        with pytest.raises(ValueError):
+            await import_service.import_profesionales(None, rows(), batch_size=size)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        r = await ac.post("/profesionales/import?format=jsonl&batch_size=-1", content=b"")
+        assert r.status_code == 422
+        r = await ac.post(f"/profesionales/import?format=jsonl&batch_size={import_service.MAX_BATCH_SIZE + 1}", content=b"")
+        assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_fila_que_falla_en_la_db_no_tira_el_lote(monkeypatch):
+    monkeypatch.setattr(
+        import_service, "embed_texts", lambda texts: [[0.0] * settings.EMBEDDING_DIM for _ in texts]
+    )
+    await init_db()
+    rows = [
+        {"nombre": "Import A", "telefono": TELS[0], "servicios": [{"nombre": "Yoga", "duracion_min": 60}]},
+        # el nombre del servicio excede String(150): falla en la DB, no en la validación
+        {"nombre": "Import B", "telefono": TELS[1], "servicios": [{"nombre": "x" * 200, "duracion_min": 30}]},
+        {"nombre": "Import C", "telefono": TELS[2]},
+    ]
+    data = "\n".join(json.dumps(r) for r in rows).encode()
+    try:
+        async with SessionLocal() as s:
+            report = await import_service.import_profesionales(
+                s, import_service.iter_jsonl(_chunks(data, 64)), batch_size=10,
+            )
+        assert (report.upserted, report.servicios, report.failed) == (2, 1, 1)
+        assert report.errors[0]["line"] == 2 and report.errors[0]["telefono"] == TELS[1]
+        async with SessionLocal() as s:
+            tels = set((await s.scalars(select(Profesional.telefono).where(Profesional.telefono.in_(TELS)))).all())
+            assert tels == {TELS[0], TELS[2]}
+    finally:
+        async with SessionLocal() as s:
+            ids = select(Profesional.id).where(Profesional.telefono.in_(TELS))
+            await s.execute(delete(Servicio).where(Servicio.profesional_id.in_(ids)))
+            await s.execute(delete(Profesional).where(Profesional.telefono.in_(TELS)))
+            await s.commit()
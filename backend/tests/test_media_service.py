@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete, func, select
+
+from app import media_service
+from app.admission import Shed
+from app.db import SessionLocal, init_db
+from app.main import app
+from app.media_service import (
+    MediaError, MediaPipeline, MediaTooLarge, ReceiptJob, ingest_receipt, resolve_media, stream_to_disk,
+)
+from app.models import MediaReceipt
+from tests.media_stub import create_media_stub_app
+
+BLOB = os.urandom(200 * 1024)
+
+
+def client_for(stub) -> AsyncClient:
+    return AsyncClient(transport=ASGITransport(app=stub), base_url="http://stub")
+
+
+@pytest.mark.asyncio
+async def test_descarga_en_streaming_con_hash_y_dedupe_en_disco(tmp_path):
+    stub = create_media_stub_app({"m1": (BLOB, "image/jpeg"), "m2": (BLOB, "image/jpeg")})
+    async with client_for(stub) as client:
+        stored = []
+        for media_id in ("m1", "m2"):
+            url, mime = await resolve_media(client, media_id, "http://stub")
+            stored.append(await stream_to_disk(client, url, tmp_path, mime_type=mime,
+                                               max_bytes=1 << 20, chunk_size=8 * 1024))
+
+    assert stored[0].sha256 == hashlib.sha256(BLOB).hexdigest() == stored[1].sha256
+    assert stored[0].path == stored[1].path == tmp_path / f"{stored[0].sha256}.jpg"
+    assert stored[0].path.read_bytes() == BLOB
+    assert [p.name for p in tmp_path.iterdir()] == [stored[0].path.name]   # sin .part huérfanos
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("send_length", [True, False])
+async def test_aborta_si_supera_el_tope(tmp_path, send_length):
+    stub = create_media_stub_app({"big": (BLOB, "application/pdf")}, send_length=send_length)
+    async with client_for(stub) as client:
+        url, mime = await resolve_media(client, "big", "http://stub")
+        with pytest.raises(MediaTooLarge):
+            await stream_to_disk(client, url, tmp_path, mime_type=mime, max_bytes=64 * 1024, chunk_size=8 * 1024)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_pipeline_descarta_con_cola_llena():
+    pipeline = MediaPipeline(workers=1, queue_size=2)
+    pipeline.submit(ReceiptJob("a", "549"))
+    pipeline.submit(ReceiptJob("b", "549"))
+    with pytest.raises(Shed):
+        pipeline.submit(ReceiptJob("c", "549"))
+    assert pipeline.snapshot()["shed"] == 1
+
+
+def test_pipeline_rechaza_media_sin_id():
+    pipeline = MediaPipeline(workers=1, queue_size=2)
+    with pytest.raises(MediaError):
+        pipeline.submit(ReceiptJob("", "549"))
+    assert pipeline.snapshot()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_webhook_rechaza_media_sin_id():
+    payload = {"entry": [{"changes": [{"value": {"messages": [
+        {"from": "5491110000055", "type": "image", "image": {"mime_type": "image/jpeg"}},
+    ]}}]}]}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        r = await ac.post("/webhook/whatsapp", json=payload)
+    assert r.status_code == 200 and r.json()["status"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_reentregas_concurrentes_del_mismo_media_id(tmp_path, monkeypatch):
+    await init_db()
+    blob = os.urandom(32 * 1024)
+    stub = create_media_stub_app({"dup-1": (blob, "image/png")}, chunk_size=4 * 1024, latency_ms=5)
+    real_resolve = media_service.resolve_media
+    monkeypatch.setattr(media_service, "resolve_media", lambda c, mid: real_resolve(c, mid, "http://stub"))
+    job = ReceiptJob("dup-1", "5491110000056")
+
+    async def ingest():
+        async with SessionLocal() as session:
+            return await ingest_receipt(session, client, job, dest_dir=tmp_path)
+
+    try:
+        async with client_for(stub) as client:
+            results = await asyncio.gather(ingest(), ingest())
+        assert sorted(r.status for r in results) == ["already_ingested", "unmatched"]
+        assert results[0].receipt_id == results[1].receipt_id
+        async with SessionLocal() as s:
+            n = await s.scalar(select(func.count()).where(MediaReceipt.wa_media_id == "dup-1"))
+            assert n == 1
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(MediaReceipt).where(MediaReceipt.wa_media_id == "dup-1"))
+            await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_descarga_sin_transaccion_abierta(tmp_path, monkeypatch):
+    await init_db()
+    stub = create_media_stub_app({"tx-1": (b"comprobante", "image/png")})
+    real_resolve = media_service.resolve_media
+    seen = []
+
+    async def resolve(c, mid):
+        seen.append(session.in_transaction())
+        return await real_resolve(c, mid, "http://stub")
+
+    monkeypatch.setattr(media_service, "resolve_media", resolve)
+    try:
+        async with client_for(stub) as client, SessionLocal() as session:
+            res = await ingest_receipt(session, client, ReceiptJob("tx-1", "5491110000057"), dest_dir=tmp_path)
+        assert res.status == "unmatched" and seen == [False]
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(MediaReceipt).where(MediaReceipt.wa_media_id == "tx-1"))
+            await s.commit()
@@ -0,0 +1,185 @@
+from datetime import date, time
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import db, partitioning
+from app.config import get_settings
+from app.models import (
+    Base, Booking, BookingStatus, Cliente, Enrollment, Message, Payment, PaymentStatus, Profesional, Servicio,
+    ServicioTipo,
+)
+from app.partitioning import partitioned_table_ddl
+
+settings = get_settings()
+ZERO = [0.0] * settings.EMBEDDING_DIM
+
+
+def _ddl(table: str) -> list[str]:
+    return partitioned_table_ddl(Base.metadata.tables[table], postgresql.dialect(), modulus=4)
+
+
+def test_bookings_particionada_por_lista_con_default_hash():
+    stmts = _ddl("bookings")
+    assert stmts[0].endswith("PARTITION BY LIST (profesional_id)")
+    assert "PRIMARY KEY (id, profesional_id)" in stmts[0]
+    assert stmts[1] == (
+        "CREATE TABLE bookings_default PARTITION OF bookings DEFAULT PARTITION BY HASH (profesional_id)"
+    )
+    hojas = [s for s in stmts if "FOR VALUES WITH" in s]
+    assert len(hojas) == 4
+    # los índices únicos tienen que incluir la clave de partición
+    unico = next(s for s in stmts if "ix_booking_unique_turno" in s)
+    assert "(servicio_id, fecha, hora, cliente_id, profesional_id)" in unico
+
+
+def test_fk_hacia_bookings_se_omite():
+    assert "REFERENCES bookings" not in _ddl("payments")[0]
+
+
+def test_clave_nullable_degrada_pk_y_unique_a_indices():
+    stmts = _ddl("messages")
+    assert "PRIMARY KEY" not in stmts[0]
+    assert not any(s.startswith("CREATE UNIQUE INDEX") for s in stmts)
+    assert "CREATE INDEX ix_messages_id ON messages (id)" in stmts
+
+
+# ---------------------------------------------------------------------------
+# Contra Postgres: base descartable creada con TENANT_PARTITIONING
+# ---------------------------------------------------------------------------
+@pytest_asyncio.fixture
+async def part_engine(monkeypatch):
+    url = make_url(settings.DATABASE_URL)
+    name = f"{url.database}_part"
+    admin = db.engine
+    async with admin.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+        try:
+            await conn.execute(text(f"CREATE DATABASE {name} TEMPLATE template0 ENCODING 'UTF8'"))
+        except Exception as exc:        # sin CREATEDB no se puede probar
+            pytest.skip(f"no se pudo crear {name}: {exc}")
+    engine = create_async_engine(url.set(database=name))
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(settings, "TENANT_PARTITIONING", True)
+    monkeypatch.setattr(settings, "TENANT_HASH_PARTITIONS", 2)
+    try:
+        await db.init_db()
+        yield engine
+    finally:
+        await engine.dispose()
+        async with admin.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+
+
+async def _tenant(Session) -> tuple[int, int, int, int]:
+    """Profesional con un turno atendido y un pago verificado: (pid, cid, sid, booking_id)."""
+    async with Session() as s:
+        prof = Profesional(nombre="Tenant grande", telefono="5491110000091", embedding=ZERO)
+        cli = Cliente(nombre="Cliente grande", telefono="5491110000092", embedding=ZERO)
+        s.add_all([prof, cli])
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                        embedding=ZERO)
+        s.add(serv)
+        await s.flush()
+        b = Booking(servicio_id=serv.id, profesional_id=prof.id, cliente_id=cli.id, fecha=date(2026, 10, 7),
+                    hora=time(10), tipo="turno", status=BookingStatus.ATTENDED)
+        s.add(b)
+        await s.flush()
+        s.add(Payment(profesional_id=prof.id, cliente_id=cli.id, booking_id=b.id, amount=100.0,
+                      status=PaymentStatus.VERIFIED))
+        s.add(Enrollment(booking_id=b.id, cliente_id=cli.id))
+        await s.commit()
+        return prof.id, cli.id, serv.id, b.id
+
+
+async def _derivados(conn, pid: int) -> tuple:
+    billing = (await conn.execute(text(
+        "SELECT cliente_id, month, paid_amount, pending_amount, rejected_amount, sessions_attended "
+        "FROM billing_monthly WHERE profesional_id = :p ORDER BY 1, 2"
+    ), {"p": pid})).all()
+    changes = (await conn.execute(text(
+        "SELECT booking_id, version, deleted FROM booking_changes WHERE profesional_id = :p ORDER BY 1"
+    ), {"p": pid})).all()
+    version = await conn.scalar(text("SELECT bookings_version FROM profesionales WHERE id = :p"), {"p": pid})
+    return billing, changes, version
+
+
+@pytest.mark.asyncio
+async def test_move_tenant_no_dispara_los_triggers_de_usuario(part_engine):
+    Session = async_sessionmaker(part_engine, expire_on_commit=False)
+    pid, cid, sid, _ = await _tenant(Session)
+    async with part_engine.connect() as conn:
+        antes = await _derivados(conn, pid)
+    assert antes[0] and antes[1]                  # los triggers sí corrieron al cargar
+
+    async with part_engine.begin() as conn:
+        await partitioning.move_tenant(conn, pid, ("bookings", "payments"))
+        assert await conn.scalar(text("SELECT current_setting('session_replication_role')")) == "origin"
+
+    async with part_engine.connect() as conn:
+        assert await _derivados(conn, pid) == antes
+        assert await conn.scalar(text(f"SELECT count(*) FROM bookings_p{pid}")) == 1
+        assert await conn.scalar(text(f"SELECT count(*) FROM payments_p{pid}")) == 1
+        assert await conn.scalar(text("SELECT count(*) FROM enrollments")) == 1    # sin "cascade" falso
+
+    # la partición nueva hereda los triggers del padre al hacer ATTACH
+    async with Session() as s:
+        s.add(Booking(servicio_id=sid, profesional_id=pid, cliente_id=cid, fecha=date(2026, 10, 8),
+                      hora=time(10), tipo="turno", status=BookingStatus.ATTENDED))
+        await s.commit()
+    async with part_engine.connect() as conn:
+        billing, changes, version = await _derivados(conn, pid)
+    assert len(changes) == 2 and version == antes[2] + 1
+    assert billing[0].sessions_attended == antes[0][0].sessions_attended + 1
+
+
+@pytest.mark.asyncio
+async def test_triggers_reemplazan_las_fks_hacia_bookings(part_engine):
+    Session = async_sessionmaker(part_engine, expire_on_commit=False)
+    pid, cid, sid, bid = await _tenant(Session)
+
+    async with Session() as s:
+        s.add(Payment(profesional_id=pid, cliente_id=cid, booking_id=bid + 1000, amount=1.0))
+        with pytest.raises(IntegrityError, match="no existe"):
+            await s.commit()
+
+    # con pagos asociados no se puede borrar (como la FK NO ACTION)
+    async with Session() as s:
+        with pytest.raises(IntegrityError, match="pagos"):
+            await s.execute(delete(Booking).where(Booking.id == bid))
+            await s.commit()
+
+    async with Session() as s:
+        await s.execute(delete(Payment).where(Payment.booking_id == bid))
+        await s.execute(delete(Booking).where(Booking.id == bid))
+        await s.commit()
+        # ON DELETE CASCADE emulado
+        assert (await s.scalars(select(Enrollment.id).where(Enrollment.booking_id == bid))).all() == []
+
+
+@pytest.mark.asyncio
+async def test_wa_message_id_sigue_siendo_unico(part_engine):
+    Session = async_sessionmaker(part_engine, expire_on_commit=False)
+    async with Session() as s:
+        s.add(Message(direction="OUT", raw_sender="1", text="a", wa_message_id="wamid.1"))
+        s.add(Message(direction="OUT", raw_sender="1", text="b"))
+        await s.commit()
+        s.add(Message(direction="OUT", raw_sender="2", text="c", wa_message_id="wamid.1"))
+        with pytest.raises(IntegrityError, match="duplicado"):
+            await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_index_tenant_rechaza_la_tabla_particionada(part_engine, monkeypatch):
+    from app import context_search
+    monkeypatch.setattr(context_search, "engine", part_engine)
+    with pytest.raises(SystemExit, match="move-tenant"):
+        await context_search.index_tenant(42)
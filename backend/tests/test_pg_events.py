@@ -0,0 +1,45 @@
+import asyncio
+import gc
+import logging
+
+import pytest
+
+from app.pg_events import PgEventListener
+
+
+@pytest.mark.asyncio
+async def test_handlers_async_se_retienen_y_sus_errores_se_loguean(caplog):
+    listener = PgEventListener()
+    done = asyncio.Event()
+
+    async def ok(event):
+        await asyncio.sleep(0.01)
+        gc.collect()                       # sin referencia fuerte, la tarea podría recolectarse acá
+        done.set()
+
+    async def falla(event):
+        raise RuntimeError(f"boom {event['id']}")
+
+    listener.subscribe("bookings_changed", ok)
+    listener.subscribe("bookings_changed", falla)
+    with caplog.at_level(logging.ERROR, logger="pg_events"):
+        listener._dispatch(None, 0, "bookings_changed", '{"op": "INSERT", "id": 7, "profesional_id": 1}')
+        assert len(listener._handler_tasks) == 2
+        await asyncio.wait_for(done.wait(), 1)
+        await asyncio.sleep(0)
+
+    assert not listener._handler_tasks
+    assert any("boom 7" in str(r.exc_info[1]) for r in caplog.records if r.exc_info)
+
+
+@pytest.mark.asyncio
+async def test_stop_cancela_handlers_en_vuelo():
+    listener = PgEventListener()
+
+    async def lento(event):
+        await asyncio.sleep(10)
+
+    listener.subscribe("payments_changed", lento)
+    listener._dispatch(None, 0, "payments_changed", '{"op": "UPDATE", "id": 1, "profesional_id": 1}')
+    await listener.stop()
+    assert not listener._handler_tasks
@@ -0,0 +1,77 @@
+from app import prompt_builder
+from app.prompt_builder import build_prompt, compact_json, count_tokens, truncate_to_tokens
+
+SYSTEM = "Sos el asistente de un profesional. Respondé breve y en español."
+STATE = {
+    "next_booking": {"fecha": "2026-10-20", "hora": "10:00", "servicio_id": 3, "status": "CONFIRMED"},
+    "recent_bookings": [],
+    "total_paid": 1500.0,
+    "pending_balance": 0.0,
+    "notas": None,
+}
+
+
+def _history(n: int) -> list[tuple[str, str]]:
+    return [("IN" if i % 2 == 0 else "OUT", f"mensaje número {i} con algo de texto") for i in range(n)]
+
+
+def test_prefijo_estatico_primero_y_estable():
+    a = build_prompt(system=SYSTEM, task="¿Cuánto debo?", state=STATE, history=_history(4), budget=2000)
+    b = build_prompt(system=SYSTEM, task="¿A qué hora es?", state=STATE, history=_history(5), budget=2000)
+    assert a.messages[0] == b.messages[0] == {"role": "system", "content": SYSTEM}
+    assert a.messages[1] == b.messages[1]                  # estado serializado idéntico
+    assert a.messages[-1]["content"] == "¿Cuánto debo?"
+
+
+def test_state_json_compacto():
+    out = compact_json(STATE)
+    assert " " not in out.replace("2026-10-20", "")
+    assert "recent_bookings" not in out and "notas" not in out
+    assert out.index('"next_booking"') < out.index('"total_paid"')   # claves ordenadas
+
+
+def test_presupuesto_descarta_primero_el_historial_mas_viejo():
+    full = build_prompt(system=SYSTEM, task="hola", state=STATE, history=_history(40), budget=100_000)
+    assert full.history_dropped == 0
+
+    budget = full.prompt_tokens // 2
+    p = build_prompt(system=SYSTEM, task="hola", state=STATE, history=_history(40), budget=budget)
+    assert p.prompt_tokens <= budget
+    assert 0 < p.history_used < 40 and p.history_dropped == 40 - p.history_used
+    hist = p.messages[2]["content"]
+    assert f"({p.history_dropped} mensajes anteriores omitidos)" in hist
+    assert "mensaje número 39" in hist and "mensaje número 0 " not in hist
+    assert not p.state_dropped
+
+
+def test_presupuesto_minimo_recorta_estado_y_tarea():
+    task = "palabra " * 500
+    p = build_prompt(system=SYSTEM, task=task, state=STATE, history=_history(3), budget=120)
+    assert p.state_dropped and p.task_truncated
+    assert p.prompt_tokens <= 120
+    assert count_tokens(p.messages[-1]["content"]) < count_tokens(task)
+
+
+class _CharEncoding:
+    """Sustituto de tiktoken: un token por carácter."""
+
+    def encode(self, text: str) -> list[int]:
+        return [ord(c) for c in text]
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(chr(t) for t in tokens)
+
+
+def test_truncate_con_encoding_conserva_el_final(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "_encoding", lambda model: _CharEncoding())
+    assert truncate_to_tokens("abcdefghij", 20) == "abcdefghij"
+    assert truncate_to_tokens("abcdefghij", 4) == "…hij"
+    assert truncate_to_tokens("abcdefghij", 1) == "…"         # [-0:] devolvería todo el texto
+    assert truncate_to_tokens("abcdefghij", 0) == ""
+
+
+def test_truncate_con_estimacion():
+    text = "uno dos tres cuatro cinco seis siete ocho nueve diez"
+    out = truncate_to_tokens(text, 6)
+    assert out.startswith("…") and text.endswith(out[1:]) and count_tokens(out) <= 6
+    assert truncate_to_tokens(text, 1) == "…"
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import date, time
+
+import pytest
+import pytest_asyncio
+from pydantic import ValidationError
+from sqlalchemy import delete, func, select
+
+from app import recurrence
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.models import Booking, Cliente, Enrollment, Profesional, Servicio, ServicioTipo
+from app.recurrence import RecurrenceError, RecurrenceRule
+
+settings = get_settings()
+ZERO = [0.0] * settings.EMBEDDING_DIM
+
+REGLA = {
+    "semanal": [{"dia": 0, "hora": "18:00"}, {"dia": 3, "hora": "09:30"}, {"dia": 0, "hora": "08:00"}],
+    "desde": "2026-10-01",
+    "hasta": "2026-10-31",
+    "excepciones": ["2026-10-12"],
+    "excepciones_horario": ["2026-10-19T18:00"],
+}
+
+
+def test_expand_respeta_dias_horas_y_vigencia():
+    rule = RecurrenceRule.model_validate(REGLA)
+    occ = list(rule.expand(date(2026, 9, 28), date(2026, 10, 8)))
+    # 28/9 (lunes) queda antes de `desde`; 1/10 es jueves
+    assert occ == [
+        (date(2026, 10, 1), time(9, 30)),
+        (date(2026, 10, 5), time(8, 0)),
+        (date(2026, 10, 5), time(18, 0)),
+        (date(2026, 10, 8), time(9, 30)),
+    ]
+    assert list(rule.expand(date(2026, 11, 1), date(2026, 11, 30))) == []   # después de `hasta`
+
+
+def test_excepciones_de_dia_y_de_horario():
+    rule = RecurrenceRule.model_validate(REGLA)
+    occ = set(rule.expand(date(2026, 10, 12), date(2026, 10, 19)))
+    assert (date(2026, 10, 12), time(18, 0)) not in occ      # feriado: día completo
+    assert (date(2026, 10, 19), time(8, 0)) in occ
+    assert (date(2026, 10, 19), time(18, 0)) not in occ      # sólo esa ocurrencia
+    assert rule.has(date(2026, 10, 15), time(9, 30))
+    assert not rule.has(date(2026, 10, 15), time(10, 0))
+
+
+def test_regla_invalida():
+    with pytest.raises(ValidationError):
+        RecurrenceRule.model_validate({**REGLA, "hasta": "2026-09-01"})
+    with pytest.raises(ValidationError):
+        RecurrenceRule.model_validate({**REGLA, "semanal": [{"dia": 7, "hora": "10:00"}]})
+
+
+# ---------------------------------------------------------------------------
+# Contra Postgres: materialización, cupo e edición de la regla
+# ---------------------------------------------------------------------------
+HOY = date(2026, 11, 2)          # lunes
+LUNES_Y_JUEVES = {"semanal": [{"dia": 0, "hora": "18:00"}, {"dia": 3, "hora": "09:30"}], "desde": "2026-10-01"}
+TELS = [f"54911100007{i:02d}" for i in range(5)]
+
+
+@pytest_asyncio.fixture
+async def clase(monkeypatch):
+    """Clase grupal (cupo 2) con la regla LUNES_Y_JUEVES; devuelve (servicio_id, clientes)."""
+    monkeypatch.setattr(recurrence, "today", lambda: HOY)
+    monkeypatch.setattr(settings, "RECURRENCE_HORIZON_DAYS", 7)
+    await init_db()
+    async with SessionLocal() as s:
+        prof = Profesional(nombre="Clases Rec", telefono="5491110000079", embedding=ZERO)
+        clientes = [Cliente(nombre=f"Alumno {i}", telefono=tel, embedding=ZERO) for i, tel in enumerate(TELS)]
+        s.add_all([prof, *clientes])
+        await s.flush()
+        serv = Servicio(profesional_id=prof.id, nombre="Pilates", tipo=ServicioTipo.GRUPAL, duracion_min=60,
+                        capacidad=2, recurrence=LUNES_Y_JUEVES, embedding=ZERO)
+        s.add(serv)
+        await s.commit()
+        ids = (serv.id, [c.id for c in clientes])
+        pid = prof.id
+    yield ids
+    async with SessionLocal() as s:
+        bookings = select(Booking.id).where(Booking.profesional_id == pid)
+        await s.execute(delete(Enrollment).where(Enrollment.booking_id.in_(bookings)))
+        await s.execute(delete(Booking).where(Booking.profesional_id == pid))
+        await s.execute(delete(Servicio).where(Servicio.profesional_id == pid))
+        await s.execute(delete(Profesional).where(Profesional.id == pid))
+        await s.execute(delete(Cliente).where(Cliente.telefono.in_(TELS)))
+        await s.commit()
+
+
+async def _filas(s, sid: int) -> list[tuple[date, time]]:
+    res = await s.execute(select(Booking.fecha, Booking.hora).where(Booking.servicio_id == sid).order_by(Booking.fecha))
+    return [tuple(r) for r in res.all()]
+
+
+@pytest.mark.asyncio
+async def test_list_occurrences_materializa_solo_el_horizonte_y_mezcla(clase):
+    sid, _ = clase
+    async with SessionLocal() as s:
+        serv = await s.get(Servicio, sid)
+        # una clase puntual fuera de la regla también aparece
+        s.add(Booking(servicio_id=sid, profesional_id=serv.profesional_id, fecha=date(2026, 11, 3), hora=time(10),
+                      tipo="clase", capacity_used=0, capacity_total=2))
+        await s.commit()
+
+        items = await recurrence.list_occurrences(s, serv, date(2026, 10, 26), date(2026, 11, 16))
+        assert [(i["fecha"], i["hora"], i["virtual"]) for i in items] == [
+            ("2026-10-26", "18:00", True),     # pasado: no se materializa
+            ("2026-10-29", "09:30", True),
+            ("2026-11-02", "18:00", False),    # hoy … hoy + horizonte
+            ("2026-11-03", "10:00", False),
+            ("2026-11-05", "09:30", False),
+            ("2026-11-09", "18:00", False),
+            ("2026-11-12", "09:30", True),     # más allá del horizonte
+            ("2026-11-16", "18:00", True),
+        ]
+        assert all(i["booking_id"] for i in items if not i["virtual"])
+        antes = await _filas(s, sid)
+        assert len(antes) == 4
+
+        # consultar de nuevo no duplica filas
+        await recurrence.list_occurrences(s, serv, date(2026, 10, 26), date(2026, 11, 16))
+        assert await _filas(s, sid) == antes
+
+        with pytest.raises(RecurrenceError):
+            await recurrence.list_occurrences(s, serv, date(2026, 11, 16), date(2026, 10, 26))
+
+
+@pytest.mark.asyncio
+async def test_enroll_respeta_el_cupo_con_inscripciones_concurrentes(clase):
+    sid, clientes = clase
+
+    async def inscribir(cid: int) -> str:
+        async with SessionLocal() as s:
+            serv = await s.get(Servicio, sid)
+            try:
+                await recurrence.enroll(s, serv, date(2026, 11, 12), time(9, 30), cid)   # aún virtual
+            except RecurrenceError as e:
+                return str(e)
+            return "ok"
+
+    results = await asyncio.gather(*(inscribir(c) for c in clientes))
+    assert results.count("ok") == 2
+    assert results.count("No quedan lugares en esa clase") == 3
+
+    async with SessionLocal() as s:
+        b = (await s.execute(select(Booking).where(Booking.servicio_id == sid))).scalar_one()
+        n = await s.scalar(select(func.count()).select_from(Enrollment).where(Enrollment.booking_id == b.id))
+        assert (b.capacity_used, n) == (2, 2)
+
+        # reinscribirse no consume otro lugar; una clase pasada o inexistente se rechaza
+        serv = await s.get(Servicio, sid)
+        ok = [c for c, r in zip(clientes, results) if r == "ok"]
+        assert (await recurrence.enroll(s, serv, date(2026, 11, 12), time(9, 30), ok[0])).capacity_used == 2
+        with pytest.raises(RecurrenceError, match="ya pasó"):
+            await recurrence.enroll(s, serv, date(2026, 10, 29), time(9, 30), ok[0])
+        with pytest.raises(RecurrenceError, match="No hay clase"):
+            await recurrence.enroll(s, serv, date(2026, 11, 11), time(9, 30), ok[0])
+
+
+@pytest.mark.asyncio
+async def test_set_rule_borra_solo_las_futuras_vacias_que_ya_no_existen(clase):
+    sid, clientes = clase
+    async with SessionLocal() as s:
+        serv = await s.get(Servicio, sid)
+        # una ocurrencia pasada materializada (historial) y las del horizonte
+        s.add(Booking(servicio_id=sid, profesional_id=serv.profesional_id, fecha=date(2026, 10, 26), hora=time(18),
+                      tipo="clase", capacity_used=0, capacity_total=2))
+        await s.commit()
+        await recurrence.list_occurrences(s, serv, HOY, date(2026, 11, 9))
+        await recurrence.enroll(s, serv, date(2026, 11, 9), time(18), clientes[0])
+
+        # pasa a ser sólo los jueves: se van los lunes futuros sin inscriptos
+        solo_jueves = RecurrenceRule.model_validate({**LUNES_Y_JUEVES, "semanal": [{"dia": 3, "hora": "09:30"}]})
+        assert await recurrence.set_rule(s, serv, solo_jueves) == 1          # el 02/11
+        assert await _filas(s, sid) == [
+            (date(2026, 10, 26), time(18)), (date(2026, 11, 5), time(9, 30)), (date(2026, 11, 9), time(18)),
+        ]
+        assert (await s.get(Servicio, sid)).recurrence["semanal"] == [{"dia": 3, "hora": "09:30:00"}]
+
+        # sin regla: también se va el jueves vacío; el lunes con inscriptos y el pasado quedan
+        assert await recurrence.set_rule(s, serv, None) == 1
+        assert await _filas(s, sid) == [(date(2026, 10, 26), time(18)), (date(2026, 11, 9), time(18))]
@@ -0,0 +1,221 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from app import reembed
+from app.db import SessionLocal, engine, init_db
+
+
+def _target(table: str) -> reembed.Target:
+    return next(t for t in reembed.TARGETS if t.table == table)
+
+
+def test_nombres_de_columnas_indices_y_trigger():
+    t = _target("clientes")
+    assert (t.shadow, t.prev, t.trigger) == ("embedding_next", "embedding_prev", "trg_reembed_clientes")
+    assert t.index == "idx_clientes_embedding_ivf"
+    assert t.index_using.startswith("ivfflat (embedding_next ")
+
+    rel = _target("relationship_state")
+    assert (rel.shadow, rel.prev) == ("summary_embedding_next", "summary_embedding_prev")
+    assert rel.index == "idx_relationship_state_summary_hnsw"
+    assert rel.index_using.startswith("hnsw (summary_embedding_next ")
+
+    assert reembed.Target("otra", "embedding", ("x",), "x").index is None
+
+
+class _FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def fases(monkeypatch):
+    """Corre `run` con fases simuladas; devuelve (estados por tabla, llamadas en orden)."""
+    states: dict[str, SimpleNamespace] = {}
+    calls: list[tuple[str, str]] = []
+    valid: dict[str, bool] = {}
+
+    class FakeModel:
+        def __init__(self, *a, **k):
+            pass
+
+        def get_sentence_embedding_dimension(self):
+            return 4
+
+    async def get_state(session, t, model, dim):
+        return states.setdefault(t.table, SimpleNamespace(phase="shadow"))
+
+    def phase(name, nxt):
+        async def run_phase(session, t, st, *args):
+            calls.append((t.table, name))
+            st.phase = nxt
+        return run_phase
+
+    async def index_valid(conn, name):
+        return valid.get(name, True)
+
+    async def tenant_indexes(conn, t, suffix=""):
+        return []
+
+    monkeypatch.setattr(reembed, "SentenceTransformer", FakeModel)
+    monkeypatch.setattr(reembed, "SessionLocal", _FakeSession)
+    monkeypatch.setattr(reembed, "_get_state", get_state)
+    monkeypatch.setattr(reembed, "_phase_shadow", phase("shadow", "backfill"))
+    monkeypatch.setattr(reembed, "_phase_backfill", phase("backfill", "index"))
+    monkeypatch.setattr(reembed, "_phase_index", phase("index", "ready"))
+    monkeypatch.setattr(reembed, "_index_valid", index_valid)
+    monkeypatch.setattr(reembed, "_tenant_indexes", tenant_indexes)
+    return states, calls, valid
+
+
+@pytest.mark.asyncio
+async def test_run_recorre_las_fases_en_orden_y_reanuda(fases):
+    states, calls, _ = fases
+    states["servicios"] = SimpleNamespace(phase="index")     # corte previo a mitad de camino
+    states["clientes"] = SimpleNamespace(phase="ready")
+
+    await reembed.run("m", None, 10, 0)
+
+    assert [c for t, c in calls if t == "profesionales"] == ["shadow", "backfill", "index"]
+    assert [c for t, c in calls if t == "servicios"] == ["index"]
+    assert [c for t, c in calls if t == "clientes"] == []
+    assert all(st.phase == "ready" for st in states.values())
+
+
+@pytest.mark.asyncio
+async def test_run_rehace_el_indice_si_quedo_invalido(fases):
+    states, calls, valid = fases
+    for t in reembed.TARGETS:
+        states[t.table] = SimpleNamespace(phase="ready")
+    valid["idx_servicios_embedding_ivf_next"] = False
+
+    await reembed.run("m", None, 10, 0)
+
+    assert calls == [("servicios", "index")]
+
+
+@pytest.mark.asyncio
+async def test_run_valida_la_dimension(fases):
+    with pytest.raises(SystemExit):
+        await reembed.run("m", 8, 10, 0)
+
+
+@pytest.mark.asyncio
+async def test_phase_index_reconstruye_un_indice_invalido(monkeypatch):
+    monkeypatch.setattr(reembed, "INDEX_TARGETS", (("reembed_tmp", "embedding", "idx_reembed_tmp_ivf"),))
+    t = reembed.Target("reembed_tmp", "embedding", ("nombre",), "nombre")
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await conn.execute(text("DROP TABLE IF EXISTS reembed_tmp"))
+        await conn.execute(text(
+            "CREATE TABLE reembed_tmp (id serial PRIMARY KEY, nombre text, embedding vector(3), embedding_next vector(3))"
+        ))
+        await conn.execute(text("INSERT INTO reembed_tmp (nombre, embedding_next) VALUES ('a', '[1,0,0]'), ('a', '[0,1,0]')"))
+        # un CONCURRENTLY que falla deja el índice creado pero INVALID
+        with pytest.raises(Exception):
+            await conn.execute(text("CREATE UNIQUE INDEX CONCURRENTLY idx_reembed_tmp_ivf_next ON reembed_tmp (nombre)"))
+        assert await reembed._index_valid(conn, "idx_reembed_tmp_ivf_next") is False
+
+    try:
+        async with SessionLocal() as session:
+            st = SimpleNamespace(phase="index")
+            await reembed._phase_index(session, t, st)
+            assert st.phase == "ready"
+            assert await reembed._index_valid(session, "idx_reembed_tmp_ivf_next") is True
+            indexdef = await session.scalar(text(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = 'idx_reembed_tmp_ivf_next'"
+            ))
+            assert "ivfflat" in indexdef
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("DROP TABLE IF EXISTS reembed_tmp"))
+
+
+class _Modelo3:
+    """Modelo falso de 3 dimensiones para correr `run` contra la DB."""
+
+    def __init__(self, *a, **k):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return 3
+
+    def encode(self, texts, batch_size=32):
+        return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+
+@pytest_asyncio.fixture
+async def tabla_tmp(monkeypatch):
+    """`run` sin mocks de fases sobre una tabla descartable (reembed_run_tmp)."""
+    t = reembed.Target("reembed_run_tmp", "embedding", ("nombre",), "nombre")
+    monkeypatch.setattr(reembed, "TARGETS", (t,))
+    monkeypatch.setattr(reembed, "INDEX_TARGETS", (("reembed_run_tmp", "embedding", "idx_reembed_run_tmp_ivf"),))
+    monkeypatch.setattr(reembed, "SentenceTransformer", _Modelo3)
+    await init_db()
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await conn.execute(text("DROP TABLE IF EXISTS reembed_run_tmp"))
+        await conn.execute(text("CREATE TABLE reembed_run_tmp (id serial PRIMARY KEY, nombre text, embedding vector(3))"))
+        await conn.execute(text("INSERT INTO reembed_run_tmp (nombre) VALUES ('a'), ('bb'), ('ccc')"))
+        await conn.execute(text("DELETE FROM embedding_migrations WHERE table_name = 'reembed_run_tmp'"))
+    try:
+        yield t
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("DROP TABLE IF EXISTS reembed_run_tmp"))
+            await conn.execute(text("DROP FUNCTION IF EXISTS trg_reembed_reembed_run_tmp_fn()"))
+            await conn.execute(text("DELETE FROM embedding_migrations WHERE table_name = 'reembed_run_tmp'"))
+
+
+async def _fase(t) -> str:
+    async with SessionLocal() as session:
+        return await session.scalar(text(
+            "SELECT phase FROM embedding_migrations WHERE table_name = :t AND model = 'm3'"
+        ), {"t": t.table})
+
+
+@pytest.mark.asyncio
+async def test_run_real_termina_tras_reanudar_y_rehacer_el_indice(tabla_tmp):
+    t = tabla_tmp
+    # el timeout convierte el autobloqueo (CONCURRENTLY esperando a la propia sesión) en un fallo
+    await asyncio.wait_for(reembed.run("m3", None, 2, 0), 30)
+    assert await _fase(t) == "ready"
+    async with SessionLocal() as session:
+        nulls = await session.scalar(text("SELECT count(*) FROM reembed_run_tmp WHERE embedding_next IS NULL"))
+        assert nulls == 0 and await reembed._index_valid(session, "idx_reembed_run_tmp_ivf_next") is True
+
+    # reanudación en "index": el SELECT de _get_state deja la transacción abierta
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX idx_reembed_run_tmp_ivf_next"))
+        await conn.execute(text("UPDATE embedding_migrations SET phase = 'index' WHERE table_name = 'reembed_run_tmp'"))
+    await asyncio.wait_for(reembed.run("m3", None, 2, 0), 30)
+    assert await _fase(t) == "ready"
+
+    # "ready" pero sin índice: la verificación previa también abre transacción
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX idx_reembed_run_tmp_ivf_next"))
+    await asyncio.wait_for(reembed.run("m3", None, 2, 0), 30)
+    async with SessionLocal() as session:
+        assert await reembed._index_valid(session, "idx_reembed_run_tmp_ivf_next") is True
+
+
+@pytest.mark.asyncio
+async def test_texto_sql_de_profesionales_igual_al_embebido():
+    from app.embedding_service import texto_profesional
+    t = _target("profesionales")
+    async with SessionLocal() as session:
+        for nombre, esp, bio in (("Ana", "Kinesiología", "Deportiva"), ("Beto", None, None)):
+            got = await session.scalar(text(
+                f"SELECT {t.source_sql} FROM (SELECT CAST(:n AS varchar) AS nombre, "
+                "CAST(:e AS varchar) AS especialidad, CAST(:b AS varchar) AS bio) p"
+            ), {"n": nombre, "e": esp, "b": bio})
+            assert got == texto_profesional(nombre, esp, bio)
+    assert set(t.source_cols) == {"nombre", "especialidad", "bio"}
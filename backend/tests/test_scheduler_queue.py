@@ -0,0 +1,206 @@
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, select
+
+from app import scheduler as scheduler_mod
+from app.config import get_settings
+from app.db import SessionLocal, init_db
+from app.models import (
+    BillingMonthly, Booking, BookingChange, BookingStatus, Cliente, Payment, Profesional, ScheduledNotification,
+    Servicio, ServicioTipo,
+)
+from app.scheduler import DueItem, DueQueue, Scheduler, query_due
+from app.whatsapp_sender import SendResult
+
+settings = get_settings()
+ZERO = [0.0] * settings.EMBEDDING_DIM
+
+T0 = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> datetime:
+    return T0 + timedelta(minutes=minutes)
+
+
+def test_pop_due_en_orden_de_vencimiento():
+    q = DueQueue()
+    q.push(DueItem(at(10), "booking_reminder", 1))
+    q.push(DueItem(at(5), "cancel_deadline", 1))
+    q.push(DueItem(at(30), "payment_nudge", 7))
+
+    assert q.next_due() == at(5)
+    due = q.pop_due(at(10))
+    assert [(i.kind, i.ref_id) for i in due] == [("cancel_deadline", 1), ("booking_reminder", 1)]
+    assert len(q) == 1
+
+
+def test_reagendar_invalida_la_entrada_vieja():
+    q = DueQueue()
+    q.push(DueItem(at(5), "booking_reminder", 1))
+    q.push(DueItem(at(60), "booking_reminder", 1))   # el turno se movió
+
+    assert q.pop_due(at(10)) == []
+    assert q.next_due() == at(60)
+    assert [i.due_at for i in q.pop_due(at(60))] == [at(60)]
+
+
+def test_discard_y_push_idempotente():
+    q = DueQueue()
+    item = DueItem(at(5), "booking_reminder", 1)
+    assert q.push(item) is True
+    assert q.push(item) is False        # recarga de ventana: no duplica
+    q.discard("booking_reminder", 1)    # booking cancelado
+    assert q.next_due() is None
+    assert q.pop_due(at(100)) == []
+
+
+# ---------------------------------------------------------------------------
+# Contra Postgres: consulta de vencimientos, claim único y recuperación
+# ---------------------------------------------------------------------------
+@pytest_asyncio.fixture
+async def agenda_db(monkeypatch):
+    """Profesional, cliente y dos servicios (con y sin límite de cancelación)."""
+    for name, value in {
+        "SCHEDULER_TZ": "America/Argentina/Buenos_Aires",     # UTC-3 fijo, sin horario de verano
+        "SCHEDULER_REMINDER_LEAD_MIN": 1440,
+        "SCHEDULER_CANCEL_WARN_LEAD_MIN": 60,
+        "SCHEDULER_PAYMENT_NUDGE_AFTER_MIN": 1440,
+        "SCHEDULER_CATCHUP_MAX_MIN": 360,
+        "SCHEDULER_WINDOW_MIN": 15,
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+    await init_db()
+    async with SessionLocal() as s:
+        prof = Profesional(nombre="Agenda Sched", telefono="5491110000081", embedding=ZERO)
+        cli = Cliente(nombre="Cliente Sched", telefono="5491110000082", embedding=ZERO)
+        s.add_all([prof, cli])
+        await s.flush()
+        con_limite = Servicio(profesional_id=prof.id, nombre="Kinesio", tipo=ServicioTipo.TURNO, duracion_min=60,
+                              cancellation_limit_min=120, embedding=ZERO)
+        sin_limite = Servicio(profesional_id=prof.id, nombre="Yoga", tipo=ServicioTipo.TURNO, duracion_min=60,
+                              embedding=ZERO)
+        s.add_all([con_limite, sin_limite])
+        await s.commit()
+        ids = {"pid": prof.id, "cid": cli.id, "con_limite": con_limite.id, "sin_limite": sin_limite.id}
+    yield ids
+    async with SessionLocal() as s:
+        bookings = select(Booking.id).where(Booking.profesional_id == ids["pid"])
+        payments = select(Payment.id).where(Payment.profesional_id == ids["pid"])
+        await s.execute(delete(ScheduledNotification).where(
+            ScheduledNotification.ref_id.in_(bookings) | ScheduledNotification.ref_id.in_(payments)
+        ))
+        for model in (Payment, Booking, BillingMonthly, BookingChange):
+            await s.execute(delete(model).where(model.profesional_id == ids["pid"]))
+        await s.execute(delete(Servicio).where(Servicio.profesional_id == ids["pid"]))
+        await s.execute(delete(Profesional).where(Profesional.id == ids["pid"]))
+        await s.execute(delete(Cliente).where(Cliente.id == ids["cid"]))
+        await s.commit()
+
+
+async def _booking(ids, servicio: str, fecha: date, hora: time, **kw) -> int:
+    async with SessionLocal() as s:
+        b = Booking(servicio_id=ids[servicio], profesional_id=ids["pid"], cliente_id=ids["cid"], fecha=fecha,
+                    hora=hora, tipo="turno", **kw)
+        s.add(b)
+        await s.commit()
+        return b.id
+
+
+def _mios(items, *ref_ids) -> set[tuple[str, int, datetime]]:
+    return {(i.kind, i.ref_id, i.due_at) for i in items if i.ref_id in ref_ids}
+
+
+@pytest.mark.asyncio
+async def test_query_due_calcula_vencimientos_en_la_zona_del_negocio(agenda_db):
+    ids = agenda_db
+    utc = timezone.utc
+    # 10/03 10:00 en Buenos Aires = 13:00 UTC
+    kine = await _booking(ids, "con_limite", date(2026, 3, 10), time(10))
+    yoga = await _booking(ids, "sin_limite", date(2026, 3, 10), time(11))
+    cancelado = await _booking(ids, "con_limite", date(2026, 3, 10), time(12), status=BookingStatus.CANCELLED)
+    async with SessionLocal() as s:
+        pago = Payment(profesional_id=ids["pid"], cliente_id=ids["cid"], amount=10.0,
+                       created_at=datetime(2026, 3, 9, 8, 0))          # naive UTC
+        s.add(pago)
+        await s.commit()
+
+        items = await query_due(s, datetime(2026, 3, 9, tzinfo=utc), datetime(2026, 3, 11, tzinfo=utc))
+        assert _mios(items, kine, yoga, cancelado) == {
+            ("booking_reminder", kine, datetime(2026, 3, 9, 13, 0, tzinfo=utc)),
+            # 13:00 UTC - (120 min de límite + 60 de aviso)
+            ("cancel_deadline", kine, datetime(2026, 3, 10, 10, 0, tzinfo=utc)),
+            ("booking_reminder", yoga, datetime(2026, 3, 9, 14, 0, tzinfo=utc)),
+        }
+        pagos = [i for i in items if i.kind == "payment_nudge" and i.ref_id == pago.id]
+        assert [i.due_at for i in pagos] == [datetime(2026, 3, 10, 8, 0, tzinfo=utc)]
+
+        # ventana [start, end): el extremo superior no entra
+        items = await query_due(s, datetime(2026, 3, 9, 13, 0, tzinfo=utc), datetime(2026, 3, 9, 14, 0, tzinfo=utc))
+        assert _mios(items, kine, yoga) == {("booking_reminder", kine, datetime(2026, 3, 9, 13, 0, tzinfo=utc))}
+
+        # lo ya disparado no vuelve (anti-join con scheduled_notifications)
+        s.add(ScheduledNotification(kind="booking_reminder", ref_id=kine,
+                                    due_at=datetime(2026, 3, 9, 13, 0, tzinfo=utc)))
+        await s.commit()
+        items = await query_due(s, datetime(2026, 3, 9, tzinfo=utc), datetime(2026, 3, 11, tzinfo=utc),
+                                booking_id=kine)
+        assert _mios(items, kine) == {("cancel_deadline", kine, datetime(2026, 3, 10, 10, 0, tzinfo=utc))}
+
+
+@pytest.mark.asyncio
+async def test_fire_concurrente_envia_una_sola_vez(agenda_db, monkeypatch):
+    ids = agenda_db
+    bid = await _booking(ids, "sin_limite", date(2026, 3, 10), time(10))
+    enviados = []
+
+    async def fake_notify(session, recipients, body):
+        enviados.append((recipients[0].telefono, body))
+        await asyncio.sleep(0.01)
+        return [SendResult(to=recipients[0].telefono, ok=True, wa_message_id="wamid.sched")]
+
+    monkeypatch.setattr(scheduler_mod, "notify", fake_notify)
+    monkeypatch.setattr(settings, "WHATSAPP_SEND_ENABLED", True)
+    item = DueItem(datetime(2026, 3, 9, 13, 0, tzinfo=timezone.utc), "booking_reminder", bid)
+
+    # varios workers (p.ej. un cambio de líder) disparan el mismo aviso a la vez
+    await asyncio.gather(*(Scheduler()._fire(item) for _ in range(5)))
+
+    assert enviados == [("5491110000082", "Recordatorio: tenés Yoga el 10/03 a las 10:00.")]
+    async with SessionLocal() as s:
+        rows = (await s.scalars(select(ScheduledNotification.status).where(
+            ScheduledNotification.kind == "booking_reminder", ScheduledNotification.ref_id == bid,
+        ))).all()
+    assert rows == ["sent"]
+
+
+@pytest.mark.asyncio
+async def test_recupera_lo_vencido_durante_la_caida(agenda_db, monkeypatch):
+    ids = agenda_db
+    monkeypatch.setattr(settings, "WHATSAPP_SEND_ENABLED", False)
+    tz = ZoneInfo(settings.SCHEDULER_TZ)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+
+    async def turno_con_recordatorio_en(minutos: int) -> int:
+        start = (now + timedelta(minutes=minutos + settings.SCHEDULER_REMINDER_LEAD_MIN)).astimezone(tz)
+        return await _booking(ids, "sin_limite", start.date(), start.time())
+
+    vencido = await turno_con_recordatorio_en(-30)                                   # durante la caída
+    viejo = await turno_con_recordatorio_en(-(settings.SCHEDULER_CATCHUP_MAX_MIN + 60))   # fuera del catch-up
+    proximo = await turno_con_recordatorio_en(5)                                     # dentro de la ventana
+
+    sched = Scheduler()
+    await sched._load_window(now)
+    due = [i for i in sched.queue.pop_due(now) if i.ref_id in (vencido, viejo, proximo)]
+    assert [(i.kind, i.ref_id) for i in due] == [("booking_reminder", vencido)]
+    assert sched.queue.next_due() is not None
+    await sched._fire(due[0])
+
+    # otro líder que arranca después no lo repite
+    otro = Scheduler()
+    await otro._load_window(now)
+    pendientes = otro.queue.pop_due(now + timedelta(minutes=10))
+    assert [i.ref_id for i in pendientes if i.ref_id in (vencido, viejo, proximo)] == [proximo]
@@ -0,0 +1,152 @@
+import threading
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete
+
+from app import admission, search_service
+from app.admission import Shed
+from app.config import get_settings
+from app.db import LEXICAL_INDEX_TARGETS, SessionLocal, init_db, tsv
+from app.models import Profesional
+from app.search_service import rrf_fuse, RRF_K
+
+settings = get_settings()
+
+
+def test_rrf_fuse_prioriza_items_en_ambas_listas():
+    lexical = [10, 20, 30]
+    vector = [30, 40, 10]
+    fused = rrf_fuse([lexical, vector])
+    ids = [i for i, _ in fused]
+
+    # 10 y 30 aparecen en ambas listas → quedan primeros
+    assert set(ids[:2]) == {10, 30}
+    assert dict(fused)[40] == 1.0 / (RRF_K + 2)
+
+
+def test_rrf_fuse_listas_vacias():
+    assert rrf_fuse([[], []]) == []
+
+
+def _row(i: int, nombre: str, exact: bool = False) -> dict:
+    return {"id": i, "nombre": nombre, "exact": exact, "sim": 0.5, "ts": 0.1}
+
+
+@pytest.fixture
+def llamadas(monkeypatch):
+    calls: list[str] = []
+
+    def lexical(rows):
+        async def fn(session, scope, query, k):
+            calls.append("lexical")
+            return rows
+        monkeypatch.setattr(search_service, "lexical_search", fn)
+
+    async def vector(session, scope, query, k):
+        calls.append("vector")
+        return [{"id": 3, "nombre": "Vec", "distancia": 0.1}, {"id": 1, "nombre": "Ana", "distancia": 0.2}]
+
+    monkeypatch.setattr(search_service, "vector_search", vector)
+    return calls, lexical
+
+
+@pytest.mark.asyncio
+async def test_match_exacto_no_calcula_embedding(llamadas):
+    calls, lexical = llamadas
+    lexical([_row(1, "Ana Pérez", exact=True), _row(2, "Ana Paz")])
+    out = await search_service.search(None, "ana pérez", top_k=1)
+    assert out["fast_path"] is True and calls == ["lexical"]
+    assert out["results"] == [{"id": 1, "nombre": "Ana Pérez", "score": None, "distancia": None}]
+
+
+@pytest.mark.asyncio
+async def test_modos(llamadas):
+    calls, lexical = llamadas
+    lexical([_row(1, "Ana"), _row(2, "Beto")])
+
+    out = await search_service.search(None, "ana", mode="lexical", top_k=5)
+    assert calls == ["lexical"] and out["fast_path"] is False and [r["id"] for r in out["results"]] == [1, 2]
+
+    calls.clear()
+    out = await search_service.search(None, "ana", mode="vector", top_k=5)
+    assert calls == ["vector"] and [r["id"] for r in out["results"]] == [3, 1]
+
+    calls.clear()
+    out = await search_service.search(None, "ana", mode="hybrid", top_k=5)
+    assert calls == ["lexical", "vector"]
+    assert out["results"][0]["id"] == 1                  # en ambas listas → primero
+    assert out["results"][0]["distancia"] == 0.2 and out["results"][0]["score"] > 0
+
+    with pytest.raises(ValueError):
+        await search_service.search(None, "ana", mode="fuzzy")
+    with pytest.raises(ValueError):
+        await search_service.search(None, "ana", scope="pagos")
+
+
+@pytest.mark.parametrize("scope,alias,cols", [
+    ("profesionales", "p", ("nombre", "bio")),
+    ("servicios", "s", ("nombre", "ubicacion_text")),
+    ("clientes", "c", ("nombre", "notas")),
+])
+def test_sql_lexico_usa_la_misma_expresion_que_el_indice_gin(scope, alias, cols):
+    sql = search_service.SCOPES[scope].lexical_sql
+    expr = tsv(*(f"{alias}.{c}" for c in cols))
+    assert f"{expr} @@ websearch_to_tsquery('spanish'::regconfig, :q)" in sql
+    index_exprs = [e for t, _, _, e in LEXICAL_INDEX_TARGETS if t == scope]
+    assert f"({tsv(*cols)})" in index_exprs             # el planner ignora el alias de tabla
+    assert f":q <% {alias}.nombre" in sql               # pg_trgm sobre el índice gin_trgm_ops
+
+
+@pytest.mark.asyncio
+async def test_busqueda_lexica_contra_postgres(monkeypatch):
+    def no_embed(q):
+        raise AssertionError("el fast path no debe embeber")
+
+    monkeypatch.setattr(search_service, "embed_text", no_embed)
+    await init_db()
+    async with SessionLocal() as s:
+        prof = Profesional(nombre="Zoe Ibarguren", telefono="5491110000091", bio="Kinesióloga deportiva",
+                           embedding=[0.0] * settings.EMBEDDING_DIM)
+        s.add(prof)
+        await s.commit()
+    try:
+        async with SessionLocal() as s:
+            out = await search_service.search(s, "zoe ibarguren", scope="profesionales")
+            assert out["fast_path"] and out["results"][0]["id"] == prof.id
+            out = await search_service.search(s, "kinesiologas", scope="profesionales", mode="lexical")
+            assert prof.id in [r["id"] for r in out["results"]]      # stemming 'spanish' vía tsvector
+    finally:
+        async with SessionLocal() as s:
+            await s.execute(delete(Profesional).where(Profesional.id == prof.id))
+            await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_vector_search_embebe_fuera_del_loop_y_pasa_por_admission(monkeypatch):
+    hilos = []
+
+    def embed(q):
+        hilos.append(threading.current_thread())
+        return [0.0] * settings.EMBEDDING_DIM
+
+    monkeypatch.setattr(search_service, "embed_text", embed)
+    await init_db()
+    before = admission.embedding.admitted
+    async with SessionLocal() as s:
+        await search_service.vector_search(s, "profesionales", "kinesiología", 3)
+    assert hilos and hilos[0] is not threading.main_thread()
+    assert admission.embedding.admitted == before + 1
+
+
+@pytest.mark.asyncio
+async def test_busqueda_saturada_responde_503(monkeypatch):
+    from app.main import app
+
+    async def saturada(*args, **kwargs):
+        raise Shed("embedding")
+
+    monkeypatch.setattr(search_service, "search", saturada)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        r = await ac.post("/semantic/search", json={"query": "kinesiología"})
+    assert r.status_code == 503 and r.headers["retry-after"] == "5"
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import select, delete, func
+
+from app.main import app
+from app.db import SessionLocal
+from app.models import ProfessionalInvite, Profesional
+from app.routers import whatsapp
+from app.sender_lock import KeyedLock
+from tests.test_e2e_alta_profesional import wa_payload
+
+TEST_PHONE = "5491110000099"
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_ordena_por_clave_y_paraleliza_entre_claves():
+    locks = KeyedLock()
+    trace: list[tuple[str, int]] = []
+
+    async def work(key: str, i: int):
+        async with locks.hold(key):
+            trace.append((key, i))
+            await asyncio.sleep(0.02)
+
+    t0 = asyncio.get_running_loop().time()
+    await asyncio.gather(*(work(k, i) for i in range(5) for k in ("a", "b", "c")))
+    elapsed = asyncio.get_running_loop().time() - t0
+
+    for k in ("a", "b", "c"):
+        assert [i for key, i in trace if key == k] == list(range(5))   # FIFO por remitente
+    assert elapsed < 0.02 * 5 * 3          # claves distintas corren en paralelo
+    assert len(locks) == 0                 # sin fugas de entradas
+
+
+@pytest_asyncio.fixture
+async def invite_record(monkeypatch):
+    async def no_llm(texto: str) -> dict:
+        await asyncio.sleep(0.01)   # simula latencia del LLM entre lectura y escritura
+        return {}
+    monkeypatch.setattr(whatsapp, "llm_parse_if_needed", no_llm)
+
+    async with SessionLocal() as s:
+        s.add(ProfessionalInvite(telefono=TEST_PHONE, consumed=False, partial_data={}, missing_fields=["nombre"]))
+        await s.commit()
+    yield
+    async with SessionLocal() as s:
+        await s.execute(delete(Profesional).where(Profesional.telefono == TEST_PHONE))
+        await s.execute(delete(ProfessionalInvite).where(ProfessionalInvite.telefono == TEST_PHONE))
+        await s.commit()
+
+
+@pytest.mark.asyncio
+async def test_sin_lost_updates_entre_workers(invite_record):
+    """Sesiones independientes (como workers distintos) sin el lock en proceso."""
+    msgs = [f"Email: user{i}@test.com" for i in range(10)] + ["Bio: Kinesióloga deportiva"]
+
+    async def worker(texto: str):
+        async with SessionLocal() as s:
+            return await whatsapp._procesar_mensaje(s, texto, TEST_PHONE)
+
+    results = await asyncio.gather(*(worker(m) for m in msgs))
+    assert all(r["status"] == "pending" for r in results)
+
+    async with SessionLocal() as s:
+        inv = (await s.execute(
+            select(ProfessionalInvite).where(ProfessionalInvite.telefono == TEST_PHONE)
+        )).scalar_one()
+    # la bio (único mensaje con ese campo) no se pierde aunque los 11 escriban a la vez
+    assert inv.partial_data.get("bio") == "Kinesióloga deportiva"
+    assert inv.partial_data.get("email", "").startswith("user")
+
+
+@pytest.mark.asyncio
+async def test_alta_concurrente_crea_un_solo_profesional(invite_record):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        posts = [
+            ac.post("/webhook/whatsapp", json=wa_payload(f"Nombre: [TEST] Dr. Concurrente {i}", TEST_PHONE))
+            for i in range(8)
+        ]
+        responses = await asyncio.gather(*posts)
+
+    bodies = [r.json() for r in responses]
+    assert sum("Registro exitoso" in b["reply"] for b in bodies) == 1
+    assert sum("Ya estás registrado" in b["reply"] for b in bodies) == 7
+
+    async with SessionLocal() as s:
+        n = await s.scalar(select(func.count()).select_from(Profesional).where(Profesional.telefono == TEST_PHONE))
+    assert n == 1
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete, select
+
+from app.db import SessionLocal, init_db
+from app.models import Message
+from app.whatsapp_sender import Recipient, SendResult, WhatsAppSender, _save_result, apply_status_updates, notify
+from tests.whatsapp_stub import create_stub_app
+
+
+def make_sender(stub, **kw) -> WhatsAppSender:
+    client = AsyncClient(transport=ASGITransport(app=stub), base_url="http://stub")
+    opts = dict(max_mps=1000, pair_interval_s=0.001, pair_burst=100, backoff_base_s=0.001)
+    opts.update(kw)
+    return WhatsAppSender(base_url="http://stub", phone_number_id="123", token="t", client=client, **opts)
+
+
+@pytest.mark.asyncio
+async def test_send_text_ok():
+    stub = create_stub_app()
+    sender = make_sender(stub)
+    res = await sender.send_text("5491100000001", "hola")
+    await sender.aclose()
+
+    assert res.ok and res.wa_message_id.startswith("wamid.stub.")
+    assert stub.state.sent[0][1]["text"]["body"] == "hola"
+
+
+@pytest.mark.asyncio
+async def test_send_text_reintenta_ante_5xx_y_429():
+    for status in (500, 429):
+        stub = create_stub_app(fail_first=2, fail_status=status)
+        sender = make_sender(stub)
+        res = await sender.send_text("5491100000001", "hola")
+        await sender.aclose()
+        assert res.ok
+        assert res.attempts == 3
+
+
+@pytest.mark.asyncio
+async def test_send_text_agota_reintentos():
+    stub = create_stub_app(fail_first=10)
+    sender = make_sender(stub, max_retries=2)
+    res = await sender.send_text("5491100000001", "hola")
+    await sender.aclose()
+    assert not res.ok and res.attempts == 3
+    assert "HTTP 500" in res.error
+
+
+@pytest.mark.asyncio
+async def test_pair_rate_limit_espacia_envios_al_mismo_destinatario():
+    stub = create_stub_app()
+    sender = make_sender(stub, pair_interval_s=0.05, pair_burst=1)
+    await sender.send_many(["5491100000001"] * 3, "hola")
+    await sender.aclose()
+
+    ts = [t for t, _ in stub.state.sent]
+    assert len(ts) == 3
+    assert all(b - a >= 0.04 for a, b in zip(ts, ts[1:]))
+
+
+@pytest.mark.asyncio
+async def test_fan_out_a_muchos_destinatarios():
+    stub = create_stub_app()
+    sender = make_sender(stub)
+    phones = [f"54911000{i:05d}" for i in range(200)]
+    results = await sender.send_many(phones, "La clase de hoy se cancela", concurrency=20)
+    await sender.aclose()
+
+    assert all(r.ok for r in results)
+    assert {p["to"] for _, p in stub.state.sent} == set(phones)
+
+
+# ---------------------------------------------------------------------------
+# notify / apply_status_updates contra Postgres
+# ---------------------------------------------------------------------------
+TELS = [f"54911100006{i:02d}" for i in range(3)]
+
+
+@pytest_asyncio.fixture
+async def mensajes():
+    await init_db()
+    yield
+    async with SessionLocal() as s:
+        await s.execute(delete(Message).where(Message.raw_sender.in_(TELS)))
+        await s.commit()
+
+
+async def _estado(tel: str) -> tuple:
+    async with SessionLocal() as s:
+        m = (await s.execute(select(Message).where(Message.raw_sender == tel))).scalar_one_or_none()
+        return (m.wa_message_id, m.delivery_status) if m else (None, None)
+
+
+class _SenderLento:
+    """Responde al instante salvo a TELS[-1], que espera a `liberar`."""
+
+    def __init__(self):
+        self.liberar = asyncio.Event()
+
+    async def send_text(self, to: str, body: str) -> SendResult:
+        if to == TELS[-1]:
+            await self.liberar.wait()
+        return SendResult(to=to, ok=to != TELS[1], wa_message_id=f"wamid.{to}", error=None if to != TELS[1] else "x")
+
+
+@pytest.mark.asyncio
+async def test_notify_persiste_cada_resultado_sin_esperar_al_lote(mensajes):
+    sender = _SenderLento()
+    async with SessionLocal() as s:
+        task = asyncio.create_task(notify(s, [Recipient(t) for t in TELS], "hola", sender=sender))
+        for _ in range(100):
+            if (await _estado(TELS[0]))[0]:
+                break
+            await asyncio.sleep(0.01)
+        # el lote sigue abierto, pero el webhook del primero ya encuentra su fila
+        assert not task.done()
+        assert await _estado(TELS[0]) == (f"wamid.{TELS[0]}", "sent")
+        async with SessionLocal() as s2:
+            assert await apply_status_updates(s2, [{"id": f"wamid.{TELS[0]}", "status": "delivered"}]) == 1
+        sender.liberar.set()
+        results = await task
+
+    assert [r.ok for r in results] == [True, False, True]
+    assert await _estado(TELS[0]) == (f"wamid.{TELS[0]}", "delivered")
+    assert (await _estado(TELS[1]))[1] == "failed"
+    assert await _estado(TELS[2]) == (f"wamid.{TELS[2]}", "sent")
+
+
+@pytest.mark.asyncio
+async def test_estado_no_retrocede(mensajes):
+    async with SessionLocal() as s:
+        m = Message(direction="OUT", raw_sender=TELS[0], text="hola", delivery_status="read")
+        s.add(m)
+        await s.commit()
+        # el resultado del envío llega después de un `read`: se guarda el wamid, no el estado
+        await _save_result(s, m.id, SendResult(to=TELS[0], ok=True, wa_message_id="wamid.x"))
+    assert await _estado(TELS[0]) == ("wamid.x", "read")
+
+    async with SessionLocal() as s:
+        await s.execute(delete(Message).where(Message.raw_sender == TELS[0]))
+        s.add(Message(direction="OUT", raw_sender=TELS[0], text="hola", wa_message_id="wamid.y",
+                      delivery_status="sent"))
+        await s.commit()
+        statuses = [
+            {"id": "wamid.y", "status": "read", "timestamp": "1760000000"},
+            {"id": "wamid.y", "status": "delivered"},          # desordenado: se ignora
+            {"id": "wamid.y", "status": "desconocido"},
+            {"id": "wamid.otro", "status": "read"},
+        ]
+        assert await apply_status_updates(s, statuses) == 1
+    assert await _estado(TELS[0]) == ("wamid.y", "read")
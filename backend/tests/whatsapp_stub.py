@@ -0,0 +1,55 @@
+"""
+Stub local de WhatsApp Cloud API para tests y benchmarks.
+
+En tests se usa en memoria vía httpx.ASGITransport; para benchmarks:
+    python -m tests.whatsapp_stub --port 8789 --latency-ms 50
+y WHATSAPP_API_BASE=http://localhost:8789
+"""
+import argparse
+import asyncio
+import itertools
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_stub_app(*, fail_first: int = 0, fail_status: int = 500, latency_ms: float = 0.0) -> FastAPI:
+    """
+    - fail_first: cantidad de requests iniciales que responden `fail_status`
+    - latency_ms: latencia artificial por request
+    Los mensajes aceptados quedan en `app.state.sent` como (timestamp, payload).
+    """
+    app = FastAPI()
+    app.state.sent = []
+    app.state.calls = 0
+    ids = itertools.count(1)
+
+    @app.post("/{phone_number_id}/messages")
+    async def messages(phone_number_id: str, request: Request):
+        app.state.calls += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if app.state.calls <= fail_first:
+            body = {"error": {"message": "stub failure", "code": 131000}}
+            if fail_status == 429:
+                body["error"]["code"] = 130429
+            return JSONResponse(body, status_code=fail_status)
+        payload = await request.json()
+        app.state.sent.append((asyncio.get_running_loop().time(), payload))
+        wamid = f"wamid.stub.{next(ids)}"
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": payload["to"], "wa_id": payload["to"]}],
+            "messages": [{"id": wamid}],
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8789)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(latency_ms=args.latency_ms), host="127.0.0.1", port=args.port)